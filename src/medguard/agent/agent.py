@@ -1,64 +1,100 @@
-import os
-from typing import List, Dict, Any
-from google import genai
-from google.genai import types
-from dotenv import load_dotenv
+import time
+from typing import Dict, List, Optional
 
-from medguard.agent.registry import registry
+from medguard.agent.backends import DEFAULT_MODEL, GeminiBackend, ModelBackend
+from medguard.agent.registry import (
+    DEFAULT_MAX_CONCURRENCY,
+    DEFAULT_TOOL_TIMEOUT,
+    ToolRegistry,
+    registry,
+)
 
+# registers the tools on the registry
 import medguard.agent.tools
 
-load_dotenv()
-
-tools = registry.tools_list
-
-client = genai.Client()
-tools = registry.tools_list
-config = types.GenerateContentConfig(tools=[tools])
-
-# user prompt
-contents = [
-    types.Content(
-        role="user",
-        parts=[types.Part(text="Get the quantity of MED_001 at FAC_001")],
-    )
-]
-# send request
-response = client.models.generate_content(
-    model="gemini-3-flash-preview",
-    contents=contents,
-    config=config,
-)
+MAX_TURNS = 10
 
-print(response.candidates[0].content.parts[0].function_call)
 
-# parse response
-tool_call = response.candidates[0].content.parts[0].function_call
+class Agent:
+    """
+    Tool-calling agent loop over a pluggable model backend.
 
-if tool_call.name == "query_inventory":
-    result = registry.execute(tool_call.name, dict(tool_call.args))
-    # print(result)
-    # {'facility_id': 'FAC_001', 'medication_id': 'MED_001', 'quantity': 471}
+    Defaults to Gemini; the SDK is only imported when the first request is
+    made, so importing this module is cheap and works offline. Pass a
+    ScriptedBackend to run the loop without a network.
+    """
 
-# create response back to user
-function_response_part = types.Part.from_function_response(
-    name=tool_call.name, response={"result": result}
-)
+    def __init__(
+        self,
+        model: str = DEFAULT_MODEL,
+        tool_registry: Optional[ToolRegistry] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        tool_timeout: float = DEFAULT_TOOL_TIMEOUT,
+        backend: Optional[ModelBackend] = None,
+    ):
+        self.backend = backend or GeminiBackend(model)
+        self.registry = tool_registry or registry
+        self.max_concurrency = max_concurrency
+        self.tool_timeout = tool_timeout
+        # per-turn timings of the last run, for benchmarking the loop itself
+        self.last_trace: List[Dict] = []
+
+    def run(self, prompt: str, max_turns: int = MAX_TURNS) -> str:
+        """
+        Send a prompt and answer tool calls until the model returns text.
+        All function calls of a turn run concurrently and their responses go
+        back to the model together in a single follow-up turn.
+        """
+        history = [{"role": "user", "text": prompt}]
+        self.last_trace = []
+
+        for _ in range(max_turns):
+            turn_start = time.perf_counter()
+            turn = self.backend.generate(history, self.registry)
+            model_seconds = time.perf_counter() - turn_start
+
+            if not turn["function_calls"]:
+                self.last_trace.append(
+                    {
+                        "model_seconds": model_seconds,
+                        "tools": [],
+                        "turn_seconds": time.perf_counter() - turn_start,
+                    }
+                )
+                return turn["text"]
+
+            timed_results = self.registry.execute_many(
+                [(call["name"], call["args"]) for call in turn["function_calls"]],
+                max_concurrency=self.max_concurrency,
+                timeout=self.tool_timeout,
+                with_timings=True,
+            )
+
+            history.append({"role": "model", "turn": turn})
+            history.append(
+                {
+                    "role": "tool",
+                    "results": [
+                        {"name": call["name"], "result": result}
+                        for call, (result, _) in zip(turn["function_calls"], timed_results)
+                    ],
+                }
+            )
+
+            self.last_trace.append(
+                {
+                    "model_seconds": model_seconds,
+                    "tools": [
+                        {"name": call["name"], "seconds": seconds}
+                        for call, (_, seconds) in zip(turn["function_calls"], timed_results)
+                    ],
+                    "turn_seconds": time.perf_counter() - turn_start,
+                }
+            )
+
+        raise RuntimeError(f"Agent did not finish within {max_turns} turns")
 
-# Append function call and result of the function execution to contents
-contents.append(
-    response.candidates[0].content
-)  # Append the content from the model's response.
-contents.append(
-    types.Content(role="user", parts=[function_response_part])
-)  # Append the function response
-
-client = genai.Client()
-final_response = client.models.generate_content(
-    model="gemini-3-flash-preview",
-    config=config,
-    contents=contents,
-)
 
-print(final_response.text)
-# The quantity of MED_001 at FAC_001 is 471.
+if __name__ == "__main__":
+    agent = Agent()
+    print(agent.run("Get the quantity of MED_001 at FAC_001"))
@@ -0,0 +1,138 @@
+"""
+Model backends for the agent loop.
+
+The agent keeps an SDK-neutral history and asks a backend for the next turn:
+
+    history entries:
+        {"role": "user", "text": "..."}
+        {"role": "model", "turn": <turn>}
+        {"role": "tool", "results": [{"name": ..., "result": ...}, ...]}
+
+    turn:
+        {"text": str | None, "function_calls": [{"name": ..., "args": {...}}], "raw": ...}
+
+GeminiBackend talks to the live API. ScriptedBackend replays scripted turns
+deterministically and needs no network, which makes the agent loop testable
+and benchmarkable on its own.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from medguard.agent.registry import ToolRegistry
+
+DEFAULT_MODEL = "gemini-3-flash-preview"
+
+
+class ModelBackend(ABC):
+    """Interface between the agent loop and a model."""
+
+    @abstractmethod
+    def generate(self, history: List[Dict], tool_registry: ToolRegistry) -> Dict:
+        """Return the model's next turn for the conversation so far."""
+
+
+class GeminiBackend(ModelBackend):
+    """
+    Gemini API backend. The SDK is imported and the client and config are
+    built on first use, so constructing it is cheap and works offline.
+    """
+
+    def __init__(self, model: str = DEFAULT_MODEL):
+        self.model = model
+        self._client = None
+        self._config = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from dotenv import load_dotenv
+            from google import genai
+
+            load_dotenv()
+            self._client = genai.Client()
+        return self._client
+
+    def _get_config(self, tool_registry: ToolRegistry):
+        if self._config is None:
+            from google.genai import types
+
+            self._config = types.GenerateContentConfig(tools=[tool_registry.tools_list])
+        return self._config
+
+    def _to_contents(self, history: List[Dict]) -> List:
+        from google.genai import types
+
+        contents = []
+        for entry in history:
+            if entry["role"] == "user":
+                contents.append(
+                    types.Content(role="user", parts=[types.Part(text=entry["text"])])
+                )
+            elif entry["role"] == "model":
+                # send back the model's own content untouched (keeps thought signatures)
+                contents.append(entry["turn"]["raw"])
+            else:
+                contents.append(
+                    types.Content(
+                        role="user",
+                        parts=[
+                            types.Part.from_function_response(
+                                name=item["name"], response={"result": item["result"]}
+                            )
+                            for item in entry["results"]
+                        ],
+                    )
+                )
+        return contents
+
+    def generate(self, history: List[Dict], tool_registry: ToolRegistry) -> Dict:
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=self._to_contents(history),
+            config=self._get_config(tool_registry),
+        )
+
+        model_content = response.candidates[0].content
+        function_calls = [
+            {"name": part.function_call.name, "args": dict(part.function_call.args or {})}
+            for part in model_content.parts or []
+            if part.function_call
+        ]
+        return {
+            "text": None if function_calls else response.text,
+            "function_calls": function_calls,
+            "raw": model_content,
+        }
+
+
+class ScriptedBackend(ModelBackend):
+    """
+    Offline stand-in that replays a fixed script of turns.
+
+    Each script entry is either {"function_calls": [{"name": ..., "args": {...}}]}
+    or {"text": "..."}. The n-th model turn of a conversation gets the n-th
+    entry, so one backend can serve any number of sessions.
+    """
+
+    def __init__(self, script: List[Dict], final_text: Optional[str] = "Done."):
+        self.script = script
+        self.final_text = final_text
+
+    def generate(self, history: List[Dict], tool_registry: ToolRegistry) -> Dict:
+        turn_index = sum(1 for entry in history if entry["role"] == "model")
+
+        if turn_index < len(self.script):
+            step = self.script[turn_index]
+        else:
+            step = {"text": self.final_text}
+
+        function_calls = [
+            {"name": call["name"], "args": dict(call.get("args", {}))}
+            for call in step.get("function_calls", [])
+        ]
+        return {
+            "text": None if function_calls else step.get("text"),
+            "function_calls": function_calls,
+            "raw": step,
+        }
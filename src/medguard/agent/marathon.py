@@ -0,0 +1,301 @@
+"""
+Long-running ("marathon") agent loop.
+
+Each cycle works out what changed since the previous one, lets the agent
+look at it if there is anything new, and writes an agent_snapshots row.
+The snapshot also stores how far it has read, so a restarted runner warm
+starts from the last snapshot instead of re-reading history, and a cycle
+only touches rows added or changed since the previous one:
+
+- new anomalies: anomalies.rowid > last_anomaly_rowid
+- resolved anomalies: anomaly_status_log (a trigger logs every is_active flip)
+- low stock / stockout: inventory_change_log (a trigger logs every insert,
+  quantity or reorder point change and delete of an inventory row). Each
+  entry carries the values before and after, so the counts only need
+  adjusting by the net status change of each inventory row touched this cycle.
+
+    python -m medguard.agent.marathon --interval-hours 4
+"""
+
+import argparse
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from medguard.db.database import (
+    from_json,
+    get_connection_to_db,
+    get_latest_snapshot,
+    insert_snapshot,
+)
+
+CYCLE_INTERVAL_HOURS = 4
+# new anomalies listed in the agent prompt; the rest are summarised by count
+MAX_PROMPT_ANOMALIES = 20
+
+
+def stock_status(quantity: Optional[int], reorder_point: Optional[int]) -> Optional[str]:
+    """Same rules as the LOW_STOCK / STOCKOUT events."""
+    if quantity is None:
+        return None
+    if quantity <= 0:
+        return "STOCKOUT"
+    if reorder_point is not None and quantity <= reorder_point:
+        return "LOW_STOCK"
+    return None
+
+
+class MarathonRunner:
+    def __init__(
+        self,
+        db_path: Optional[Path] = None,
+        agent=None,
+        interval_hours: float = CYCLE_INTERVAL_HOURS,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.db_path = db_path
+        self.agent = agent
+        self.interval_seconds = interval_hours * 3600
+        self.clock = clock
+
+        # incremental state, restored from the last snapshot on the first cycle
+        self.started = False
+        self.last_inventory_change_id = 0
+        self.last_anomaly_rowid = 0
+        self.last_status_change_id = 0
+        self.low_stock_count = 0
+        self.stockout_count = 0
+        self.active_anomaly_count = 0
+        self.critical_anomaly_ids = set()
+
+    def warm_start(self, conn: sqlite3.Connection) -> None:
+        snapshot = get_latest_snapshot(conn)
+        if snapshot is None or snapshot.get("last_inventory_change_id") is None:
+            self._cold_start(conn)
+        else:
+            self.last_inventory_change_id = snapshot["last_inventory_change_id"]
+            self.last_anomaly_rowid = snapshot["last_anomaly_rowid"]
+            self.last_status_change_id = snapshot["last_status_change_id"]
+            self.low_stock_count = snapshot["low_stock_count"]
+            self.stockout_count = snapshot["stockout_count"]
+            self.active_anomaly_count = snapshot["active_anomaly_count"]
+            self.critical_anomaly_ids = set(from_json(snapshot["critical_anomaly_ids"] or "[]"))
+        self.started = True
+
+    def _cold_start(self, conn: sqlite3.Connection) -> None:
+        """First run on a database: one full read to set the baseline."""
+        self.low_stock_count = self.stockout_count = 0
+        for row in conn.execute("SELECT quantity, reorder_point FROM inventory"):
+            status = stock_status(row["quantity"], row["reorder_point"])
+            if status == "LOW_STOCK":
+                self.low_stock_count += 1
+            elif status == "STOCKOUT":
+                self.stockout_count += 1
+
+        self.active_anomaly_count = conn.execute(
+            "SELECT COUNT(*) FROM anomalies WHERE is_active = 1"
+        ).fetchone()[0]
+        self.critical_anomaly_ids = {
+            row["anomaly_id"]
+            for row in conn.execute(
+                "SELECT anomaly_id FROM anomalies WHERE is_active = 1 AND severity = 'CRITICAL'"
+            )
+        }
+
+        self.last_inventory_change_id = (
+            conn.execute("SELECT MAX(change_id) FROM inventory_change_log").fetchone()[0] or 0
+        )
+        self.last_anomaly_rowid = conn.execute("SELECT MAX(rowid) FROM anomalies").fetchone()[0] or 0
+        self.last_status_change_id = (
+            conn.execute("SELECT MAX(change_id) FROM anomaly_status_log").fetchone()[0] or 0
+        )
+
+    def _apply_inventory_changes(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute(
+            """
+            SELECT change_id, inventory_id, was_quantity, quantity, was_reorder_point, reorder_point
+            FROM inventory_change_log
+            WHERE change_id > ?
+            ORDER BY change_id
+            """,
+            (self.last_inventory_change_id,),
+        )
+
+        # only the net change per inventory row matters: before its first change
+        # this cycle, after its last one
+        before: Dict[str, Optional[str]] = {}
+        after: Dict[str, Optional[str]] = {}
+        for row in rows:
+            self.last_inventory_change_id = row["change_id"]
+            inventory_id = row["inventory_id"]
+            if inventory_id not in before:
+                before[inventory_id] = stock_status(row["was_quantity"], row["was_reorder_point"])
+            after[inventory_id] = stock_status(row["quantity"], row["reorder_point"])
+
+        for inventory_id, old_status in before.items():
+            new_status = after[inventory_id]
+            if old_status == new_status:
+                continue
+            if old_status == "LOW_STOCK":
+                self.low_stock_count -= 1
+            elif old_status == "STOCKOUT":
+                self.stockout_count -= 1
+            if new_status == "LOW_STOCK":
+                self.low_stock_count += 1
+            elif new_status == "STOCKOUT":
+                self.stockout_count += 1
+
+    def _apply_anomalies(self, conn: sqlite3.Connection) -> Tuple[List[Dict], List[str]]:
+        previous_rowid = self.last_anomaly_rowid
+
+        new_anomalies = []
+        for row in conn.execute(
+            """
+            SELECT rowid, anomaly_id, anomaly_type, severity, facility_id, batch_id, details, is_active
+            FROM anomalies
+            WHERE rowid > ?
+            ORDER BY rowid
+            """,
+            (previous_rowid,),
+        ):
+            self.last_anomaly_rowid = row["rowid"]
+            new_anomalies.append(dict(row))
+            if row["is_active"]:
+                self.active_anomaly_count += 1
+                if row["severity"] == "CRITICAL":
+                    self.critical_anomaly_ids.add(row["anomaly_id"])
+
+        # net status flip per older anomaly; new ones were counted in their current state
+        flips: Dict[str, List] = {}
+        for row in conn.execute(
+            """
+            SELECT change_id, anomaly_rowid, anomaly_id, severity, was_active, is_active
+            FROM anomaly_status_log
+            WHERE change_id > ?
+            ORDER BY change_id
+            """,
+            (self.last_status_change_id,),
+        ):
+            self.last_status_change_id = row["change_id"]
+            if row["anomaly_rowid"] > previous_rowid:
+                continue
+            flip = flips.setdefault(row["anomaly_id"], [row["was_active"], None, None])
+            flip[1] = row["is_active"]
+            flip[2] = row["severity"]
+
+        resolved_ids = []
+        for anomaly_id, (was_active, is_active, severity) in flips.items():
+            if was_active and not is_active:
+                self.active_anomaly_count -= 1
+                self.critical_anomaly_ids.discard(anomaly_id)
+                resolved_ids.append(anomaly_id)
+            elif is_active and not was_active:
+                self.active_anomaly_count += 1
+                if severity == "CRITICAL":
+                    self.critical_anomaly_ids.add(anomaly_id)
+
+        return new_anomalies, resolved_ids
+
+    def _consult_agent(
+        self, new_anomalies: List[Dict], resolved_ids: List[str]
+    ) -> Tuple[List[Dict], Optional[str]]:
+        if self.agent is None or not new_anomalies:
+            return [], None
+
+        lines = [
+            f"Monitoring cycle update: {len(new_anomalies)} new anomalies, "
+            f"{len(resolved_ids)} resolved, {self.active_anomaly_count} active "
+            f"({len(self.critical_anomaly_ids)} critical). "
+            f"{self.low_stock_count} inventory items are low on stock and "
+            f"{self.stockout_count} are out of stock.",
+            "",
+            "New anomalies:",
+        ]
+        for anomaly in new_anomalies[:MAX_PROMPT_ANOMALIES]:
+            lines.append(
+                f"- {anomaly['anomaly_id']} {anomaly['anomaly_type']} ({anomaly['severity']}) "
+                f"facility={anomaly['facility_id']} batch={anomaly['batch_id']}: {anomaly['details']}"
+            )
+        if len(new_anomalies) > MAX_PROMPT_ANOMALIES:
+            lines.append(f"... and {len(new_anomalies) - MAX_PROMPT_ANOMALIES} more")
+        lines += ["", "Investigate the most serious ones and summarise what should be done."]
+
+        try:
+            summary = self.agent.run("\n".join(lines))
+        except Exception as e:
+            return [], f"Agent failed: {e}"
+
+        actions = [
+            {"tool": tool["name"]}
+            for turn in self.agent.last_trace
+            for tool in turn["tools"]
+        ]
+        return actions, summary
+
+    def run_cycle(self) -> Dict:
+        """Compute this cycle's delta, consult the agent and write a snapshot."""
+        conn = get_connection_to_db(self.db_path)
+        if not self.started:
+            self.warm_start(conn)
+
+        self._apply_inventory_changes(conn)
+        new_anomalies, resolved_ids = self._apply_anomalies(conn)
+        actions, summary = self._consult_agent(new_anomalies, resolved_ids)
+
+        critical_ids = sorted(self.critical_anomaly_ids)
+        snapshot = {
+            "snapshot_id": f"SNAP_{uuid.uuid4().hex[:10].upper()}",
+            "cycle_time": self.clock().isoformat(),
+            "low_stock_count": self.low_stock_count,
+            "stockout_count": self.stockout_count,
+            "active_anomaly_count": self.active_anomaly_count,
+            "critical_anomaly_count": len(critical_ids),
+            "critical_anomaly_ids": critical_ids,
+            "new_anomaly_ids": [a["anomaly_id"] for a in new_anomalies],
+            "resolved_anomaly_ids": resolved_ids,
+            "actions_taken": actions,
+            "reasoning_summary": summary,
+            "last_inventory_change_id": self.last_inventory_change_id,
+            "last_anomaly_rowid": self.last_anomaly_rowid,
+            "last_status_change_id": self.last_status_change_id,
+        }
+        insert_snapshot(snapshot, conn)
+        conn.close()
+        return snapshot
+
+    def run(self, max_cycles: Optional[int] = None) -> None:
+        """Run a cycle every interval until max_cycles (forever if None)."""
+        cycles = 0
+        while max_cycles is None or cycles < max_cycles:
+            started = time.monotonic()
+            snapshot = self.run_cycle()
+            cycles += 1
+            print(
+                f"[{snapshot['cycle_time']}] new={len(snapshot['new_anomaly_ids'])} "
+                f"resolved={len(snapshot['resolved_anomaly_ids'])} "
+                f"active={snapshot['active_anomaly_count']} "
+                f"low_stock={snapshot['low_stock_count']} stockout={snapshot['stockout_count']}"
+            )
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+            time.sleep(max(0.0, self.interval_seconds - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the agent on a schedule")
+    parser.add_argument("--interval-hours", type=float, default=CYCLE_INTERVAL_HOURS)
+    parser.add_argument("--cycles", type=int, default=None)
+    parser.add_argument("--db", type=Path, default=None)
+    parser.add_argument("--no-agent", action="store_true", help="only write snapshots")
+    args = parser.parse_args()
+
+    agent = None
+    if not args.no_agent:
+        from medguard.agent.agent import Agent
+
+        agent = Agent()
+
+    MarathonRunner(args.db, agent, args.interval_hours).run(args.cycles)
@@ -1,19 +1,56 @@
+import asyncio
+import copy
 import inspect
-from typing import Callable, Dict, Any, List
-from google.genai import types
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TOOL_TIMEOUT = 30.0  # seconds
+DEFAULT_CACHE_SIZE = 256  # cached tool results kept before LRU eviction
 
 
 class ToolRegistry:
-    def __init__(self):
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE):
         self._tools: Dict[str, Callable] = {}
-        self._declarations: List[types.FunctionDeclaration] = []
+        self._schemas: List[Dict[str, Any]] = []
+        # Gemini Tool object, built on first use so importing tools stays SDK-free
+        self._tool = None
+
+        # tool name -> data version function, for tools registered with cache=True
+        self._cached_tools: Dict[str, Optional[Callable]] = {}
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
-    def register(self, func: Callable):
+    def register(
+        self,
+        func: Optional[Callable] = None,
+        *,
+        cache: bool = False,
+        version: Optional[Callable] = None,
+    ):
         """
         Decorator to register a tool.
-        It automatically generates the Gemini FunctionDeclaration from the docstring and type hints.
+        It records the parameter schema from the docstring and type hints; the
+        Gemini FunctionDeclaration is generated from it when tools_list is first read.
+
+        Use as @registry.register, or @registry.register(cache=True, version=fn)
+        to memoize results. `version` is called with the tool's arguments and
+        returns a cheap data version (e.g. the movement change counter of a
+        batch); cached results are reused only while it is unchanged.
         """
+        if func is None:
+            return lambda f: self.register(f, cache=cache, version=version)
+
         self._tools[func.__name__] = func
+        if cache:
+            self._cached_tools[func.__name__] = version
 
         params = inspect.signature(func).parameters
         properties = {}
@@ -33,27 +70,145 @@ class ToolRegistry:
             if param.default == inspect.Parameter.empty:
                 required.append(name)
 
-        declaration = types.FunctionDeclaration(
-            name=func.__name__,
-            description=func.__doc__ or "No description provided",
-            parameters=types.Schema(
-                type="OBJECT", properties=properties, required=required
-            ),
+        self._schemas.append(
+            {
+                "name": func.__name__,
+                "description": func.__doc__ or "No description provided",
+                "properties": properties,
+                "required": required,
+            }
         )
-
-        self._declarations.append(declaration)
+        self._tool = None
         return func
 
     @property
-    def tools_list(self) -> types.Tool:
+    def tools_list(self):
         """Returns the Tool object formatted for Gemini"""
-        return types.Tool(function_declarations=self._declarations)
+        if self._tool is None:
+            from google.genai import types
+
+            declarations = [
+                types.FunctionDeclaration(
+                    name=schema["name"],
+                    description=schema["description"],
+                    parameters=types.Schema(
+                        type="OBJECT",
+                        properties=schema["properties"],
+                        required=schema["required"],
+                    ),
+                )
+                for schema in self._schemas
+            ]
+            self._tool = types.Tool(function_declarations=declarations)
+        return self._tool
 
     def execute(self, name: str, args: Dict[str, Any]) -> Any:
         """Executes the registered function safely"""
         if name not in self._tools:
             raise ValueError(f"Tool {name} not found")
-        return self._tools[name](**args)
+        if name not in self._cached_tools:
+            return self._tools[name](**args)
+
+        version = self._cached_tools[name]
+        key = (
+            name,
+            json.dumps(args, sort_keys=True, default=str),
+            version(**args) if version else None,
+        )
+
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                # a copy, so a caller editing its result can't change the next caller's
+                return copy.deepcopy(self._cache[key])
+            self.cache_misses += 1
+
+        result = self._tools[name](**args)
+
+        with self._cache_lock:
+            self._cache[key] = copy.deepcopy(result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return result
+
+    def clear_cache(self) -> None:
+        with self._cache_lock:
+            self._cache.clear()
+
+    async def _execute_async(
+        self,
+        name: str,
+        args: Dict[str, Any],
+        executor: ThreadPoolExecutor,
+        semaphore: asyncio.Semaphore,
+        timeout: float,
+    ) -> Any:
+        # the timeout only covers the tool itself, not waiting for a free slot
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(
+                    loop.run_in_executor(executor, self.execute, name, args), timeout
+                )
+            except asyncio.TimeoutError:
+                result = {"error": f"Tool {name} timed out after {timeout}s"}
+            except Exception as e:
+                result = {"error": f"Tool {name} failed: {e}"}
+            return result, time.perf_counter() - start
+
+    async def execute_many_async(
+        self,
+        calls: List[Tuple[str, Dict[str, Any]]],
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        timeout: float = DEFAULT_TOOL_TIMEOUT,
+        with_timings: bool = False,
+    ) -> List[Any]:
+        """
+        Run several (name, args) tool calls concurrently on a thread pool.
+        Results come back in call order; a failing or timed out call yields an
+        {"error": ...} dict instead of raising, so the others still complete.
+        With with_timings=True each item is a (result, seconds) tuple.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            timed_results = await asyncio.gather(
+                *(
+                    self._execute_async(name, args, executor, semaphore, timeout)
+                    for name, args in calls
+                )
+            )
+            if with_timings:
+                return timed_results
+            return [result for result, _ in timed_results]
+        finally:
+            # don't block on tools that timed out, their threads finish on their own
+            executor.shutdown(wait=False)
+
+    def execute_many(
+        self,
+        calls: List[Tuple[str, Dict[str, Any]]],
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        timeout: float = DEFAULT_TOOL_TIMEOUT,
+        with_timings: bool = False,
+    ) -> List[Any]:
+        """
+        Synchronous wrapper around execute_many_async. Called from inside a
+        running event loop (a notebook, an async server) asyncio.run would
+        fail, so the calls then run on a fresh loop in a helper thread; async
+        callers should await execute_many_async instead.
+        """
+        coro = self.execute_many_async(calls, max_concurrency, timeout, with_timings)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        with ThreadPoolExecutor(max_workers=1) as runner:
+            return runner.submit(asyncio.run, coro).result()
 
 
 registry = ToolRegistry()
@@ -7,31 +7,77 @@ TODO: IMPLEMENT TOOLS FOR PREDICTIVE REASONING
 - Predictive reordering
 """
 
-from typing import List, Dict
-from medguard.db.database import get_connection_to_db
+import threading
+from typing import List, Dict, Tuple
+from medguard.db import database
+from medguard.db.database import get_connection_to_db, query_incidents, set_batches_flagged
 from medguard.agent.registry import registry
+from medguard.detection.genealogy import GenealogyGraph
+from medguard.detection.reliability import ReliabilityScorer
+from medguard.transfers.recommender import TransferRecommender
 
 
-@registry.register
-def trace_batch_journey(batch_id: str) -> List[Dict]:
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def _batch_movements_version(batch_id: str, **_) -> Tuple[str, int]:
+    """
+    Change counter for a batch's movements, kept by triggers; bumped by inserts
+    and in-place upserts alike. Counters are per database, so the database path
+    is part of the version: after set_db_path, equal counts don't match.
+    """
+    conn = get_connection_to_db()
+    row = conn.execute(
+        "SELECT version FROM batch_movement_versions WHERE batch_id = ?", (batch_id,)
+    ).fetchone()
+    conn.close()
+    return str(database.path_to_db), row[0] if row else 0
+
+
+def _decode_cursor(cursor: str):
+    """Cursors are '<timestamp>|<sort key>' of the last entry on the previous page."""
+    if not cursor:
+        return None
+    timestamp, _, sort_key = cursor.partition("|")
+    return timestamp, sort_key
+
+
+def _page_size(page_size: int) -> int:
+    return max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+
+@registry.register(cache=True, version=_batch_movements_version)
+def trace_batch_journey(
+    batch_id: str, cursor: str = "", page_size: int = DEFAULT_PAGE_SIZE
+) -> Dict:
     """
-    Trace the complete movement history of a batch for counterfeit investigation.
+    Trace the movement history of a batch for counterfeit investigation.
     Shows where the batch has been and how it moved through the supply chain.
 
+    Every RESTOCK, TRANSFER and EXPIRY_WITHDRAW movement is listed in full.
+    Dispenses are summarised per facility and day (units dispensed, number
+    of dispenses, first and last time); use get_batch_dispenses to see the
+    individual dispenses of one facility and day. All dispenses of a facility
+    on one day go into one summary at the time of the first, even when other
+    movements there (e.g. a restock) fall between them.
+
     Use this tool when investigating anomalies to understand the full journey
     of a suspicious batch before making QUARANTINE or ESCALATE decisions.
 
     Args:
         batch_id: The batch ID to trace.
+        cursor: next_cursor from the previous page; leave empty for the first page.
+        page_size: Maximum number of entries to return.
 
     Returns:
-        Chronological list of all movements for this batch.
+        Chronological journey entries and next_cursor (empty on the last page).
     """
     conn = get_connection_to_db()
-    cursor = conn.cursor()
+    db_cursor = conn.cursor()
 
     # get batch details first
-    cursor.execute(
+    db_cursor.execute(
         """
         SELECT b.*, br.brand_name, m.name as manufacturer
         FROM batches b
@@ -41,28 +87,76 @@ def trace_batch_journey(batch_id: str) -> List[Dict]:
         """,
         (batch_id,),
     )
-    batch_info = cursor.fetchone()
+    batch_info = db_cursor.fetchone()
 
     if not batch_info:
         conn.close()
-        return [{"error": "Batch not found"}]
+        return {"error": "Batch not found"}
 
-    # get all movements
-    cursor.execute(
-        """
-        SELECT m.*, f.name as facility_name, f.city
-        FROM movements m
-        JOIN facilities f ON m.facility_id = f.facility_id
-        WHERE m.batch_id = ?
-        ORDER BY m.timestamp ASC
+    page_size = _page_size(page_size)
+    after = _decode_cursor(cursor)
+
+    # dispenses collapse to one row per facility and day inside SQLite; other
+    # movements pass through. Keyset pagination on (timestamp, sort_key) avoids
+    # an OFFSET, and the cursor is also pushed into both branches as a range on
+    # idx_movements_batch_time, so later pages don't re-aggregate earlier days.
+    # A dispense summary starts on its day, so whole days from the cursor's
+    # day on are kept and the outer keyset filter trims that first day.
+    db_cursor.execute(
+        f"""
+        WITH journey AS (
+            SELECT MIN(timestamp) AS timestamp,
+                   MAX(timestamp) AS last_timestamp,
+                   facility_id,
+                   'DISPENSE' AS movement_type,
+                   SUM(quantity_change) AS quantity_change,
+                   COUNT(*) AS movement_count,
+                   NULL AS reason,
+                   'D' || facility_id || date(timestamp) AS sort_key
+            FROM movements
+            WHERE batch_id = :batch_id AND movement_type = 'DISPENSE'
+              {"AND timestamp >= date(:after_time)" if after else ""}
+            GROUP BY facility_id, date(timestamp)
+
+            UNION ALL
+
+            SELECT timestamp, timestamp, facility_id, movement_type,
+                   quantity_change, 1, reason, 'M' || movement_id
+            FROM movements
+            WHERE batch_id = :batch_id AND movement_type != 'DISPENSE'
+              {"AND timestamp >= :after_time" if after else ""}
+        )
+        SELECT j.*,
+               f.name AS facility_name,
+               f.city,
+               (SELECT m.quantity_after FROM movements m
+                WHERE m.batch_id = :batch_id
+                  AND m.facility_id = j.facility_id
+                  AND m.timestamp = j.last_timestamp
+                  AND m.movement_type = j.movement_type
+                ORDER BY m.rowid DESC LIMIT 1) AS quantity_after
+        FROM journey j
+        LEFT JOIN facilities f ON j.facility_id = f.facility_id
+        {"WHERE (j.timestamp, j.sort_key) > (:after_time, :after_key)" if after else ""}
+        ORDER BY j.timestamp, j.sort_key
+        LIMIT :limit
         """,
-        (batch_id,),
+        {
+            "batch_id": batch_id,
+            "after_time": after[0] if after else None,
+            "after_key": after[1] if after else None,
+            "limit": page_size + 1,
+        },
     )
-    movements = cursor.fetchall()
+    rows = db_cursor.fetchall()
     conn.close()
 
-    journey = [
-        {
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    entries = []
+    for row in rows:
+        entry = {
             "timestamp": row["timestamp"],
             "facility_id": row["facility_id"],
             "facility_name": row["facility_name"],
@@ -70,9 +164,238 @@ def trace_batch_journey(batch_id: str) -> List[Dict]:
             "movement_type": row["movement_type"],
             "quantity_change": row["quantity_change"],
             "quantity_after": row["quantity_after"],
-            "reason": row["reason"],
         }
-        for row in movements
-    ]
+        if row["movement_type"] == "DISPENSE":
+            entry["dispense_count"] = row["movement_count"]
+            entry["last_timestamp"] = row["last_timestamp"]
+        else:
+            entry["reason"] = row["reason"]
+        entries.append(entry)
+
+    last = rows[-1] if rows else None
+    return {
+        "batch_id": batch_id,
+        "entries": entries,
+        "next_cursor": f"{last['timestamp']}|{last['sort_key']}" if has_more else "",
+    }
+
+
+@registry.register(cache=True, version=_batch_movements_version)
+def get_batch_dispenses(
+    batch_id: str,
+    facility_id: str,
+    day: str,
+    cursor: str = "",
+    page_size: int = DEFAULT_PAGE_SIZE,
+) -> Dict:
+    """
+    List the individual dispenses of a batch at one facility on one day.
+    Use this to drill into a dispense summary from trace_batch_journey.
+
+    Args:
+        batch_id: The batch ID.
+        facility_id: The facility that dispensed.
+        day: The day, as YYYY-MM-DD.
+        cursor: next_cursor from the previous page; leave empty for the first page.
+        page_size: Maximum number of dispenses to return.
+
+    Returns:
+        Dispenses in time order and next_cursor (empty on the last page).
+    """
+    page_size = _page_size(page_size)
+    after = _decode_cursor(cursor)
+
+    conn = get_connection_to_db()
+    rows = conn.execute(
+        f"""
+        SELECT movement_id, timestamp, quantity_change, quantity_after, reason
+        FROM movements
+        WHERE batch_id = :batch_id
+          AND facility_id = :facility_id
+          AND movement_type = 'DISPENSE'
+          AND timestamp >= :day AND timestamp < date(:day, '+1 day')
+          {"AND (timestamp, movement_id) > (:after_time, :after_key)" if after else ""}
+        ORDER BY timestamp, movement_id
+        LIMIT :limit
+        """,
+        {
+            "batch_id": batch_id,
+            "facility_id": facility_id,
+            "day": day,
+            "after_time": after[0] if after else None,
+            "after_key": after[1] if after else None,
+            "limit": page_size + 1,
+        },
+    ).fetchall()
+    conn.close()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    last = rows[-1] if rows else None
+
+    return {
+        "batch_id": batch_id,
+        "facility_id": facility_id,
+        "day": day,
+        "dispenses": [dict(row) for row in rows],
+        "next_cursor": f"{last['timestamp']}|{last['movement_id']}" if has_more else "",
+    }
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+_reliability = ReliabilityScorer()
+
+
+def _get_recommender() -> TransferRecommender:
+    """Build the transfer indexes once, then only apply inventory changes stored since the last call."""
+    global _recommender
+    with _recommender_lock:
+        conn = get_connection_to_db()
+        # one row per facility and anomaly type, cheap to reload
+        _reliability.load(conn)
+        if _recommender is None:
+            _recommender = TransferRecommender.from_db(conn, reliability=_reliability.score)
+        else:
+            _recommender.sync(conn)
+        conn.close()
+        return _recommender
+
+
+@registry.register
+def recommend_transfer_sources(
+    facility_id: str, med_id: str, quantity: int, max_results: int = 5
+) -> List[Dict]:
+    """
+    Find the best facilities to transfer a medication from when a facility runs low.
+    Only facilities with unexpired stock (and cold storage for cold chain
+    medications) are returned, ranked by distance, expiry proximity, how much
+    of the request they can cover, and reliability.
+
+    Use this tool when a pharmacist asks for units of a medication their
+    facility does not have, e.g. "I need 30 units of paracetamol".
+
+    Args:
+        facility_id: The requesting facility.
+        med_id: The medication needed.
+        quantity: Units needed.
+        max_results: Maximum number of source facilities to return.
+
+    Returns:
+        Source facilities with distance, available quantity, batches and score.
+    """
+    recommender = _get_recommender()
+    with _recommender_lock:
+        return recommender.recommend(facility_id, med_id, quantity, k=max_results)
+
+
+@registry.register
+def get_incidents(
+    escalation_level: str = "", batch_id: str = "", anomaly_id: str = "", max_results: int = 10
+) -> List[Dict]:
+    """
+    List open incidents: groups of correlated anomalies sharing a batch, batch
+    number, importer, brand or facility. Each incident has an escalation level:
+    FLAG_FOR_REVIEW (single anomaly), POTENTIAL_COUNTERFEIT_INCIDENT (several
+    correlated anomalies) or SUPPLY_CHAIN_COMPROMISE (correlated across sites).
+
+    Use this tool to see whether an anomaly is part of a bigger incident before
+    deciding how far to escalate it.
+
+    Args:
+        escalation_level: Only incidents at this level (optional).
+        batch_id: Only incidents involving this batch (optional).
+        anomaly_id: Only the incident containing this anomaly (optional).
+        max_results: Maximum number of incidents to return.
+
+    Returns:
+        Incidents, most escalated first, with their anomalies, facilities and batches.
+    """
+    conn = get_connection_to_db()
+    incidents = query_incidents(
+        conn,
+        escalation_level=escalation_level or None,
+        batch_id=batch_id or None,
+        anomaly_id=anomaly_id or None,
+        limit=max_results,
+    )
+    conn.close()
+    return incidents
+
+
+@registry.register
+def flag_batch(batch_id: str, flagged: bool = True) -> Dict:
+    """
+    Flag a batch as suspect (or clear the flag). Point-of-sale verification
+    reports packs from a flagged batch as SUSPECT.
+
+    Use this tool once an investigation concludes a batch should be
+    QUARANTINED, or to clear the flag after it has been ruled out.
+
+    Args:
+        batch_id: The batch to flag.
+        flagged: True to flag the batch, False to clear the flag.
+
+    Returns:
+        The batch id and its flag after the change.
+    """
+    conn = get_connection_to_db()
+    if conn.execute("SELECT 1 FROM batches WHERE batch_id = ?", (batch_id,)).fetchone() is None:
+        conn.close()
+        return {"error": "Batch not found"}
+    set_batches_flagged([batch_id], flagged, conn)
+    conn.close()
+    return {"batch_id": batch_id, "is_flagged": bool(flagged)}
+
+
+_genealogy = None
+_genealogy_lock = threading.Lock()
+
+
+def _get_genealogy() -> GenealogyGraph:
+    """Build the genealogy graph once, then only add batches and movements stored since."""
+    global _genealogy
+    with _genealogy_lock:
+        conn = get_connection_to_db()
+        if _genealogy is None:
+            _genealogy = GenealogyGraph.from_db(conn)
+        else:
+            _genealogy.sync(conn)
+        conn.close()
+        return _genealogy
+
+
+@registry.register
+def get_batch_exposure(
+    batch_id: str,
+    include_same_batch_number: bool = True,
+    include_same_importer: bool = False,
+    max_hops: int = 1,
+) -> Dict:
+    """
+    Find everywhere a batch, and optionally batches related to it, has been.
+    Related batches share a batch number (a possible clone) or an importer.
+
+    Use this tool to size a counterfeit incident: which other facilities may
+    hold the same suspicious stock and should be warned or checked.
+
+    Args:
+        batch_id: The suspicious batch.
+        include_same_batch_number: Also follow batches with the same batch number.
+        include_same_importer: Also follow batches from the same importer.
+        max_hops: How many batch-to-batch steps to follow (1 or 2).
+
+    Returns:
+        Related batches and each facility reached with first/last seen times.
+    """
+    via = []
+    if include_same_batch_number:
+        via.append("batch_number")
+    if include_same_importer:
+        via.append("importer")
 
-    return journey
+    graph = _get_genealogy()
+    with _genealogy_lock:
+        if ("batch", batch_id) not in graph.node_ids:
+            return {"error": "Batch not found"}
+        return graph.exposure(batch_id, via=tuple(via), max_hops=max(1, min(int(max_hops), 2)))
@@ -0,0 +1,153 @@
+"""
+Triage between anomaly detection and the agent.
+
+One incident usually produces several anomaly records (an injected
+impossible quantity shows up as IMPOSSIBLE_QUANTITY and GHOST_STOCK on the
+same batch), so investigating record by record would spend a model session
+on each. Anomalies that share a batch_id or a facility are coalesced into
+one investigation, investigations are ranked by severity and by how
+unreliable the facilities involved already are, and only
+`budget_per_cycle` of them go to the model each cycle. The rest stay queued
+and keep absorbing related anomalies until their turn comes.
+"""
+
+import heapq
+import itertools
+from typing import Callable, Dict, List, Optional
+
+from medguard.detection.reliability import SEVERITY_WEIGHTS, anomaly_facilities
+
+DEFAULT_LLM_BUDGET = 3
+# anomalies listed in an investigation prompt; the rest are summarised by count
+MAX_PROMPT_ANOMALIES = 15
+
+
+class Investigation:
+    """A group of related anomalies, investigated in one agent session."""
+
+    def __init__(self, investigation_id: str):
+        self.investigation_id = investigation_id
+        self.anomalies: List[Dict] = []
+        self.batch_ids = set()
+        self.facility_ids = set()
+        self.version = 0  # heap entries with an older version are stale
+
+    def keys(self):
+        return [("batch", b) for b in self.batch_ids] + [("facility", f) for f in self.facility_ids]
+
+    def summary(self) -> Dict:
+        return {
+            "investigation_id": self.investigation_id,
+            "anomaly_ids": [a["anomaly_id"] for a in self.anomalies],
+            "anomaly_types": sorted({a["anomaly_type"] for a in self.anomalies}),
+            "batch_ids": sorted(self.batch_ids),
+            "facility_ids": sorted(self.facility_ids),
+        }
+
+
+def _anomaly_keys(anomaly: Dict) -> List[tuple]:
+    keys = [("facility", f) for f in anomaly_facilities(anomaly)]
+    if anomaly.get("batch_id"):
+        keys.append(("batch", anomaly["batch_id"]))
+    return keys
+
+
+class TriageQueue:
+    def __init__(
+        self,
+        budget_per_cycle: int = DEFAULT_LLM_BUDGET,
+        reliability: Optional[Callable[[str], float]] = None,
+    ):
+        self.budget_per_cycle = budget_per_cycle
+        self.reliability = reliability or (lambda facility_id: 1.0)
+        self._heap = []
+        self._by_key: Dict[tuple, Investigation] = {}
+        self._pending: Dict[str, Investigation] = {}
+        self._ids = itertools.count(1)
+        self._entries = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def priority(self, investigation: Investigation) -> tuple:
+        """Worst severity first, then total severity scaled up by facility unreliability."""
+        weights = [SEVERITY_WEIGHTS.get(a.get("severity"), 1.0) for a in investigation.anomalies]
+        least_reliable = min(
+            (self.reliability(f) for f in investigation.facility_ids), default=1.0
+        )
+        return max(weights), sum(weights) * (2 - least_reliable)
+
+    def _merge(self, keep: Investigation, other: Investigation) -> None:
+        keep.anomalies.extend(other.anomalies)
+        keep.batch_ids |= other.batch_ids
+        keep.facility_ids |= other.facility_ids
+        for key in other.keys():
+            self._by_key[key] = keep
+        del self._pending[other.investigation_id]
+
+    def push(self, anomalies: List[Dict]) -> None:
+        """Coalesce new anomalies into pending investigations."""
+        touched = {}
+        for anomaly in anomalies:
+            keys = _anomaly_keys(anomaly)
+            found = {id(inv): inv for inv in (self._by_key.get(k) for k in keys) if inv}
+
+            if found:
+                # fold the smaller investigations into the largest one
+                groups = sorted(found.values(), key=lambda inv: len(inv.anomalies), reverse=True)
+                investigation = groups[0]
+                for other in groups[1:]:
+                    self._merge(investigation, other)
+                    touched.pop(other.investigation_id, None)
+            else:
+                investigation = Investigation(f"INV_{next(self._ids):05d}")
+                self._pending[investigation.investigation_id] = investigation
+
+            investigation.anomalies.append(anomaly)
+            for kind, value in keys:
+                (investigation.batch_ids if kind == "batch" else investigation.facility_ids).add(value)
+                self._by_key[(kind, value)] = investigation
+            touched[investigation.investigation_id] = investigation
+
+        # re-rank changed investigations; their old heap entries go stale
+        for investigation in touched.values():
+            investigation.version = next(self._entries)
+            major, minor = self.priority(investigation)
+            heapq.heappush(self._heap, (-major, -minor, investigation.version, investigation))
+
+    def next_cycle(self, budget: Optional[int] = None) -> List[Investigation]:
+        """Pop the highest priority investigations this cycle can afford."""
+        budget = self.budget_per_cycle if budget is None else budget
+        selected = []
+        while self._heap and len(selected) < budget:
+            _, _, version, investigation = heapq.heappop(self._heap)
+            if version != investigation.version or investigation.investigation_id not in self._pending:
+                continue
+            del self._pending[investigation.investigation_id]
+            for key in investigation.keys():
+                if self._by_key.get(key) is investigation:
+                    del self._by_key[key]
+            selected.append(investigation)
+        return selected
+
+
+def investigation_prompt(investigation: Investigation) -> str:
+    lines = [
+        f"Investigate {len(investigation.anomalies)} related anomalies "
+        f"involving batches {', '.join(sorted(investigation.batch_ids)) or 'none'} "
+        f"at facilities {', '.join(sorted(investigation.facility_ids)) or 'none'}.",
+        "",
+    ]
+    for anomaly in investigation.anomalies[:MAX_PROMPT_ANOMALIES]:
+        lines.append(
+            f"- {anomaly['anomaly_type']} ({anomaly.get('severity')}): {anomaly.get('details')}"
+        )
+    if len(investigation.anomalies) > MAX_PROMPT_ANOMALIES:
+        lines.append(f"... and {len(investigation.anomalies) - MAX_PROMPT_ANOMALIES} more")
+    lines += [
+        "",
+        "Trace the batches involved, decide whether this is one incident, and "
+        "recommend QUARANTINE (flag_batch the batches), ESCALATE or MONITOR "
+        "with a short reason.",
+    ]
+    return "\n".join(lines)
@@ -104,6 +104,12 @@ def expiry_withdraw(inventory, quantity, timestamp, source="UNKNOWN"):
     )
 
 
+def new_movement_id() -> str:
+    # 48 random bits: a 6-digit id collides within a few thousand movements,
+    # and a stored movement with a reused id would be overwritten
+    return f"MOV_{random.getrandbits(48):012X}"
+
+
 def _record_movement(
     inventory,
     movement_type,
@@ -127,7 +133,7 @@ def _record_movement(
     new_quantity = max(0, previous_quantity + quantity_change)
 
     movement = {
-        "movement_id": f"MOV_{random.randint(100000, 999999)}",
+        "movement_id": new_movement_id(),
         "inventory_id": inventory["inventory_id"],
         "facility_id": inventory["facility_id"],
         "batch_id": inventory["batch_id"],
@@ -0,0 +1,118 @@
+# major road network: city nodes and typical truck travel times between them
+# (city, state, latitude, longitude)
+
+road_nodes = [
+    ("Lagos", "Lagos", 6.5244, 3.3792),
+    ("Abeokuta", "Ogun", 7.1557, 3.3451),
+    ("Ijebu-Ode", "Ogun", 6.8194, 3.9173),
+    ("Ibadan", "Oyo", 7.3775, 3.9470),
+    ("Oyo", "Oyo", 7.8526, 3.9312),
+    ("Ogbomoso", "Oyo", 8.1335, 4.2407),
+    ("Ilorin", "Kwara", 8.4966, 4.5421),
+    ("Jebba", "Kwara", 9.1331, 4.8237),
+    ("Mokwa", "Niger", 9.2950, 5.0541),
+    ("Bida", "Niger", 9.0804, 6.0101),
+    ("Minna", "Niger", 9.6139, 6.5569),
+    ("Akure", "Ondo", 7.2571, 5.2058),
+    ("Ore", "Ondo", 6.7500, 4.8667),
+    ("Benin City", "Edo", 6.3350, 5.6037),
+    ("Sapele", "Delta", 5.8941, 5.6767),
+    ("Warri", "Delta", 5.5167, 5.7500),
+    ("Ughelli", "Delta", 5.4896, 6.0033),
+    ("Asaba", "Delta", 6.1980, 6.7319),
+    ("Onitsha", "Anambra", 6.1498, 6.7857),
+    ("Owerri", "Imo", 5.4836, 7.0333),
+    ("Port Harcourt", "Rivers", 4.8156, 7.0498),
+    ("Aba", "Abia", 5.1066, 7.3667),
+    ("Umuahia", "Abia", 5.5320, 7.4860),
+    ("Uyo", "Akwa Ibom", 5.0377, 7.9128),
+    ("Calabar", "Cross River", 4.9757, 8.3417),
+    ("Enugu", "Enugu", 6.4584, 7.5464),
+    ("Abakaliki", "Ebonyi", 6.3249, 8.1137),
+    ("Lokoja", "Kogi", 7.8023, 6.7333),
+    ("Makurdi", "Benue", 7.7322, 8.5391),
+    ("Lafia", "Nasarawa", 8.4939, 8.5153),
+    ("Keffi", "Nasarawa", 8.8486, 7.8736),
+    ("Abuja", "FCT", 9.0579, 7.4951),
+    ("Gwagwalada", "FCT", 8.9433, 7.0803),
+    ("Kaduna", "Kaduna", 10.5105, 7.4165),
+    ("Zaria", "Kaduna", 11.0855, 7.7199),
+    ("Kafanchan", "Kaduna", 9.5833, 8.3000),
+    ("Jos", "Plateau", 9.8965, 8.8583),
+    ("Kano", "Kano", 12.0022, 8.5920),
+    ("Katsina", "Katsina", 12.9908, 7.6018),
+    ("Gusau", "Zamfara", 12.1628, 6.6614),
+    ("Sokoto", "Sokoto", 13.0059, 5.2476),
+    ("Bauchi", "Bauchi", 10.3158, 9.8442),
+    ("Gombe", "Gombe", 10.2897, 11.1673),
+    ("Potiskum", "Yobe", 11.7128, 11.0780),
+    ("Damaturu", "Yobe", 11.7470, 11.9608),
+    ("Maiduguri", "Borno", 11.8311, 13.1510),
+    ("Yola", "Adamawa", 9.2035, 12.4954),
+]
+
+# (city, city, hours)
+road_edges = [
+    ("Lagos", "Abeokuta", 1.5),
+    ("Lagos", "Ibadan", 2.0),
+    ("Lagos", "Ijebu-Ode", 1.5),
+    ("Abeokuta", "Ibadan", 1.5),
+    ("Ijebu-Ode", "Ibadan", 1.2),
+    ("Ijebu-Ode", "Ore", 2.0),
+    ("Ibadan", "Oyo", 1.0),
+    ("Ibadan", "Akure", 3.0),
+    ("Oyo", "Ogbomoso", 1.0),
+    ("Ogbomoso", "Ilorin", 1.0),
+    ("Ilorin", "Jebba", 1.5),
+    ("Jebba", "Mokwa", 0.7),
+    ("Mokwa", "Bida", 1.5),
+    ("Bida", "Minna", 1.5),
+    ("Minna", "Abuja", 2.0),
+    ("Minna", "Kaduna", 3.0),
+    ("Akure", "Ore", 1.5),
+    ("Akure", "Lokoja", 4.0),
+    ("Ore", "Benin City", 2.0),
+    ("Benin City", "Sapele", 1.0),
+    ("Benin City", "Asaba", 2.0),
+    ("Benin City", "Lokoja", 4.0),
+    ("Sapele", "Warri", 0.8),
+    ("Warri", "Ughelli", 0.5),
+    ("Ughelli", "Port Harcourt", 3.5),
+    ("Asaba", "Onitsha", 0.3),
+    ("Onitsha", "Owerri", 1.5),
+    ("Onitsha", "Enugu", 1.8),
+    ("Owerri", "Port Harcourt", 1.5),
+    ("Owerri", "Umuahia", 1.0),
+    ("Umuahia", "Aba", 0.8),
+    ("Umuahia", "Enugu", 1.7),
+    ("Aba", "Port Harcourt", 1.0),
+    ("Aba", "Uyo", 1.2),
+    ("Uyo", "Calabar", 1.5),
+    ("Enugu", "Abakaliki", 1.3),
+    ("Enugu", "Makurdi", 4.0),
+    ("Abakaliki", "Calabar", 4.0),
+    ("Makurdi", "Lafia", 2.0),
+    ("Lafia", "Keffi", 2.0),
+    ("Lafia", "Jos", 3.5),
+    ("Keffi", "Abuja", 1.0),
+    ("Lokoja", "Abuja", 3.0),
+    ("Lokoja", "Gwagwalada", 2.7),
+    ("Gwagwalada", "Abuja", 0.6),
+    ("Abuja", "Kaduna", 2.5),
+    ("Kaduna", "Zaria", 1.0),
+    ("Kaduna", "Kafanchan", 2.5),
+    ("Kafanchan", "Jos", 1.7),
+    ("Zaria", "Kano", 1.8),
+    ("Zaria", "Gusau", 3.0),
+    ("Gusau", "Sokoto", 3.0),
+    ("Kano", "Katsina", 2.5),
+    ("Kano", "Bauchi", 4.5),
+    ("Kano", "Potiskum", 4.5),
+    ("Jos", "Bauchi", 2.0),
+    ("Bauchi", "Gombe", 2.3),
+    ("Gombe", "Potiskum", 2.5),
+    ("Gombe", "Yola", 4.0),
+    ("Potiskum", "Damaturu", 1.3),
+    ("Damaturu", "Maiduguri", 1.8),
+    ("Yola", "Maiduguri", 6.5),
+]
@@ -1,7 +1,12 @@
 import json
 import sqlite3
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any
+
+try:
+    import orjson
+except ImportError:  # optional speedup, stdlib json is the fallback
+    orjson = None
 
 # path_to_db = Path(__file__).parent / "medguard.db"
 # path_to_schema = Path(__file__).parent / "schema.sql"
@@ -17,6 +22,36 @@ path_to_schema = BASE_DIR / "schema.sql"
 # cur = conn.cursor()
 
 
+def to_json(payload: Any) -> Optional[str]:
+    """
+    Serialize an events.data / anomalies.evidence payload for storage.
+    Strings are assumed to be JSON already and pass through unchanged.
+    """
+    if payload is None or isinstance(payload, str):
+        return payload
+    if orjson is not None:
+        return orjson.dumps(payload, default=str).decode()
+    return json.dumps(payload, separators=(",", ":"), default=str)
+
+
+def from_json(text: Optional[str]) -> Any:
+    if text is None:
+        return None
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def set_db_path(db_path: Path) -> Path:
+    """
+    Point connections opened without an explicit path (e.g. agent tools) at
+    another database. Returns the previous path, so it can be restored.
+    """
+    global path_to_db
+    previous, path_to_db = path_to_db, Path(db_path)
+    return previous
+
+
 def get_connection_to_db(db_path: Optional[Path] = None) -> sqlite3.Connection:
     path = db_path or path_to_db
     conn = sqlite3.connect(path)
@@ -25,23 +60,109 @@ def get_connection_to_db(db_path: Optional[Path] = None) -> sqlite3.Connection:
     return conn
 
 
+# columns added to tables after their first release; CREATE TABLE IF NOT EXISTS
+# leaves an existing table alone, so these are added by hand before the schema
+# (and its indexes on them) runs. Definitions match schema.sql.
+ADDED_COLUMNS = {
+    "movements": {
+        "transfer_id": "TEXT",
+        "source_facility_id": "TEXT",
+        "destination_facility_id": "TEXT",
+    },
+    "events": {
+        "days_to_expiry": "INTEGER GENERATED ALWAYS AS ("
+        "CASE WHEN json_valid(data) THEN json_extract(data, '$.days_to_expiry') END) VIRTUAL",
+    },
+    "anomalies": {
+        "distance_km": "REAL GENERATED ALWAYS AS ("
+        "CASE WHEN json_valid(evidence) THEN json_extract(evidence, '$.distance_km') END) VIRTUAL",
+        "hours_between": "REAL GENERATED ALWAYS AS ("
+        "CASE WHEN json_valid(evidence) THEN json_extract(evidence, '$.hours_between') END) VIRTUAL",
+        "price_ratio": "REAL GENERATED ALWAYS AS ("
+        "CASE WHEN json_valid(evidence) THEN json_extract(evidence, '$.price_ratio') END) VIRTUAL",
+    },
+    "agent_snapshots": {
+        "last_inventory_change_id": "INTEGER",
+        "last_anomaly_rowid": "INTEGER",
+        "last_status_change_id": "INTEGER",
+    },
+}
+
+
+def migrate_columns(conn: sqlite3.Connection) -> List[str]:
+    """Add any ADDED_COLUMNS missing from existing tables. Returns the columns added."""
+    added = []
+    for table, columns in ADDED_COLUMNS.items():
+        # table_xinfo, unlike table_info, lists generated columns too
+        existing = {row["name"] for row in conn.execute(f"PRAGMA table_xinfo({table})")}
+        if not existing:
+            continue  # new database: the schema creates the table whole
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+                added.append(f"{table}.{name}")
+    conn.commit()
+    return added
+
+
 def init_database(db_path: Optional[Path] = None) -> None:
     conn = get_connection_to_db(db_path)
+    migrate_columns(conn)
     with open(path_to_schema) as f:
         conn.executescript(f.read())
     conn.commit()
+    backfill_stock_ledger(conn)
     conn.close()
 
 
+def backfill_stock_ledger(conn: sqlite3.Connection, chunk_size: int = 50000) -> int:
+    """
+    Build stock_ledger_daily from movements stored before the ledger existed.
+    Only runs while the ledger is empty, so it happens once per database.
+    Returns the number of movements folded in.
+    """
+    if conn.execute("SELECT 1 FROM stock_ledger_daily LIMIT 1").fetchone() is not None:
+        return 0
+
+    cursor = conn.execute(
+        """
+        SELECT facility_id, batch_id, movement_type, quantity_before,
+               quantity_change, quantity_after, timestamp
+        FROM movements
+        ORDER BY timestamp
+        """
+    )
+    count = 0
+    with conn:
+        while True:
+            chunk = [dict(row) for row in cursor.fetchmany(chunk_size)]
+            if not chunk:
+                break
+            update_stock_ledger(chunk, conn)
+            count += len(chunk)
+    return count
+
+
 def clear_database(db_path: Optional[Path] = None) -> None:
     """Clear all data (keeps schema)."""
     conn = get_connection_to_db(db_path)
-    # list tables in order of no dependency to dependency order
+    # list tables in order of no dependency to dependency order;
+    # batch_movement_versions stays, a version must never repeat
     tables = [
+        "incidents",
+        "agent_snapshots",
+        "anomaly_status_log",
+        "batch_flag_log",
+        "batch_change_log",
+        "facility_scores",
+        "inventory_checkpoint_items",
+        "inventory_checkpoints",
+        "stock_ledger_daily",
         "anomalies",
         "events",
         "movements",
         "inventory",
+        "inventory_change_log",  # after inventory: its delete trigger logs rows
         "batches",
         "brands",
         "facilities",
@@ -59,7 +180,7 @@ def insert_medications(medications: List[Dict], conn: sqlite3.Connection) -> Non
         return
 
     sql = """
-        INSERT OR REPLACE INTO medications (
+        INSERT INTO medications (
             med_id,
             generic_name,
             therapeutic_class,
@@ -72,6 +193,25 @@ def insert_medications(medications: List[Dict], conn: sqlite3.Connection) -> Non
             nrn
         )
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (med_id) DO UPDATE SET
+            generic_name = excluded.generic_name,
+            therapeutic_class = excluded.therapeutic_class,
+            form = excluded.form,
+            strength = excluded.strength,
+            category = excluded.category,
+            base_demand = excluded.base_demand,
+            stocking_level = excluded.stocking_level,
+            is_cold_chain = excluded.is_cold_chain,
+            nrn = excluded.nrn
+        WHERE generic_name IS NOT excluded.generic_name
+           OR therapeutic_class IS NOT excluded.therapeutic_class
+           OR form IS NOT excluded.form
+           OR strength IS NOT excluded.strength
+           OR category IS NOT excluded.category
+           OR base_demand IS NOT excluded.base_demand
+           OR stocking_level IS NOT excluded.stocking_level
+           OR is_cold_chain IS NOT excluded.is_cold_chain
+           OR nrn IS NOT excluded.nrn
     """
 
     values = [
@@ -99,7 +239,7 @@ def insert_companies(companies: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO companies (
+        INSERT INTO companies (
             company_id,
             name,
             country,
@@ -108,7 +248,20 @@ def insert_companies(companies: List[Dict], conn: sqlite3.Connection) -> None:
             is_importer,
             is_distributor
         )
-        VALUES(?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (company_id) DO UPDATE SET
+            name = excluded.name,
+            country = excluded.country,
+            city = excluded.city,
+            is_manufacturer = excluded.is_manufacturer,
+            is_importer = excluded.is_importer,
+            is_distributor = excluded.is_distributor
+        WHERE name IS NOT excluded.name
+           OR country IS NOT excluded.country
+           OR city IS NOT excluded.city
+           OR is_manufacturer IS NOT excluded.is_manufacturer
+           OR is_importer IS NOT excluded.is_importer
+           OR is_distributor IS NOT excluded.is_distributor
     """
 
     values = [
@@ -132,7 +285,7 @@ def insert_facilities(facilities: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO facilities (
+        INSERT INTO facilities (
             facility_id,
             name,
             facility_type,
@@ -144,6 +297,23 @@ def insert_facilities(facilities: List[Dict], conn: sqlite3.Connection) -> None:
             longitude
         )
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (facility_id) DO UPDATE SET
+            name = excluded.name,
+            facility_type = excluded.facility_type,
+            city = excluded.city,
+            state = excluded.state,
+            tier = excluded.tier,
+            has_cold_storage = excluded.has_cold_storage,
+            latitude = excluded.latitude,
+            longitude = excluded.longitude
+        WHERE name IS NOT excluded.name
+           OR facility_type IS NOT excluded.facility_type
+           OR city IS NOT excluded.city
+           OR state IS NOT excluded.state
+           OR tier IS NOT excluded.tier
+           OR has_cold_storage IS NOT excluded.has_cold_storage
+           OR latitude IS NOT excluded.latitude
+           OR longitude IS NOT excluded.longitude
     """
 
     values = [
@@ -170,7 +340,7 @@ def insert_brands(brands: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO brands (
+        INSERT INTO brands (
             brand_id,
             brand_name,
             med_id,
@@ -180,6 +350,19 @@ def insert_brands(brands: List[Dict], conn: sqlite3.Connection) -> None:
             counterfeit_risk
         )
         VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (brand_id) DO UPDATE SET
+            brand_name = excluded.brand_name,
+            med_id = excluded.med_id,
+            manufacturer_id = excluded.manufacturer_id,
+            unit_price = excluded.unit_price,
+            is_innovator = excluded.is_innovator,
+            counterfeit_risk = excluded.counterfeit_risk
+        WHERE brand_name IS NOT excluded.brand_name
+           OR med_id IS NOT excluded.med_id
+           OR manufacturer_id IS NOT excluded.manufacturer_id
+           OR unit_price IS NOT excluded.unit_price
+           OR is_innovator IS NOT excluded.is_innovator
+           OR counterfeit_risk IS NOT excluded.counterfeit_risk
     """
 
     values = [
@@ -200,11 +383,16 @@ def insert_brands(brands: List[Dict], conn: sqlite3.Connection) -> None:
 
 
 def insert_batches(batches: List[Dict], conn: sqlite3.Connection) -> None:
+    """
+    Insert or update batch reference data. is_flagged is only taken from new
+    rows: re-importing a feed must not clear a flag, which is changed through
+    set_batches_flagged alone.
+    """
     if not batches:
         return
 
     sql = """
-        INSERT OR REPLACE INTO batches (
+        INSERT INTO batches (
             batch_id,
             brand_id,
             importer_id,
@@ -216,6 +404,21 @@ def insert_batches(batches: List[Dict], conn: sqlite3.Connection) -> None:
             is_flagged
         )
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (batch_id) DO UPDATE SET
+            brand_id = excluded.brand_id,
+            importer_id = excluded.importer_id,
+            batch_number = excluded.batch_number,
+            manufacturing_date = excluded.manufacturing_date,
+            expiry_date = excluded.expiry_date,
+            initial_quantity = excluded.initial_quantity,
+            is_verified = excluded.is_verified
+        WHERE brand_id IS NOT excluded.brand_id
+           OR importer_id IS NOT excluded.importer_id
+           OR batch_number IS NOT excluded.batch_number
+           OR manufacturing_date IS NOT excluded.manufacturing_date
+           OR expiry_date IS NOT excluded.expiry_date
+           OR initial_quantity IS NOT excluded.initial_quantity
+           OR is_verified IS NOT excluded.is_verified
     """
 
     values = [
@@ -242,7 +445,59 @@ def insert_inventory(inventory: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO inventory (
+        INSERT INTO inventory (
+            inventory_id,
+            facility_id,
+            batch_id,
+            quantity,
+            reorder_point,
+            unit_price
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (inventory_id) DO UPDATE SET
+            facility_id = excluded.facility_id,
+            batch_id = excluded.batch_id,
+            quantity = excluded.quantity,
+            reorder_point = excluded.reorder_point,
+            unit_price = excluded.unit_price
+        WHERE facility_id IS NOT excluded.facility_id
+           OR batch_id IS NOT excluded.batch_id
+           OR quantity IS NOT excluded.quantity
+           OR reorder_point IS NOT excluded.reorder_point
+           OR unit_price IS NOT excluded.unit_price
+    """
+
+    values = [
+        (
+            item["inventory_id"],
+            item["facility_id"],
+            item["batch_id"],
+            item["quantity"],
+            item.get("reorder_point"),
+            item.get("unit_price"),
+        )
+        for item in inventory
+    ]
+
+    with conn:
+        conn.executemany(sql, values)
+
+
+def upsert_inventory_quantities(
+    inventory: List[Dict], conn: sqlite3.Connection
+) -> None:
+    """
+    Write back quantities for inventory rows that changed since the last flush.
+
+    Existing rows only get their quantity column updated, and only when it
+    differs, so the facility/batch indexes and foreign keys are left alone.
+    Rows that do not exist yet are inserted in full.
+    """
+    if not inventory:
+        return
+
+    sql = """
+        INSERT INTO inventory (
             inventory_id,
             facility_id,
             batch_id,
@@ -251,6 +506,9 @@ def insert_inventory(inventory: List[Dict], conn: sqlite3.Connection) -> None:
             unit_price
         )
         VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (inventory_id) DO UPDATE SET
+            quantity = excluded.quantity
+        WHERE quantity IS NOT excluded.quantity
     """
 
     values = [
@@ -274,7 +532,7 @@ def insert_movements(movements: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO movements (
+        INSERT INTO movements (
             movement_id,
             facility_id,
             batch_id,
@@ -286,11 +544,46 @@ def insert_movements(movements: List[Dict], conn: sqlite3.Connection) -> None:
             timestamp,
             reference_id,
             source,
-            reason
+            reason,
+            transfer_id,
+            source_facility_id,
+            destination_facility_id
         )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (movement_id) DO UPDATE SET
+            facility_id = excluded.facility_id,
+            batch_id = excluded.batch_id,
+            inventory_id = excluded.inventory_id,
+            movement_type = excluded.movement_type,
+            quantity_before = excluded.quantity_before,
+            quantity_change = excluded.quantity_change,
+            quantity_after = excluded.quantity_after,
+            timestamp = excluded.timestamp,
+            reference_id = excluded.reference_id,
+            source = excluded.source,
+            reason = excluded.reason,
+            transfer_id = excluded.transfer_id,
+            source_facility_id = excluded.source_facility_id,
+            destination_facility_id = excluded.destination_facility_id
+        WHERE facility_id IS NOT excluded.facility_id
+           OR batch_id IS NOT excluded.batch_id
+           OR inventory_id IS NOT excluded.inventory_id
+           OR movement_type IS NOT excluded.movement_type
+           OR quantity_before IS NOT excluded.quantity_before
+           OR quantity_change IS NOT excluded.quantity_change
+           OR quantity_after IS NOT excluded.quantity_after
+           OR timestamp IS NOT excluded.timestamp
+           OR reference_id IS NOT excluded.reference_id
+           OR source IS NOT excluded.source
+           OR reason IS NOT excluded.reason
+           OR transfer_id IS NOT excluded.transfer_id
+           OR source_facility_id IS NOT excluded.source_facility_id
+           OR destination_facility_id IS NOT excluded.destination_facility_id
     """
 
+    # a movement repeated within the call is stored (and counted) once, as its last version
+    movements = list({movement["movement_id"]: movement for movement in movements}.values())
+
     values = [
         (
             movement["movement_id"],
@@ -305,12 +598,273 @@ def insert_movements(movements: List[Dict], conn: sqlite3.Connection) -> None:
             movement.get("reference_id"),
             movement.get("source"),
             movement.get("reason"),
+            movement.get("transfer_id"),
+            movement.get("source_facility_id"),
+            movement.get("destination_facility_id"),
         )
         for movement in movements
     ]
 
+    # new movements are folded into the ledger incrementally. A stored movement
+    # that changed can't be taken back out of a day's opening/closing quantity,
+    # so the ledger cells it left and entered are rebuilt from movements instead.
+    stored = _stored_movements([row[0] for row in values], conn)
+    new_movements = []
+    stale_cells = set()
+    for movement, row in zip(movements, values):
+        old = stored.get(row[0])
+        if old is None:
+            new_movements.append(movement)
+        elif old != row:
+            stale_cells.add(_ledger_cell(old[1], old[2], old[8]))
+            stale_cells.add(_ledger_cell(row[1], row[2], row[8]))
+    new_movements = [
+        movement
+        for movement in new_movements
+        if _ledger_cell(movement["facility_id"], movement["batch_id"], movement["timestamp"])
+        not in stale_cells
+    ]
+
     with conn:
         conn.executemany(sql, values)
+        update_stock_ledger(new_movements, conn)
+        rebuild_ledger_cells(stale_cells, conn)
+
+
+def _ledger_cell(facility_id: str, batch_id: str, timestamp) -> tuple:
+    if not isinstance(timestamp, str):
+        timestamp = timestamp.isoformat()
+    return facility_id, batch_id, timestamp[:10]
+
+
+def _stored_movements(movement_ids: List[str], conn: sqlite3.Connection) -> Dict[str, tuple]:
+    """movement_id -> stored row, in insert_movements' column order."""
+    stored = {}
+    # stay under sqlite's bound parameter limit
+    for start in range(0, len(movement_ids), 500):
+        chunk = movement_ids[start : start + 500]
+        placeholders = ",".join(["?"] * len(chunk))
+        rows = conn.execute(
+            f"""
+            SELECT movement_id, facility_id, batch_id, inventory_id, movement_type,
+                   quantity_before, quantity_change, quantity_after, timestamp,
+                   reference_id, source, reason, transfer_id,
+                   source_facility_id, destination_facility_id
+            FROM movements
+            WHERE movement_id IN ({placeholders})
+            """,
+            chunk,
+        )
+        stored.update((row[0], tuple(row)) for row in rows)
+    return stored
+
+
+def rebuild_ledger_cells(cells: set, conn: sqlite3.Connection) -> None:
+    """Recompute (facility_id, batch_id, day) ledger rows from the movements stored for them."""
+    for facility_id, batch_id, day in cells:
+        conn.execute(
+            "DELETE FROM stock_ledger_daily WHERE facility_id = ? AND batch_id = ? AND day = ?",
+            (facility_id, batch_id, day),
+        )
+        rows = conn.execute(
+            """
+            SELECT facility_id, batch_id, movement_type, quantity_before,
+                   quantity_change, quantity_after, timestamp
+            FROM movements
+            WHERE batch_id = ? AND facility_id = ?
+              AND timestamp >= ? AND timestamp < date(?, '+1 day')
+            """,
+            (batch_id, facility_id, day, day),
+        )
+        update_stock_ledger([dict(row) for row in rows], conn)
+
+
+# movement type -> stock_ledger_daily total column
+LEDGER_COLUMNS = {
+    "RESTOCK": "restocked",
+    "DISPENSE": "dispensed",
+    "TRANSFER_IN": "transferred_in",
+    "TRANSFER_OUT": "transferred_out",
+    "EXPIRY_WITHDRAW": "expiry_withdrawn",
+}
+
+
+def update_stock_ledger(movements: List[Dict], conn: sqlite3.Connection) -> None:
+    """
+    Fold movements into the daily (facility, med, batch) ledger.
+
+    Movements are aggregated per day in python first, then merged into
+    existing ledger rows, so each call costs O(len(movements)) no matter how
+    much history is already stored. Movements may arrive out of order: the
+    opening quantity always comes from the earliest movement of the day and
+    the closing quantity from the latest one.
+    """
+    if not movements:
+        return
+
+    med_by_batch = _med_ids_for_batches(
+        {m["batch_id"] for m in movements if not m.get("med_id")}, conn
+    )
+
+    rows = {}
+    for mov in sorted(movements, key=lambda m: m["timestamp"]):
+        timestamp = mov["timestamp"]
+        if not isinstance(timestamp, str):
+            timestamp = timestamp.isoformat()
+
+        key = (mov["facility_id"], mov["batch_id"], timestamp[:10])
+        change = mov["quantity_change"]
+        after = mov.get("quantity_after")
+        before = mov.get("quantity_before")
+        if before is None and after is not None:
+            before = after - change
+
+        row = rows.get(key)
+        if row is None:
+            row = {
+                "med_id": mov.get("med_id") or med_by_batch.get(mov["batch_id"]),
+                "opening_quantity": before,
+                "first_movement_at": timestamp,
+                "totals": dict.fromkeys(LEDGER_COLUMNS.values(), 0),
+                "movement_count": 0,
+            }
+            rows[key] = row
+
+        row["closing_quantity"] = after
+        row["last_movement_at"] = timestamp
+        row["movement_count"] += 1
+
+        column = LEDGER_COLUMNS.get(mov["movement_type"])
+        if column:
+            row["totals"][column] += abs(change)
+
+    sql = """
+        INSERT INTO stock_ledger_daily (
+            facility_id,
+            med_id,
+            batch_id,
+            day,
+            opening_quantity,
+            closing_quantity,
+            first_movement_at,
+            last_movement_at,
+            restocked,
+            dispensed,
+            transferred_in,
+            transferred_out,
+            expiry_withdrawn,
+            movement_count
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (facility_id, batch_id, day) DO UPDATE SET
+            med_id = COALESCE(med_id, excluded.med_id),
+            opening_quantity = CASE
+                WHEN excluded.first_movement_at < first_movement_at
+                THEN excluded.opening_quantity ELSE opening_quantity END,
+            closing_quantity = CASE
+                WHEN excluded.last_movement_at >= last_movement_at
+                THEN excluded.closing_quantity ELSE closing_quantity END,
+            first_movement_at = MIN(first_movement_at, excluded.first_movement_at),
+            last_movement_at = MAX(last_movement_at, excluded.last_movement_at),
+            restocked = restocked + excluded.restocked,
+            dispensed = dispensed + excluded.dispensed,
+            transferred_in = transferred_in + excluded.transferred_in,
+            transferred_out = transferred_out + excluded.transferred_out,
+            expiry_withdrawn = expiry_withdrawn + excluded.expiry_withdrawn,
+            movement_count = movement_count + excluded.movement_count
+    """
+
+    values = [
+        (
+            facility_id,
+            row["med_id"],
+            batch_id,
+            day,
+            row["opening_quantity"],
+            row["closing_quantity"],
+            row["first_movement_at"],
+            row["last_movement_at"],
+            row["totals"]["restocked"],
+            row["totals"]["dispensed"],
+            row["totals"]["transferred_in"],
+            row["totals"]["transferred_out"],
+            row["totals"]["expiry_withdrawn"],
+            row["movement_count"],
+        )
+        for (facility_id, batch_id, day), row in rows.items()
+    ]
+
+    conn.executemany(sql, values)
+
+
+def _med_ids_for_batches(batch_ids: set, conn: sqlite3.Connection) -> Dict[str, str]:
+    if not batch_ids:
+        return {}
+
+    batch_ids = list(batch_ids)
+    med_by_batch = {}
+    for start in range(0, len(batch_ids), 500):
+        chunk = batch_ids[start : start + 500]
+        placeholders = ",".join(["?"] * len(chunk))
+        rows = conn.execute(
+            f"""
+            SELECT b.batch_id, br.med_id
+            FROM batches b
+            JOIN brands br ON b.brand_id = br.brand_id
+            WHERE b.batch_id IN ({placeholders})
+            """,
+            chunk,
+        )
+        med_by_batch.update({row[0]: row[1] for row in rows})
+    return med_by_batch
+
+
+def get_stock_on_day(
+    facility_id: str, med_id: str, day: str, conn: sqlite3.Connection
+) -> int:
+    """
+    Stock of a medication at a facility at the end of `day` (YYYY-MM-DD),
+    read from the daily ledger instead of replaying movements.
+    """
+    row = conn.execute(
+        """
+        SELECT COALESCE(SUM(l.closing_quantity), 0)
+        FROM stock_ledger_daily l
+        WHERE l.facility_id = ?
+          AND l.med_id = ?
+          AND l.day = (
+              SELECT MAX(l2.day)
+              FROM stock_ledger_daily l2
+              WHERE l2.facility_id = l.facility_id
+                AND l2.batch_id = l.batch_id
+                AND l2.day <= ?
+          )
+        """,
+        (facility_id, med_id, day),
+    ).fetchone()
+    return row[0]
+
+
+def get_daily_ledger(
+    facility_id: str,
+    med_id: str,
+    start_day: str,
+    end_day: str,
+    conn: sqlite3.Connection,
+) -> List[Dict]:
+    """Daily ledger rows (one per batch per day) for dashboards and forecasting."""
+    rows = conn.execute(
+        """
+        SELECT *
+        FROM stock_ledger_daily
+        WHERE facility_id = ?
+          AND med_id = ?
+          AND day BETWEEN ? AND ?
+        ORDER BY day, batch_id
+        """,
+        (facility_id, med_id, start_day, end_day),
+    )
+    return [dict(row) for row in rows]
 
 
 def insert_events(events: List[Dict], conn: sqlite3.Connection) -> None:
@@ -318,7 +872,7 @@ def insert_events(events: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO events (
+        INSERT INTO events (
             event_id,
             event_type,
             severity,
@@ -332,6 +886,27 @@ def insert_events(events: List[Dict], conn: sqlite3.Connection) -> None:
             is_active
         )
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (event_id) DO UPDATE SET
+            event_type = excluded.event_type,
+            severity = excluded.severity,
+            facility_id = excluded.facility_id,
+            batch_id = excluded.batch_id,
+            timestamp = excluded.timestamp,
+            detected_at = excluded.detected_at,
+            details = excluded.details,
+            data = excluded.data,
+            source = excluded.source,
+            is_active = excluded.is_active
+        WHERE event_type IS NOT excluded.event_type
+           OR severity IS NOT excluded.severity
+           OR facility_id IS NOT excluded.facility_id
+           OR batch_id IS NOT excluded.batch_id
+           OR timestamp IS NOT excluded.timestamp
+           OR detected_at IS NOT excluded.detected_at
+           OR details IS NOT excluded.details
+           OR data IS NOT excluded.data
+           OR source IS NOT excluded.source
+           OR is_active IS NOT excluded.is_active
     """
 
     values = [
@@ -344,7 +919,7 @@ def insert_events(events: List[Dict], conn: sqlite3.Connection) -> None:
             event.get("timestamp"),
             event.get("detected_at"),
             event.get("details"),
-            event.get("data"),
+            to_json(event.get("data")),
             event.get("source"),
             int(bool(event.get("is_active", True))),
         )
@@ -360,7 +935,7 @@ def insert_anomalies(anomalies: List[Dict], conn: sqlite3.Connection) -> None:
         return
 
     sql = """
-        INSERT OR REPLACE INTO anomalies (
+        INSERT INTO anomalies (
             anomaly_id,
             anomaly_type,
             severity,
@@ -373,6 +948,25 @@ def insert_anomalies(anomalies: List[Dict], conn: sqlite3.Connection) -> None:
             is_active
         )
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (anomaly_id) DO UPDATE SET
+            anomaly_type = excluded.anomaly_type,
+            severity = excluded.severity,
+            facility_id = excluded.facility_id,
+            batch_id = excluded.batch_id,
+            timestamp = excluded.timestamp,
+            details = excluded.details,
+            evidence = excluded.evidence,
+            source = excluded.source,
+            is_active = excluded.is_active
+        WHERE anomaly_type IS NOT excluded.anomaly_type
+           OR severity IS NOT excluded.severity
+           OR facility_id IS NOT excluded.facility_id
+           OR batch_id IS NOT excluded.batch_id
+           OR timestamp IS NOT excluded.timestamp
+           OR details IS NOT excluded.details
+           OR evidence IS NOT excluded.evidence
+           OR source IS NOT excluded.source
+           OR is_active IS NOT excluded.is_active
     """
 
     values = [
@@ -384,7 +978,7 @@ def insert_anomalies(anomalies: List[Dict], conn: sqlite3.Connection) -> None:
             anomaly.get("batch_id"),
             anomaly.get("timestamp"),
             anomaly.get("details"),
-            anomaly.get("evidence"),
+            to_json(anomaly.get("evidence")),
             anomaly.get("source"),
             int(bool(anomaly.get("is_active", True))),
         )
@@ -395,6 +989,76 @@ def insert_anomalies(anomalies: List[Dict], conn: sqlite3.Connection) -> None:
         conn.executemany(sql, values)
 
 
+def set_anomalies_active(
+    anomaly_ids: List[str], is_active: bool, conn: sqlite3.Connection
+) -> None:
+    """Resolve (or reopen) anomalies; the change is logged to anomaly_status_log."""
+    with conn:
+        conn.executemany(
+            "UPDATE anomalies SET is_active = ? WHERE anomaly_id = ?",
+            [(int(is_active), anomaly_id) for anomaly_id in anomaly_ids],
+        )
+
+
+def set_batches_flagged(
+    batch_ids: List[str], is_flagged: bool, conn: sqlite3.Connection
+) -> None:
+    """Flag (or clear) batches; the change is logged to batch_flag_log."""
+    with conn:
+        conn.executemany(
+            "UPDATE batches SET is_flagged = ? WHERE batch_id = ?",
+            [(int(is_flagged), batch_id) for batch_id in batch_ids],
+        )
+
+
+def query_anomalies(
+    conn: sqlite3.Connection,
+    *,
+    anomaly_type: Optional[str] = None,
+    min_distance_km: Optional[float] = None,
+    max_price_ratio: Optional[float] = None,
+    since: Optional[str] = None,
+    active_only: bool = False,
+    limit: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Filter anomalies on evidence fields through the indexed generated columns,
+    e.g. all GEOGRAPHIC_IMPOSSIBILITY anomalies over 500 km in the last week.
+    """
+    clauses = []
+    params = []
+
+    if anomaly_type is not None:
+        clauses.append("anomaly_type = ?")
+        params.append(anomaly_type)
+    if min_distance_km is not None:
+        clauses.append("distance_km > ?")
+        params.append(min_distance_km)
+    if max_price_ratio is not None:
+        clauses.append("price_ratio < ?")
+        params.append(max_price_ratio)
+    if since is not None:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if active_only:
+        clauses.append("is_active = 1")
+
+    sql = "SELECT * FROM anomalies"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY timestamp DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    anomalies = []
+    for row in conn.execute(sql, params):
+        anomaly = dict(row)
+        anomaly["evidence"] = from_json(anomaly["evidence"])
+        anomalies.append(anomaly)
+    return anomalies
+
+
 def get_snapshot_details(snapshot_id: str, conn) -> Dict:
     cursor = conn.cursor()
 
@@ -408,7 +1072,7 @@ def get_snapshot_details(snapshot_id: str, conn) -> Dict:
     snapshot = dict(row)
 
     # critical anomalies
-    critical_ids = json.loads(snapshot["critical_anomaly_ids"] or "[]")
+    critical_ids = from_json(snapshot["critical_anomaly_ids"] or "[]")
 
     if critical_ids:
         placeholders = ",".join(["?"] * len(critical_ids))
@@ -421,3 +1085,156 @@ def get_snapshot_details(snapshot_id: str, conn) -> Dict:
         snapshot["critical_anomalies"] = []
 
     return snapshot
+
+
+def insert_incidents(incidents: List[Dict], conn: sqlite3.Connection) -> None:
+    sql = """
+        INSERT INTO incidents (
+            incident_id,
+            escalation_level,
+            status,
+            merged_into,
+            anomaly_count,
+            anomaly_ids,
+            anomaly_types,
+            facility_ids,
+            batch_ids,
+            max_severity,
+            first_seen,
+            last_seen,
+            exposed_facility_ids
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (incident_id) DO UPDATE SET
+            escalation_level = excluded.escalation_level,
+            status = excluded.status,
+            merged_into = excluded.merged_into,
+            anomaly_count = excluded.anomaly_count,
+            anomaly_ids = excluded.anomaly_ids,
+            anomaly_types = excluded.anomaly_types,
+            facility_ids = excluded.facility_ids,
+            batch_ids = excluded.batch_ids,
+            max_severity = excluded.max_severity,
+            first_seen = excluded.first_seen,
+            last_seen = excluded.last_seen,
+            exposed_facility_ids = excluded.exposed_facility_ids
+    """
+
+    values = [
+        (
+            incident["incident_id"],
+            incident["escalation_level"],
+            incident["status"],
+            incident["merged_into"],
+            incident["anomaly_count"],
+            to_json(incident["anomaly_ids"]),
+            to_json(incident["anomaly_types"]),
+            to_json(incident["facility_ids"]),
+            to_json(incident["batch_ids"]),
+            incident["max_severity"],
+            incident["first_seen"],
+            incident["last_seen"],
+            to_json(incident.get("exposed_facility_ids")),
+        )
+        for incident in incidents
+    ]
+
+    with conn:
+        conn.executemany(sql, values)
+
+
+def query_incidents(
+    conn: sqlite3.Connection,
+    *,
+    escalation_level: Optional[str] = None,
+    anomaly_id: Optional[str] = None,
+    batch_id: Optional[str] = None,
+    include_merged: bool = False,
+    limit: int = 50,
+) -> List[Dict]:
+    clauses = []
+    params: List[Any] = []
+    if escalation_level:
+        clauses.append("escalation_level = ?")
+        params.append(escalation_level)
+    if anomaly_id:
+        clauses.append("EXISTS (SELECT 1 FROM json_each(anomaly_ids) WHERE value = ?)")
+        params.append(anomaly_id)
+    if batch_id:
+        clauses.append("EXISTS (SELECT 1 FROM json_each(batch_ids) WHERE value = ?)")
+        params.append(batch_id)
+    if not include_merged:
+        clauses.append("status = 'OPEN'")
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = conn.execute(
+        f"""
+        SELECT * FROM incidents
+        {where}
+        ORDER BY CASE escalation_level
+                     WHEN 'SUPPLY_CHAIN_COMPROMISE' THEN 0
+                     WHEN 'POTENTIAL_COUNTERFEIT_INCIDENT' THEN 1
+                     ELSE 2
+                 END,
+                 anomaly_count DESC
+        LIMIT ?
+        """,
+        (*params, limit),
+    ).fetchall()
+
+    incidents = []
+    for row in rows:
+        incident = dict(row)
+        for key in ("anomaly_ids", "anomaly_types", "facility_ids", "batch_ids", "exposed_facility_ids"):
+            incident[key] = from_json(incident[key] or "[]")
+        incidents.append(incident)
+    return incidents
+
+
+def insert_snapshot(snapshot: Dict, conn: sqlite3.Connection) -> None:
+    sql = """
+        INSERT INTO agent_snapshots (
+            snapshot_id,
+            cycle_time,
+            low_stock_count,
+            stockout_count,
+            active_anomaly_count,
+            critical_anomaly_count,
+            critical_anomaly_ids,
+            new_anomaly_ids,
+            resolved_anomaly_ids,
+            actions_taken,
+            reasoning_summary,
+            last_inventory_change_id,
+            last_anomaly_rowid,
+            last_status_change_id
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    values = (
+        snapshot["snapshot_id"],
+        snapshot["cycle_time"],
+        snapshot["low_stock_count"],
+        snapshot["stockout_count"],
+        snapshot["active_anomaly_count"],
+        snapshot["critical_anomaly_count"],
+        to_json(snapshot["critical_anomaly_ids"]),
+        to_json(snapshot["new_anomaly_ids"]),
+        to_json(snapshot["resolved_anomaly_ids"]),
+        to_json(snapshot.get("actions_taken", [])),
+        snapshot.get("reasoning_summary"),
+        snapshot["last_inventory_change_id"],
+        snapshot["last_anomaly_rowid"],
+        snapshot["last_status_change_id"],
+    )
+
+    with conn:
+        conn.execute(sql, values)
+
+
+def get_latest_snapshot(conn: sqlite3.Connection) -> Optional[Dict]:
+    row = conn.execute(
+        "SELECT * FROM agent_snapshots ORDER BY rowid DESC LIMIT 1"
+    ).fetchone()
+    return dict(row) if row else None
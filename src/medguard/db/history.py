@@ -0,0 +1,272 @@
+"""
+Point-in-time (as-of) inventory queries.
+
+Every movement carries quantity_before / quantity_after, so the state of an
+inventory row at time t is the quantity_after of its last movement at or
+before t. Replaying that from the start of history gets slower as history
+grows, so full inventory checkpoints are stored every CHECKPOINT_INTERVAL_HOURS
+and a query only applies the movements between the nearest checkpoint and t.
+"""
+
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+CHECKPOINT_INTERVAL_HOURS = 24
+
+
+def _as_timestamp(t) -> str:
+    # movements store isoformat strings, which compare correctly as text
+    if isinstance(t, datetime):
+        return t.isoformat()
+    return t
+
+
+def _latest_checkpoint(t: str, conn: sqlite3.Connection) -> Optional[sqlite3.Row]:
+    return conn.execute(
+        """
+        SELECT checkpoint_id, checkpoint_time
+        FROM inventory_checkpoints
+        WHERE checkpoint_time <= ?
+        ORDER BY checkpoint_time DESC
+        LIMIT 1
+        """,
+        (t,),
+    ).fetchone()
+
+
+def _state_from_movements(
+    t: str, conn: sqlite3.Connection, where: str = "", params: tuple = ()
+) -> Dict[str, Dict]:
+    """
+    State without a checkpoint: per inventory row, the last movement at or
+    before t, else the quantity before its first later movement, else the
+    current quantity (no movement has touched it).
+    """
+    rows = conn.execute(
+        f"""
+        SELECT
+            i.inventory_id,
+            i.facility_id,
+            i.batch_id,
+            COALESCE(
+                (
+                    SELECT m.quantity_after
+                    FROM movements m
+                    WHERE m.inventory_id = i.inventory_id AND m.timestamp <= :t
+                    ORDER BY m.timestamp DESC, m.rowid DESC
+                    LIMIT 1
+                ),
+                (
+                    SELECT m.quantity_before
+                    FROM movements m
+                    WHERE m.inventory_id = i.inventory_id AND m.timestamp > :t
+                    ORDER BY m.timestamp ASC, m.rowid ASC
+                    LIMIT 1
+                ),
+                i.quantity
+            ) AS quantity
+        FROM inventory i
+        {where}
+        """,
+        {"t": t, **dict(params)},
+    )
+    return {row["inventory_id"]: dict(row) for row in rows}
+
+
+def _apply_deltas(state: Dict[str, Dict], rows) -> Dict[str, Dict]:
+    """Apply movements (ordered by time) on top of a checkpoint state."""
+    for row in rows:
+        inventory_id = row["inventory_id"]
+        if inventory_id is None:
+            continue
+
+        quantity = row["quantity_after"]
+        if quantity is None:
+            quantity = (row["quantity_before"] or 0) + row["quantity_change"]
+
+        state[inventory_id] = {
+            "inventory_id": inventory_id,
+            "facility_id": row["facility_id"],
+            "batch_id": row["batch_id"],
+            "quantity": quantity,
+        }
+    return state
+
+
+def create_inventory_checkpoint(t, conn: sqlite3.Connection) -> str:
+    """
+    Store the full inventory state as of t.
+
+    Built from the previous checkpoint plus the movements since then, so the
+    cost depends on the checkpoint interval, not on total history.
+    """
+    t = _as_timestamp(t)
+    previous = _latest_checkpoint(t, conn)
+
+    if previous is None:
+        state = _state_from_movements(t, conn)
+    else:
+        items = conn.execute(
+            """
+            SELECT inventory_id, facility_id, batch_id, quantity
+            FROM inventory_checkpoint_items
+            WHERE checkpoint_id = ?
+            """,
+            (previous["checkpoint_id"],),
+        )
+        state = {row["inventory_id"]: dict(row) for row in items}
+        deltas = conn.execute(
+            """
+            SELECT inventory_id, facility_id, batch_id,
+                   quantity_before, quantity_change, quantity_after
+            FROM movements
+            WHERE timestamp > ? AND timestamp <= ?
+            ORDER BY timestamp ASC, rowid ASC
+            """,
+            (previous["checkpoint_time"], t),
+        )
+        _apply_deltas(state, deltas)
+
+    checkpoint_id = f"CKP_{uuid.uuid4().hex[:10].upper()}"
+
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO inventory_checkpoints (checkpoint_id, checkpoint_time, created_at)
+            VALUES (?, ?, ?)
+            """,
+            (checkpoint_id, t, datetime.now().isoformat()),
+        )
+        conn.executemany(
+            """
+            INSERT INTO inventory_checkpoint_items (
+                checkpoint_id,
+                inventory_id,
+                facility_id,
+                batch_id,
+                quantity
+            )
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    checkpoint_id,
+                    item["inventory_id"],
+                    item["facility_id"],
+                    item["batch_id"],
+                    item["quantity"],
+                )
+                for item in state.values()
+            ],
+        )
+
+    return checkpoint_id
+
+
+def ensure_checkpoints(
+    conn: sqlite3.Connection,
+    until=None,
+    interval_hours: int = CHECKPOINT_INTERVAL_HOURS,
+) -> List[str]:
+    """
+    Create any missing checkpoints, one per interval, up to `until`
+    (defaults to the latest movement). Returns the new checkpoint ids.
+    """
+    if until is None:
+        until = conn.execute("SELECT MAX(timestamp) FROM movements").fetchone()[0]
+        if until is None:
+            return []
+    until = datetime.fromisoformat(_as_timestamp(until))
+
+    last = conn.execute(
+        "SELECT MAX(checkpoint_time) FROM inventory_checkpoints"
+    ).fetchone()[0]
+    if last is None:
+        first = conn.execute("SELECT MIN(timestamp) FROM movements").fetchone()[0]
+        if first is None:
+            return []
+        # first checkpoint sits on the interval boundary at or before the first movement
+        first = datetime.fromisoformat(first)
+        next_time = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        next_time = datetime.fromisoformat(last) + timedelta(hours=interval_hours)
+
+    created = []
+    while next_time <= until:
+        created.append(create_inventory_checkpoint(next_time, conn))
+        next_time += timedelta(hours=interval_hours)
+
+    return created
+
+
+def inventory_as_of(facility_id: str, t, conn: sqlite3.Connection) -> List[Dict]:
+    """Inventory rows of a facility (including zero quantities) as of t."""
+    t = _as_timestamp(t)
+    checkpoint = _latest_checkpoint(t, conn)
+
+    if checkpoint is None:
+        state = _state_from_movements(
+            t, conn, "WHERE i.facility_id = :facility_id", (("facility_id", facility_id),)
+        )
+    else:
+        items = conn.execute(
+            """
+            SELECT inventory_id, facility_id, batch_id, quantity
+            FROM inventory_checkpoint_items
+            WHERE checkpoint_id = ? AND facility_id = ?
+            """,
+            (checkpoint["checkpoint_id"], facility_id),
+        )
+        state = {row["inventory_id"]: dict(row) for row in items}
+        deltas = conn.execute(
+            """
+            SELECT inventory_id, facility_id, batch_id,
+                   quantity_before, quantity_change, quantity_after
+            FROM movements
+            WHERE facility_id = ? AND timestamp > ? AND timestamp <= ?
+            ORDER BY timestamp ASC, rowid ASC
+            """,
+            (facility_id, checkpoint["checkpoint_time"], t),
+        )
+        _apply_deltas(state, deltas)
+
+    return sorted(state.values(), key=lambda item: item["inventory_id"])
+
+
+def batch_holdings_as_of(batch_id: str, t, conn: sqlite3.Connection) -> List[Dict]:
+    """Facilities holding a batch (quantity > 0) as of t."""
+    t = _as_timestamp(t)
+    checkpoint = _latest_checkpoint(t, conn)
+
+    if checkpoint is None:
+        state = _state_from_movements(
+            t, conn, "WHERE i.batch_id = :batch_id", (("batch_id", batch_id),)
+        )
+    else:
+        items = conn.execute(
+            """
+            SELECT inventory_id, facility_id, batch_id, quantity
+            FROM inventory_checkpoint_items
+            WHERE checkpoint_id = ? AND batch_id = ?
+            """,
+            (checkpoint["checkpoint_id"], batch_id),
+        )
+        state = {row["inventory_id"]: dict(row) for row in items}
+        deltas = conn.execute(
+            """
+            SELECT inventory_id, facility_id, batch_id,
+                   quantity_before, quantity_change, quantity_after
+            FROM movements
+            WHERE batch_id = ? AND timestamp > ? AND timestamp <= ?
+            ORDER BY timestamp ASC, rowid ASC
+            """,
+            (batch_id, checkpoint["checkpoint_time"], t),
+        )
+        _apply_deltas(state, deltas)
+
+    return sorted(
+        (item for item in state.values() if item["quantity"] and item["quantity"] > 0),
+        key=lambda item: item["facility_id"],
+    )
@@ -87,6 +87,9 @@ CREATE TABLE IF NOT EXISTS movements (
             reference_id TEXT,
             source TEXT,
             reason TEXT,
+            transfer_id TEXT,               -- shared by the TRANSFER_OUT / TRANSFER_IN pair
+            source_facility_id TEXT,        -- TRANSFER_IN: where the stock came from
+            destination_facility_id TEXT,   -- TRANSFER_OUT: where the stock went
 
             FOREIGN KEY (facility_id) REFERENCES facilities(facility_id)
         );
@@ -102,7 +105,12 @@ CREATE TABLE IF NOT EXISTS events (
             details TEXT,
             data TEXT,  
             source TEXT,
-            is_active INTEGER
+            is_active INTEGER,
+
+            -- queryable payload keys (JSON1), computed on read and indexable
+            days_to_expiry INTEGER GENERATED ALWAYS AS (
+                CASE WHEN json_valid(data) THEN json_extract(data, '$.days_to_expiry') END
+            ) VIRTUAL
         );
 
 CREATE TABLE IF NOT EXISTS anomalies (
@@ -115,10 +123,82 @@ CREATE TABLE IF NOT EXISTS anomalies (
             details TEXT,
             evidence TEXT,  
             source TEXT,
-            is_active INTEGER
+            is_active INTEGER,
+
+            -- queryable evidence keys (JSON1), computed on read and indexable
+            distance_km REAL GENERATED ALWAYS AS (
+                CASE WHEN json_valid(evidence) THEN json_extract(evidence, '$.distance_km') END
+            ) VIRTUAL,
+            hours_between REAL GENERATED ALWAYS AS (
+                CASE WHEN json_valid(evidence) THEN json_extract(evidence, '$.hours_between') END
+            ) VIRTUAL,
+            price_ratio REAL GENERATED ALWAYS AS (
+                CASE WHEN json_valid(evidence) THEN json_extract(evidence, '$.price_ratio') END
+            ) VIRTUAL
+        );
+
+CREATE TABLE IF NOT EXISTS stock_ledger_daily (
+            facility_id TEXT NOT NULL,
+            med_id TEXT,
+            batch_id TEXT NOT NULL,
+            day TEXT NOT NULL,              -- YYYY-MM-DD
+            opening_quantity INTEGER,       -- quantity before the first movement of the day
+            closing_quantity INTEGER,       -- quantity after the last movement of the day
+            first_movement_at TEXT,
+            last_movement_at TEXT,
+            restocked INTEGER DEFAULT 0,
+            dispensed INTEGER DEFAULT 0,
+            transferred_in INTEGER DEFAULT 0,
+            transferred_out INTEGER DEFAULT 0,
+            expiry_withdrawn INTEGER DEFAULT 0,
+            movement_count INTEGER DEFAULT 0,
+
+            PRIMARY KEY (facility_id, batch_id, day)
+        );
+
+CREATE TABLE IF NOT EXISTS inventory_checkpoints (
+            checkpoint_id TEXT PRIMARY KEY,
+            checkpoint_time TEXT NOT NULL,  -- inventory state as of this time
+            created_at TEXT
+        );
+
+CREATE TABLE IF NOT EXISTS inventory_checkpoint_items (
+            checkpoint_id TEXT NOT NULL,
+            inventory_id TEXT NOT NULL,
+            facility_id TEXT,
+            batch_id TEXT,
+            quantity INTEGER,
+
+            PRIMARY KEY (checkpoint_id, inventory_id),
+            FOREIGN KEY (checkpoint_id) REFERENCES inventory_checkpoints(checkpoint_id)
+        );
+
+CREATE TABLE IF NOT EXISTS facility_scores (
+            facility_id TEXT NOT NULL,
+            anomaly_type TEXT NOT NULL,     -- 'ALL' holds the combined penalty
+            penalty REAL,                   -- decayed anomaly penalty as of updated_at
+            updated_at TEXT,
+
+            PRIMARY KEY (facility_id, anomaly_type)
+        );
+
+CREATE TABLE IF NOT EXISTS incidents (
+            incident_id TEXT PRIMARY KEY,
+            escalation_level TEXT,      -- FLAG_FOR_REVIEW / POTENTIAL_COUNTERFEIT_INCIDENT / SUPPLY_CHAIN_COMPROMISE
+            status TEXT,                -- OPEN, or MERGED into another incident
+            merged_into TEXT,
+            anomaly_count INTEGER,
+            anomaly_ids TEXT,           -- JSON
+            anomaly_types TEXT,         -- JSON
+            facility_ids TEXT,          -- JSON
+            batch_ids TEXT,             -- JSON
+            max_severity TEXT,
+            first_seen TEXT,
+            last_seen TEXT,
+            exposed_facility_ids TEXT   -- JSON: everywhere the incident's batches have been
         );
 
-CREATE TABLE agent_snapshots (
+CREATE TABLE IF NOT EXISTS agent_snapshots (
     snapshot_id TEXT PRIMARY KEY,
     cycle_time TEXT,
     low_stock_count INTEGER,
@@ -129,15 +209,154 @@ CREATE TABLE agent_snapshots (
     new_anomaly_ids TEXT,       -- Detected this cycle
     resolved_anomaly_ids TEXT,  -- Resolved this cycle
     actions_taken TEXT,         -- JSON: what agent did
-    reasoning_summary TEXT      -- Brief explanation
+    reasoning_summary TEXT,     -- Brief explanation
+
+    -- how far the snapshot has read, so the next cycle only reads newer rows
+    last_inventory_change_id INTEGER,
+    last_anomaly_rowid INTEGER,
+    last_status_change_id INTEGER
+);
+
+-- every flip of anomalies.is_active, so resolutions can be read incrementally
+CREATE TABLE IF NOT EXISTS anomaly_status_log (
+    change_id INTEGER PRIMARY KEY,
+    anomaly_rowid INTEGER,
+    anomaly_id TEXT,
+    severity TEXT,
+    was_active INTEGER,
+    is_active INTEGER,
+    changed_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
+CREATE TRIGGER IF NOT EXISTS trg_anomalies_status
+AFTER UPDATE OF is_active ON anomalies
+WHEN OLD.is_active IS NOT NEW.is_active
+BEGIN
+    INSERT INTO anomaly_status_log (anomaly_rowid, anomaly_id, severity, was_active, is_active)
+    VALUES (NEW.rowid, NEW.anomaly_id, NEW.severity, OLD.is_active, NEW.is_active);
+END;
+
+-- every flip of batches.is_flagged, so caches keyed on batches can be invalidated
+CREATE TABLE IF NOT EXISTS batch_flag_log (
+    change_id INTEGER PRIMARY KEY,
+    batch_id TEXT,
+    was_flagged INTEGER,
+    is_flagged INTEGER,
+    changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_batches_flag
+AFTER UPDATE OF is_flagged ON batches
+WHEN OLD.is_flagged IS NOT NEW.is_flagged
+BEGIN
+    INSERT INTO batch_flag_log (batch_id, was_flagged, is_flagged)
+    VALUES (NEW.batch_id, OLD.is_flagged, NEW.is_flagged);
+END;
+
+-- batches whose number, expiry or brand changed after insert (e.g. a corrected
+-- re-import), so caches keyed on batches can re-index them
+CREATE TABLE IF NOT EXISTS batch_change_log (
+    change_id INTEGER PRIMARY KEY,
+    batch_id TEXT,
+    changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_batches_change
+AFTER UPDATE OF batch_number, expiry_date, brand_id ON batches
+WHEN OLD.batch_number IS NOT NEW.batch_number
+  OR OLD.expiry_date IS NOT NEW.expiry_date
+  OR OLD.brand_id IS NOT NEW.brand_id
+BEGIN
+    INSERT INTO batch_change_log (batch_id) VALUES (NEW.batch_id);
+END;
+
+-- every insert, quantity / reorder point change and delete of an inventory row,
+-- so in-memory stock views can follow upsert_inventory_quantities incrementally
+CREATE TABLE IF NOT EXISTS inventory_change_log (
+    change_id INTEGER PRIMARY KEY,
+    inventory_id TEXT,
+    was_quantity INTEGER,
+    quantity INTEGER,
+    was_reorder_point INTEGER,
+    reorder_point INTEGER,
+    changed_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_change_insert
+AFTER INSERT ON inventory
+BEGIN
+    INSERT INTO inventory_change_log (inventory_id, quantity, reorder_point)
+    VALUES (NEW.inventory_id, NEW.quantity, NEW.reorder_point);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_change_update
+AFTER UPDATE OF quantity, reorder_point ON inventory
+WHEN OLD.quantity IS NOT NEW.quantity OR OLD.reorder_point IS NOT NEW.reorder_point
+BEGIN
+    INSERT INTO inventory_change_log (inventory_id, was_quantity, quantity, was_reorder_point, reorder_point)
+    VALUES (NEW.inventory_id, OLD.quantity, NEW.quantity, OLD.reorder_point, NEW.reorder_point);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_change_delete
+AFTER DELETE ON inventory
+BEGIN
+    INSERT INTO inventory_change_log (inventory_id, was_quantity, was_reorder_point)
+    VALUES (OLD.inventory_id, OLD.quantity, OLD.reorder_point);
+END;
+
+-- bumped whenever a batch's movements are inserted, changed or deleted, so
+-- cached per-batch tool results can tell they are stale
+CREATE TABLE IF NOT EXISTS batch_movement_versions (
+    batch_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_movements_version_insert
+AFTER INSERT ON movements
+BEGIN
+    INSERT INTO batch_movement_versions (batch_id, version) VALUES (NEW.batch_id, 1)
+    ON CONFLICT (batch_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_movements_version_update
+AFTER UPDATE ON movements
+BEGIN
+    INSERT INTO batch_movement_versions (batch_id, version) VALUES (NEW.batch_id, 1)
+    ON CONFLICT (batch_id) DO UPDATE SET version = version + 1;
+    INSERT INTO batch_movement_versions (batch_id, version)
+    SELECT OLD.batch_id, 1 WHERE OLD.batch_id IS NOT NEW.batch_id
+    ON CONFLICT (batch_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_movements_version_delete
+AFTER DELETE ON movements
+BEGIN
+    INSERT INTO batch_movement_versions (batch_id, version) VALUES (OLD.batch_id, 1)
+    ON CONFLICT (batch_id) DO UPDATE SET version = version + 1;
+END;
+
 CREATE INDEX IF NOT EXISTS idx_brands_med ON brands(med_id);
 CREATE INDEX IF NOT EXISTS idx_batches_brand ON batches(brand_id);
+CREATE INDEX IF NOT EXISTS idx_batches_number ON batches(batch_number);
 CREATE INDEX IF NOT EXISTS idx_inventory_facility ON inventory(facility_id);
 CREATE INDEX IF NOT EXISTS idx_inventory_batch ON inventory(batch_id);
 CREATE INDEX IF NOT EXISTS idx_movements_facility ON movements(facility_id);
 CREATE INDEX IF NOT EXISTS idx_movements_batch ON movements(batch_id);
 CREATE INDEX IF NOT EXISTS idx_movements_timestamp ON movements(timestamp);
+CREATE INDEX IF NOT EXISTS idx_movements_facility_time ON movements(facility_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_movements_batch_time ON movements(batch_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_movements_inventory_time ON movements(inventory_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_movements_transfer ON movements(transfer_id);
 CREATE INDEX IF NOT EXISTS idx_anomalies_type ON anomalies(anomaly_type);
-CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_anomalies_timestamp ON anomalies(timestamp);
+CREATE INDEX IF NOT EXISTS idx_anomalies_type_distance ON anomalies(anomaly_type, distance_km);
+CREATE INDEX IF NOT EXISTS idx_anomalies_type_hours ON anomalies(anomaly_type, hours_between);
+CREATE INDEX IF NOT EXISTS idx_anomalies_type_price_ratio ON anomalies(anomaly_type, price_ratio);
+CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type);
+CREATE INDEX IF NOT EXISTS idx_events_type_expiry ON events(event_type, days_to_expiry);
+CREATE INDEX IF NOT EXISTS idx_incidents_level ON incidents(status, escalation_level);
+CREATE INDEX IF NOT EXISTS idx_snapshots_cycle_time ON agent_snapshots(cycle_time);
+CREATE INDEX IF NOT EXISTS idx_ledger_facility_med_day ON stock_ledger_daily(facility_id, med_id, day);
+CREATE INDEX IF NOT EXISTS idx_checkpoints_time ON inventory_checkpoints(checkpoint_time);
+CREATE INDEX IF NOT EXISTS idx_checkpoint_items_facility ON inventory_checkpoint_items(checkpoint_id, facility_id);
+CREATE INDEX IF NOT EXISTS idx_checkpoint_items_batch ON inventory_checkpoint_items(checkpoint_id, batch_id);
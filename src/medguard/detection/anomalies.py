@@ -1,10 +1,14 @@
 from datetime import datetime
 from collections import defaultdict
-from typing import List, Dict
+from typing import List, Dict, Optional
 import math
 import uuid
+import warnings
+
+import numpy as np
 
 from medguard.data.generators.companies import authorized_importers
+from medguard.detection.prices import GroupCoder, PriceHistory, robust_zscores
 
 ANOMALY_TYPES = [
     "IMPOSSIBLE_QUANTITY",
@@ -13,13 +17,35 @@ ANOMALY_TYPES = [
     "UNAUTHORIZED_IMPORTER",
     "PRICE_ANOMALY",
     "DUPLICATE_BATCH_NUMBER",
+    "NEAR_DUPLICATE_BATCH_NUMBER",
+    "RAPID_TURNOVER",
+    "UNVERIFIED_CUSTODY",
 ]
 
 DEFAULT_THRESHOLDS = {
     "IMPOSSIBLE_QUANTITY_MULTIPLIER": 10,
     "GEOGRAPHIC_IMPOSSIBLE_KM": 300,
     "GEOGRAPHIC_IMPOSSIBLE_HOURS": 6,
-    "PRICE_ANOMALY_LOW_THRESHOLD": 0.7,
+    # with road travel times: flag sightings closer in time than this share of the drive,
+    # for facilities more than a delivery round apart
+    "GEOGRAPHIC_TRAVEL_TOLERANCE": 0.75,
+    "GEOGRAPHIC_MIN_TRAVEL_HOURS": 2,
+    # robust z-score (median / MAD of the same med and brand elsewhere) below which a price is flagged
+    "PRICE_ANOMALY_Z_THRESHOLD": -3.5,
+    "PRICE_ANOMALY_MIN_PEERS": 5,
+    "PRICE_ANOMALY_MAD_FLOOR": 0.02,  # share of the median; keeps identical-price groups sane
+    "PRICE_HISTORY_DAYS": 7,  # window of past prices a PriceDetector compares against
+    "RAPID_TURNOVER_WINDOW_HOURS": 72,
+    "RAPID_TURNOVER_MIN_UNITS": 50,
+    "RAPID_TURNOVER_RATIO": 3.0,  # units transferred out per unit dispensed
+    "RAPID_TURNOVER_MAX_DWELL_HOURS": 24,
+    # how long a transfer receipt may wait for its sender's records to arrive
+    "CUSTODY_GRACE_HOURS": 24,
+    # units inventory may differ from the movement ledger before it's flagged
+    "LEDGER_DRIFT_TOLERANCE": 0,
+    "LEDGER_AUDIT_ROWS_PER_CYCLE": 500,  # untouched rows re-checked each cycle, in rotation
+    # edits (a digit edit counts two) within which two batch numbers of one manufacturer look alike
+    "FUZZY_BATCH_MAX_EDITS": 1,
 }
 
 
@@ -113,73 +139,16 @@ def detect_geographic_impossibility(
     current_time: datetime,
     thresholds=DEFAULT_THRESHOLDS,
 ) -> List[Dict]:
-    """detect when same batch appears at distant locations in an unrealistic short period."""
-    anomalies = []
-
-    facility_lookup = {f["facility_id"]: f for f in facilities}
-    movements_by_batch = defaultdict(list)
-
-    for mov in movements:
-        # skip initial seed
-        if mov.get("source") == "INITIAL_SEED":
-            continue
-        #  check restock  movements only
-        if mov["movement_type"] != "RESTOCK":
-            continue
-        movements_by_batch[mov["batch_id"]].append(mov)
-
-    for batch_id, batch_moves in movements_by_batch.items():
-        # sort batch movements with time
-        batch_moves.sort(key=lambda movement: movement["timestamp"])
-
-        for i in range(len(batch_moves) - 1):
-            former_movement = batch_moves[i]
-            latter_movement = batch_moves[i + 1]
-
-            former_fac = facility_lookup.get(former_movement["facility_id"])
-            latter_fac = facility_lookup.get(latter_movement["facility_id"])
-
-            if not former_fac or not latter_fac:
-                continue
-
-            # skip same facility
-            if former_fac["facility_id"] == latter_fac["facility_id"]:
-                continue
-
-            former_time = datetime.fromisoformat(former_movement["timestamp"])
-            latter_time = datetime.fromisoformat(latter_movement["timestamp"])
-            hours_between = abs((latter_time - former_time).total_seconds()) / 3600
-
-            distance_in_km = haversine_km(
-                former_fac["latitude"],
-                former_fac["longitude"],
-                latter_fac["latitude"],
-                latter_fac["longitude"],
-            )
-
-            if (
-                distance_in_km > thresholds["GEOGRAPHIC_IMPOSSIBLE_KM"]
-                and hours_between < thresholds["GEOGRAPHIC_IMPOSSIBLE_HOURS"]
-            ):
-                anomalies.append(
-                    create_anomaly(
-                        anomaly_type="GEOGRAPHIC_IMPOSSIBILITY",
-                        severity="CRITICAL",
-                        facility_id=None,
-                        med_id=former_movement["med_id"],
-                        batch_id=batch_id,
-                        timestamp=current_time,
-                        details=f"Batch appeared at two distant locations ({round(distance_in_km, 1)} km apart) within {round(hours_between, 2)} hours",
-                        evidence={
-                            "first_facility": former_fac["facility_id"],
-                            "second_facility": latter_fac["facility_id"],
-                            "distance_km": round(distance_in_km, 1),
-                            "hours_between": round(hours_between, 2),
-                        },
-                    )
-                )
-
-    return anomalies
+    """
+    detect when same batch appears at distant locations in an unrealistic short period.
+    one-off run of geographic.GeographicDetector over all movements.
+    """
+    from medguard.detection.geographic import GeographicDetector
+
+    detector = GeographicDetector(facilities, thresholds)
+    return detector.detect(
+        new_movements=movements, inventory=[], batches=[], current_time=current_time
+    )
 
 
 def detect_ghost_stock(
@@ -187,38 +156,35 @@ def detect_ghost_stock(
     movements: List[Dict],
     current_time: datetime,
 ) -> List[Dict]:
-    """Detect inventory that exists without any movement at that facility."""
-    anomalies = []
+    """
+    Detect inventory that exists without any receipt at that facility, or
+    whose quantity the movement ledger doesn't support.
+    one-off run of ledger.LedgerReconciler over all movements.
+    """
+    from medguard.detection.ledger import LedgerReconciler
+
+    return LedgerReconciler().detect(
+        new_movements=movements, inventory=inventory, batches=[], current_time=current_time
+    )
 
-    received_at_facility = set()
-    for mov in movements:
-        if mov["movement_type"] in ("RESTOCK", "TRANSFER_IN"):
-            key = (mov["facility_id"], mov["batch_id"])
-            received_at_facility.add(key)
 
-    for inv in inventory:
-        if inv["quantity"] <= 0:
-            continue
+def importer_is_authorized(batch: Dict) -> bool:
+    """Whether the batch came in through an importer its manufacturer authorizes."""
+    manufacturer_name = batch.get("manufacturer_name")
+    importer_name = batch.get("importer_name")
 
-        key = (inv["facility_id"], inv["batch_id"])
-        if key not in received_at_facility:
-            anomalies.append(
-                create_anomaly(
-                    anomaly_type="GHOST_STOCK",
-                    severity="HIGH",
-                    facility_id=inv["facility_id"],
-                    med_id=inv["med_id"],
-                    batch_id=inv["batch_id"],
-                    timestamp=current_time,
-                    details="Inventory exists at facility without any receipt movement",
-                    evidence={
-                        "quantity": inv["quantity"],
-                        "facility_id": inv["facility_id"],
-                    },
-                )
-            )
+    # skip nigerian manufacturers because they can self-distribute
+    if manufacturer_name == importer_name:
+        return True
 
-    return anomalies
+    # does manufacturer have authorized importers ?
+    authorized = authorized_importers.get(manufacturer_name)
+
+    # not an international manufacturer requiring authorization
+    if authorized is None:
+        return True
+
+    return importer_name in authorized
 
 
 def detect_unauthorized_importer(
@@ -229,37 +195,27 @@ def detect_unauthorized_importer(
     anomalies = []
 
     for batch in batches:
-        manufacturer_name = batch.get("manufacturer_name")
-        importer_name = batch.get("importer_name")
-
-        # skip nigerian manufacturers because they can self-distribute
-        if manufacturer_name == importer_name:
-            continue
-
-        # does manufacturer have authorized importers ?
-        authorized = authorized_importers.get(manufacturer_name)
-
-        # not an international manufacturer requiring authorization, skip
-        if authorized is None:
+        if importer_is_authorized(batch):
             continue
 
-        if importer_name not in authorized:
-            anomalies.append(
-                create_anomaly(
-                    anomaly_type="UNAUTHORIZED_IMPORTER",
-                    severity="CRITICAL",
-                    facility_id=None,
-                    med_id=batch["med_id"],
-                    batch_id=batch["batch_id"],
-                    timestamp=current_time,
-                    details=f"Batch imported by unauthorized importer: {importer_name}",
-                    evidence={
-                        "manufacturer": manufacturer_name,
-                        "importer": importer_name,
-                        "authorized_importers": authorized,
-                    },
-                )
+        manufacturer_name = batch.get("manufacturer_name")
+        importer_name = batch.get("importer_name")
+        anomalies.append(
+            create_anomaly(
+                anomaly_type="UNAUTHORIZED_IMPORTER",
+                severity="CRITICAL",
+                facility_id=None,
+                med_id=batch["med_id"],
+                batch_id=batch["batch_id"],
+                timestamp=current_time,
+                details=f"Batch imported by unauthorized importer: {importer_name}",
+                evidence={
+                    "manufacturer": manufacturer_name,
+                    "importer": importer_name,
+                    "authorized_importers": authorized_importers[manufacturer_name],
+                },
             )
+        )
 
     return anomalies
 
@@ -267,78 +223,119 @@ def detect_unauthorized_importer(
 def detect_duplicate_batch_number(
     batches: List[Dict],
     current_time: datetime,
+    thresholds=DEFAULT_THRESHOLDS,
 ) -> List[Dict]:
-    """detect batches with duplicate batch numbers."""
-    anomalies = []
-
-    # group batches by batch no
-    by_batch_number = defaultdict(list)
-    for batch in batches:
-        by_batch_number[batch["batch_number"]].append(batch)
+    """detect batches with duplicate or look-alike batch numbers."""
+    from medguard.detection.batch_numbers import BatchNumberIndex
 
-    for batch_number, batch_list in by_batch_number.items():
-        if len(batch_list) > 1:
-            batch_ids = [b["batch_id"] for b in batch_list]
-            manufacturers = list(set(b["manufacturer_name"] for b in batch_list))
-
-            anomalies.append(
-                create_anomaly(
-                    anomaly_type="DUPLICATE_BATCH_NUMBER",
-                    severity="CRITICAL",
-                    facility_id=None,
-                    med_id=batch_list[0]["med_id"],
-                    batch_id=batch_ids[0],
-                    timestamp=current_time,
-                    details=f"Batch number {batch_number} appears on {len(batch_list)} different batches",
-                    evidence={
-                        "batch_number": batch_number,
-                        "duplicate_batch_ids": batch_ids,
-                        "manufacturers": manufacturers,
-                    },
-                )
-            )
-
-    return anomalies
+    return BatchNumberIndex(thresholds).detect(
+        new_movements=[], inventory=[], batches=batches, current_time=current_time
+    )
 
 
 def detect_price_anomaly(
     inventory: List[Dict],
     current_time: datetime,
     thresholds=DEFAULT_THRESHOLDS,
+    history: Optional[PriceHistory] = None,
 ) -> List[Dict]:
+    """
+    Flag prices far below what other facilities charge for the same brand
+    of the same medication (robust z-score, see detection/prices.py). With
+    a PriceHistory the peers are the latest price of every facility's stock
+    in its window, not just the current inventory.
+
+    Thresholds missing from `thresholds` fall back to DEFAULT_THRESHOLDS.
+    The old PRICE_ANOMALY_LOW_THRESHOLD (price / expected price) is still
+    honoured, against the peer median instead of the z-score, but deprecated.
+    """
+    thresholds = {**DEFAULT_THRESHOLDS, **thresholds}
+    low_ratio = thresholds.get("PRICE_ANOMALY_LOW_THRESHOLD")
+    if low_ratio is not None:
+        warnings.warn(
+            "PRICE_ANOMALY_LOW_THRESHOLD is deprecated, use PRICE_ANOMALY_Z_THRESHOLD",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+
+    # one pass per column, then numpy for the filter and the group codes
+    prices = np.array([inv.get("unit_price") or 0.0 for inv in inventory], dtype=np.float64)
+    med_ids = np.array([inv.get("med_id") or "" for inv in inventory], dtype=str)
+    brand_ids = np.array([inv.get("brand_id") or "" for inv in inventory], dtype=str)
+    rows = np.flatnonzero((prices != 0) & (med_ids != "") & (brand_ids != ""))
+    if not len(rows):
+        return []
+
+    coder = history.coder if history is not None else GroupCoder()
+    codes = coder.encode_pairs(med_ids[rows], brand_ids[rows])
+    prices = prices[rows]
+
+    if history is not None:
+        # nearly one source per row, so a sort would cost more than the dict
+        sources = history.sources.encode(
+            (inventory[i].get("facility_id"), inventory[i].get("batch_id")) for i in rows.tolist()
+        )
+        # the offset below needs one row per source; keep the last, like arrays()
+        _, from_end = np.unique(sources[::-1], return_index=True)
+        keep = np.sort(len(sources) - 1 - from_end)
+        rows, codes, prices, sources = rows[keep], codes[keep], prices[keep], sources[keep]
+        history.add(codes, prices, current_time, sources)
+        history.evict(current_time)
+        # this cycle's rows are the last chunk, so they are the tail of the window
+        codes, prices = history.arrays()
+
+    stats = robust_zscores(codes, prices, thresholds["PRICE_ANOMALY_MAD_FLOOR"])
+    offset = len(prices) - len(rows)
+    if low_ratio is not None:
+        low = prices[offset:] < low_ratio * stats["median"][offset:]
+    else:
+        low = stats["z"][offset:] < thresholds["PRICE_ANOMALY_Z_THRESHOLD"]
+    flagged = np.flatnonzero(low & (stats["peers"][offset:] >= thresholds["PRICE_ANOMALY_MIN_PEERS"]))
 
     anomalies = []
+    for i in flagged:
+        inv = inventory[rows[i]]
+        actual_price = inv["unit_price"]
+        median = float(stats["median"][offset + i])
+        anomalies.append(
+            create_anomaly(
+                anomaly_type="PRICE_ANOMALY",
+                severity="HIGH",
+                facility_id=inv["facility_id"],
+                med_id=inv["med_id"],
+                batch_id=inv["batch_id"],
+                timestamp=current_time,
+                details=f"Suspiciously low price: {actual_price} vs peer median {median:g}",
+                evidence={
+                    "actual_price": actual_price,
+                    "peer_median_price": median,
+                    "peer_mad": round(float(stats["mad"][offset + i]), 2),
+                    "peer_count": int(stats["peers"][offset + i]),
+                    "robust_z": round(float(stats["z"][offset + i]), 2),
+                    "price_ratio": round(actual_price / median, 2),
+                    "counterfeit_risk": inv.get("counterfeit_risk"),
+                    "facility_id": inv["facility_id"],
+                },
+            )
+        )
 
-    for inv in inventory:
-        actual_price = inv.get("unit_price")
-        expected_price = inv.get("expected_price")
+    return anomalies
 
-        if not actual_price or not expected_price or expected_price <= 0:
-            continue
 
-        ratio = actual_price / expected_price
+class PriceDetector:
+    """
+    Stateful detector: detect_price_anomaly against a rolling PriceHistory
+    of PRICE_HISTORY_DAYS, so peers include stock sold out since.
+    """
 
-        if ratio < thresholds["PRICE_ANOMALY_LOW_THRESHOLD"]:
-            anomalies.append(
-                create_anomaly(
-                    anomaly_type="PRICE_ANOMALY",
-                    severity="HIGH",
-                    facility_id=inv["facility_id"],
-                    med_id=inv["med_id"],
-                    batch_id=inv["batch_id"],
-                    timestamp=current_time,
-                    details=f"Suspiciously low price: {actual_price} vs expected {expected_price}",
-                    evidence={
-                        "actual_price": actual_price,
-                        "expected_price": expected_price,
-                        "price_ratio": round(ratio, 2),
-                        "counterfeit_risk": inv.get("counterfeit_risk"),
-                        "facility_id": inv["facility_id"],
-                    },
-                )
-            )
+    anomaly_types = ("PRICE_ANOMALY",)
 
-    return anomalies
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS):
+        self.thresholds = thresholds
+        self.history = PriceHistory({**DEFAULT_THRESHOLDS, **thresholds}["PRICE_HISTORY_DAYS"])
+
+    def detect(self, *, new_movements, inventory, batches, current_time) -> List[Dict]:
+        return detect_price_anomaly(inventory, current_time, self.thresholds, self.history)
 
 
 def generate_anomalies(
@@ -351,9 +348,23 @@ def generate_anomalies(
     current_time: datetime,
     existing_anomalies: List[Dict] = None,
     thresholds=DEFAULT_THRESHOLDS,
+    detectors: List = None,
+    new_movements: List[Dict] = None,
 ) -> List[Dict]:
+    """
+    Run all detectors and return anomalies not already in existing_anomalies.
+
+    `detectors` are stateful detectors (e.g. flow.PassThroughDetector) with an
+    `anomaly_types` attribute and a detect(*, new_movements, inventory, batches,
+    current_time) method. They keep their own state between cycles, so they
+    only get the movements added since the previous call (`new_movements`,
+    all movements if not given). A built-in detector is skipped when a
+    stateful detector covers its anomaly type.
+    """
 
     existing_anomalies = existing_anomalies or []
+    detectors = detectors or []
+    covered = {t for detector in detectors for t in detector.anomaly_types}
 
     # Create signatures of already-detected anomalies
     existing_signatures = set()
@@ -367,18 +378,34 @@ def generate_anomalies(
         existing_signatures.add(sig)
 
     all_detected = []
-    all_detected.extend(
-        detect_impossible_quantity(
-            movements, inventory, batches, current_time, thresholds
+    if "IMPOSSIBLE_QUANTITY" not in covered:
+        all_detected.extend(
+            detect_impossible_quantity(
+                movements, inventory, batches, current_time, thresholds
+            )
+        )
+    if "GEOGRAPHIC_IMPOSSIBILITY" not in covered:
+        all_detected.extend(
+            detect_geographic_impossibility(movements, facilities, current_time, thresholds)
+        )
+    if "GHOST_STOCK" not in covered:
+        all_detected.extend(detect_ghost_stock(inventory, movements, current_time))
+    if "UNAUTHORIZED_IMPORTER" not in covered:
+        all_detected.extend(detect_unauthorized_importer(batches, current_time))
+    if "DUPLICATE_BATCH_NUMBER" not in covered:
+        all_detected.extend(detect_duplicate_batch_number(batches, current_time, thresholds))
+    if "PRICE_ANOMALY" not in covered:
+        all_detected.extend(detect_price_anomaly(inventory, current_time, thresholds))
+
+    for detector in detectors:
+        all_detected.extend(
+            detector.detect(
+                new_movements=movements if new_movements is None else new_movements,
+                inventory=inventory,
+                batches=batches,
+                current_time=current_time,
+            )
         )
-    )
-    all_detected.extend(
-        detect_geographic_impossibility(movements, facilities, current_time, thresholds)
-    )
-    all_detected.extend(detect_ghost_stock(inventory, movements, current_time))
-    all_detected.extend(detect_unauthorized_importer(batches, current_time))
-    all_detected.extend(detect_duplicate_batch_number(batches, current_time))
-    all_detected.extend(detect_price_anomaly(inventory, current_time, thresholds))
 
     # fulter duplicates
     new_anomalies = []
@@ -0,0 +1,242 @@
+"""
+Exact and near-duplicate batch numbers.
+
+Counterfeiters rarely copy a batch number exactly; they use look-alikes
+(N0V-2024-0001 for NOV-2024-0001) or swap two digits. Batch numbers are
+reduced to a skeleton: upper case, separators dropped, and look-alike
+characters folded onto one (O -> 0, I/L -> 1, S -> 5, ...). Two numbers
+are near duplicates if their skeletons are equal while the raw numbers
+differ, or within FUZZY_BATCH_MAX_EDITS Damerau-Levenshtein edits of each
+other. Changing, adding, dropping or swapping digits costs two:
+NOV-2024-0001, NOV-2024-0002, NOV-2024-00012 and NOV-2024-0010 are just
+other batches off the same line, so with the default of one edit a
+swapped serial is only caught if it is also a look-alike.
+
+    >>> index = BatchNumberIndex()
+    >>> _ = index.add({"batch_id": "B1", "batch_number": "NOV-2024-0001"})
+    >>> _ = index.add({"batch_id": "B2", "batch_number": "NOV-2024-0012"})
+    >>> [(m["batch_id"], m["distance"], m["kind"]) for m in index.add({"batch_id": "B3", "batch_number": "N0V-2024-0001"})[1]]
+    [('B1', 0, 'LOOKALIKE')]
+    >>> index.add({"batch_id": "B4", "batch_number": "NOV-2024-0021"})[1]
+    []
+    >>> index.add({"batch_id": "B5", "batch_number": "NOV-2024-0002"})[1]
+    []
+
+Batches are indexed by manufacturer prefix (the skeleton's first segment,
+"N0V"), and within a prefix by their deletion neighbourhood: the skeleton
+with up to FUZZY_BATCH_MAX_EDITS characters deleted. Two skeletons within
+k edits always share a string with at most k deletions from each, so a new
+batch is only compared with batches it shares such a key with. Character
+n-grams don't narrow it down here: every NOV-2024-xxxx number shares most
+of its bigrams with every other one.
+"""
+
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from medguard.detection.anomalies import DEFAULT_THRESHOLDS, create_anomaly
+
+CONFUSABLES = str.maketrans({"O": "0", "Q": "0", "D": "0", "I": "1", "L": "1", "S": "5", "B": "8", "Z": "2", "G": "6"})
+
+SEPARATORS = re.compile(r"[^0-9A-Z]+")
+
+# a different serial, not a typo
+DIGIT_EDIT_COST = 2
+
+
+def skeleton(batch_number: str) -> Tuple[str, str]:
+    """(manufacturer prefix, skeleton) of a batch number."""
+    parts = [p for p in SEPARATORS.split(batch_number.upper()) if p]
+    if not parts:
+        return "", ""
+    folded = [p.translate(CONFUSABLES) for p in parts]
+    prefix = folded[0] if len(folded) > 1 else folded[0][:3]
+    return prefix, "".join(folded)
+
+
+def deletions(text: str, k: int) -> Set[str]:
+    """text with every choice of up to k characters deleted."""
+    keys = frontier = {text}
+    for _ in range(k):
+        frontier = {s[:i] + s[i + 1 :] for s in frontier for i in range(len(s))}
+        keys = keys | frontier
+    return keys
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Damerau-Levenshtein (optimal string alignment) distance between
+    skeletons, capped at limit + 1. Any edit touching only digits (adding,
+    dropping, changing or swapping them) costs DIGIT_EDIT_COST. Only the
+    band of cells within limit of the diagonal is filled in.
+
+    >>> edit_distance("N0V20240012", "N0V20240021", 2)
+    2
+    >>> edit_distance("N0VA1", "N0V1A", 1)
+    1
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    cost_a = [DIGIT_EDIT_COST if c.isdigit() else 1 for c in a]
+    cost_b = [DIGIT_EDIT_COST if c.isdigit() else 1 for c in b]
+
+    previous2: Optional[List[int]] = None
+    previous = [over] * (len(b) + 1)
+    previous[0] = 0
+    for j in range(1, min(len(b), limit) + 1):
+        previous[j] = min(over, previous[j - 1] + cost_b[j - 1])
+
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = min(over, previous[0] + cost_a[i - 1])
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            if a[i - 1] == b[j - 1]:
+                substitution = 0
+            else:
+                substitution = min(cost_a[i - 1], cost_b[j - 1])
+            value = min(
+                previous[j] + cost_a[i - 1],
+                current[j - 1] + cost_b[j - 1],
+                previous[j - 1] + substitution,
+            )
+            if (
+                previous2 is not None
+                and j > 1
+                and a[i - 1] == b[j - 2]
+                and a[i - 2] == b[j - 1]
+            ):
+                value = min(value, previous2[j - 2] + min(cost_a[i - 1], cost_a[i - 2]))
+            current[j] = min(over, value)
+        # a transposition can reach back two rows, so both have to be over
+        if min(current) >= over and min(previous) >= over:
+            return over
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class BatchNumberIndex:
+    """Stateful detector: picks up batches registered since the last call."""
+
+    anomaly_types = ("DUPLICATE_BATCH_NUMBER", "NEAR_DUPLICATE_BATCH_NUMBER")
+
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS):
+        self.max_edits = thresholds["FUZZY_BATCH_MAX_EDITS"]
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every indexed batch, e.g. when the batch list starts over."""
+        self.batches: Dict[str, Dict] = {}
+        self.skeletons: Dict[str, str] = {}
+        self.by_number: Dict[str, List[str]] = {}  # raw batch number -> batch ids
+        # (manufacturer prefix, skeleton minus up to max_edits characters) -> batch ids
+        self.neighbourhood: Dict[Tuple[str, str], List[str]] = {}
+        self.cursor = 0
+
+    def candidates(self, prefix: str, keys: Set[str]) -> Set[str]:
+        """Batch ids under prefix sharing a deletion key with keys."""
+        found = set()
+        for key in keys:
+            found.update(self.neighbourhood.get((prefix, key), ()))
+        return found
+
+    def add(self, batch: Dict) -> Tuple[List[str], List[Dict]]:
+        """Index a batch. Returns (exact duplicate ids, near duplicates)."""
+        batch_id, number = batch["batch_id"], batch["batch_number"]
+        prefix, text = skeleton(number)
+        keys = deletions(text, self.max_edits)
+
+        near = []
+        for other_id in sorted(self.candidates(prefix, keys)):
+            other = self.batches[other_id]
+            if other["batch_number"] == number:
+                continue  # exact duplicates are reported on their own
+            distance = edit_distance(text, self.skeletons[other_id], self.max_edits)
+            if distance <= self.max_edits:
+                near.append(
+                    {
+                        "batch_id": other_id,
+                        "batch_number": other["batch_number"],
+                        "distance": distance,
+                        "kind": "LOOKALIKE" if distance == 0 else "EDIT",
+                    }
+                )
+
+        self.batches[batch_id] = batch
+        self.skeletons[batch_id] = text
+        self.by_number.setdefault(number, []).append(batch_id)
+        for key in keys:
+            self.neighbourhood.setdefault((prefix, key), []).append(batch_id)
+
+        return self.by_number[number], near
+
+    def detect(
+        self,
+        *,
+        new_movements: List[Dict],
+        inventory: List[Dict],
+        batches: List[Dict],
+        current_time: datetime,
+    ) -> List[Dict]:
+        if len(batches) < self.cursor:
+            self.reset()
+        new_batches = batches[self.cursor :]
+        self.cursor = len(batches)
+
+        anomalies = []
+        duplicated = {}
+        for batch in new_batches:
+            if not batch.get("batch_number"):
+                continue
+            exact, near = self.add(batch)
+            if len(exact) > 1:
+                duplicated[batch["batch_number"]] = exact
+            if near:
+                anomalies.append(self._near_duplicate(batch, near, current_time))
+
+        for batch_number, batch_ids in duplicated.items():
+            anomalies.append(self._duplicate(batch_number, batch_ids, current_time))
+        return anomalies
+
+    def _duplicate(self, batch_number: str, batch_ids: List[str], current_time: datetime) -> Dict:
+        batch_list = [self.batches[b] for b in batch_ids]
+        return create_anomaly(
+            anomaly_type="DUPLICATE_BATCH_NUMBER",
+            severity="CRITICAL",
+            facility_id=None,
+            med_id=batch_list[0]["med_id"],
+            batch_id=batch_ids[0],
+            timestamp=current_time,
+            details=f"Batch number {batch_number} appears on {len(batch_list)} different batches",
+            evidence={
+                "batch_number": batch_number,
+                "duplicate_batch_ids": list(batch_ids),
+                "manufacturers": list(set(b["manufacturer_name"] for b in batch_list)),
+            },
+        )
+
+    def _near_duplicate(self, batch: Dict, near: List[Dict], current_time: datetime) -> Dict:
+        closest = min(near, key=lambda match: match["distance"])
+        return create_anomaly(
+            anomaly_type="NEAR_DUPLICATE_BATCH_NUMBER",
+            severity="HIGH" if closest["kind"] == "LOOKALIKE" else "MEDIUM",
+            facility_id=None,
+            med_id=batch["med_id"],
+            batch_id=batch["batch_id"],
+            timestamp=current_time,
+            details=(
+                f"Batch number {batch['batch_number']} looks like {closest['batch_number']}"
+                + (f" and {len(near) - 1} more" if len(near) > 1 else "")
+            ),
+            evidence={
+                "batch_number": batch["batch_number"],
+                "similar": near,
+                "duplicate_batch_ids": [batch["batch_id"]] + [m["batch_id"] for m in near],
+                "manufacturers": list(
+                    {batch["manufacturer_name"]}
+                    | {self.batches[m["batch_id"]]["manufacturer_name"] for m in near}
+                ),
+            },
+        )
@@ -0,0 +1,225 @@
+"""
+Correlate anomalies into incidents.
+
+Anomalies are linked when they share a batch, a batch number, an importer,
+a brand or a facility (see CorrelationEngine.link_keys for which anomaly
+types link on what). Linked anomalies form one incident, escalated as the
+README describes:
+
+    single anomaly                  -> FLAG_FOR_REVIEW
+    multiple correlated anomalies   -> POTENTIAL_COUNTERFEIT_INCIDENT
+    correlated across many sites    -> SUPPLY_CHAIN_COMPROMISE
+
+With a genealogy graph, incidents also list every facility their batches
+have passed through (exposed_facility_ids), i.e. where to look next.
+
+Clusters are kept in a union-find (path halving, union by size) keyed by
+the first anomaly seen for each linking key, so adding an anomaly costs a
+handful of near-constant finds and unions. Incident statistics live on the
+cluster root and are merged with the clusters.
+"""
+
+import sqlite3
+import uuid
+from typing import Dict, List, Optional
+
+from medguard.db.database import insert_incidents
+from medguard.detection.genealogy import GenealogyGraph
+from medguard.detection.reliability import SEVERITY_WEIGHTS, anomaly_facilities
+
+ESCALATION_LEVELS = [
+    "FLAG_FOR_REVIEW",
+    "POTENTIAL_COUNTERFEIT_INCIDENT",
+    "SUPPLY_CHAIN_COMPROMISE",
+]
+
+# anomaly types that are about an importer or a brand, linked on that too
+SUBJECT_KEYS = {
+    "UNAUTHORIZED_IMPORTER": "importer",
+    "PRICE_ANOMALY": "brand",
+}
+
+# distinct facilities a correlated cluster must span to count as a supply chain pattern
+SUPPLY_CHAIN_MIN_FACILITIES = 3
+
+
+class Incident:
+    def __init__(self, anomaly: Dict):
+        self.incident_id = f"INC_{uuid.uuid4().hex[:10].upper()}"
+        self.anomaly_ids = [anomaly["anomaly_id"]]
+        self.anomaly_types = {anomaly["anomaly_type"]}
+        self.facility_ids = set(anomaly_facilities(anomaly))
+        self.batch_ids = {anomaly["batch_id"]} if anomaly.get("batch_id") else set()
+        self.max_severity = anomaly.get("severity")
+        self.first_seen = self.last_seen = anomaly.get("timestamp")
+        self.merged_into: Optional[str] = None
+
+    def absorb(self, other: "Incident") -> None:
+        self.anomaly_ids.extend(other.anomaly_ids)
+        self.anomaly_types |= other.anomaly_types
+        self.facility_ids |= other.facility_ids
+        self.batch_ids |= other.batch_ids
+        if SEVERITY_WEIGHTS.get(other.max_severity, 0) > SEVERITY_WEIGHTS.get(self.max_severity, 0):
+            self.max_severity = other.max_severity
+        self.first_seen = min(filter(None, [self.first_seen, other.first_seen]), default=None)
+        self.last_seen = max(filter(None, [self.last_seen, other.last_seen]), default=None)
+        other.merged_into = self.incident_id
+
+    @property
+    def escalation_level(self) -> str:
+        if len(self.anomaly_ids) == 1:
+            return "FLAG_FOR_REVIEW"
+        if len(self.facility_ids) >= SUPPLY_CHAIN_MIN_FACILITIES:
+            return "SUPPLY_CHAIN_COMPROMISE"
+        return "POTENTIAL_COUNTERFEIT_INCIDENT"
+
+    def to_dict(self) -> Dict:
+        return {
+            "incident_id": self.incident_id,
+            "escalation_level": self.escalation_level,
+            "status": "MERGED" if self.merged_into else "OPEN",
+            "merged_into": self.merged_into,
+            "anomaly_count": len(self.anomaly_ids),
+            "anomaly_ids": self.anomaly_ids,
+            "anomaly_types": sorted(self.anomaly_types),
+            "facility_ids": sorted(self.facility_ids),
+            "batch_ids": sorted(self.batch_ids),
+            "max_severity": self.max_severity,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+        }
+
+
+class CorrelationEngine:
+    def __init__(self, batches: List[Dict], genealogy: Optional[GenealogyGraph] = None):
+        self.batch_lookup = {b["batch_id"]: b for b in batches}
+        self.genealogy = genealogy
+
+        self.parent: Dict[str, str] = {}  # anomaly_id -> parent anomaly_id
+        self.size: Dict[str, int] = {}
+        self.key_owner: Dict[tuple, str] = {}  # linking key -> first anomaly with it
+        self.incident_at_root: Dict[str, Incident] = {}
+        self._dirty: Dict[str, Incident] = {}
+        self._saved = set()
+
+    def link_keys(self, anomaly: Dict) -> List[tuple]:
+        """
+        Keys an anomaly is linked on. Batch and batch number always link.
+        Facility only links anomalies recorded at that facility, not ones
+        that merely mention it: a geographic anomaly names two busy
+        facilities and would otherwise chain everything together. Importer
+        and brand only link the anomaly types they are the subject of.
+        """
+        keys = []
+        if anomaly.get("facility_id"):
+            keys.append(("facility", anomaly["facility_id"]))
+
+        evidence = anomaly.get("evidence") or {}
+        batch_ids = [anomaly.get("batch_id")]
+        if isinstance(evidence, dict):
+            batch_ids += evidence.get("duplicate_batch_ids") or []
+
+        for batch_id in filter(None, dict.fromkeys(batch_ids)):
+            keys.append(("batch", batch_id))
+            batch = self.batch_lookup.get(batch_id)
+            if batch is None:
+                continue
+            if batch.get("batch_number"):
+                keys.append(("batch_number", batch["batch_number"]))
+            subject = SUBJECT_KEYS.get(anomaly["anomaly_type"])
+            if subject and batch.get(f"{subject}_id"):
+                keys.append((subject, batch[f"{subject}_id"]))
+        return keys
+
+    def find(self, anomaly_id: str) -> str:
+        parent = self.parent
+        while parent[anomaly_id] != anomaly_id:
+            parent[anomaly_id] = parent[parent[anomaly_id]]
+            anomaly_id = parent[anomaly_id]
+        return anomaly_id
+
+    def _union(self, a: str, b: str) -> str:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return root_a
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+
+        keep = self.incident_at_root[root_a]
+        absorbed = self.incident_at_root.pop(root_b)
+        keep.absorb(absorbed)
+        self._dirty[keep.incident_id] = keep
+        self._dirty[absorbed.incident_id] = absorbed
+        return root_a
+
+    def add(self, anomalies: List[Dict]) -> List[Dict]:
+        """Fold new anomalies into the clusters. Returns the incidents that changed."""
+        changed = {}
+        for anomaly in anomalies:
+            anomaly_id = anomaly["anomaly_id"]
+            if anomaly_id in self.parent:
+                continue
+
+            self.parent[anomaly_id] = anomaly_id
+            self.size[anomaly_id] = 1
+            incident = Incident(anomaly)
+            self.incident_at_root[anomaly_id] = incident
+            self._dirty[incident.incident_id] = incident
+
+            root = anomaly_id
+            for key in self.link_keys(anomaly):
+                owner = self.key_owner.setdefault(key, anomaly_id)
+                if owner != anomaly_id:
+                    root = self._union(root, owner)
+
+            current = self.incident_at_root[root]
+            changed[current.incident_id] = current
+
+        return [
+            self._describe(incident)
+            for incident in changed.values()
+            if incident.merged_into is None
+        ]
+
+    def _describe(self, incident: Incident) -> Dict:
+        record = incident.to_dict()
+        if self.genealogy is not None:
+            record["exposed_facility_ids"] = sorted(
+                {
+                    sighting["facility_id"]
+                    for batch_id in incident.batch_ids
+                    for sighting in self.genealogy.facilities_of(batch_id)
+                }
+            )
+        return record
+
+    def incident_for(self, anomaly_id: str) -> Optional[Dict]:
+        if anomaly_id not in self.parent:
+            return None
+        return self._describe(self.incident_at_root[self.find(anomaly_id)])
+
+    def incidents(self) -> List[Dict]:
+        """Open incidents, most escalated first."""
+        open_incidents = [self._describe(incident) for incident in self.incident_at_root.values()]
+        open_incidents.sort(
+            key=lambda i: (ESCALATION_LEVELS.index(i["escalation_level"]), i["anomaly_count"]),
+            reverse=True,
+        )
+        return open_incidents
+
+    def save(self, conn: sqlite3.Connection) -> None:
+        """Persist incidents that changed since the last save."""
+        if not self._dirty:
+            return
+        # an anomaly that joined an existing incident right away never needs its own row
+        incidents = [
+            incident
+            for incident in self._dirty.values()
+            if incident.merged_into is None or incident.incident_id in self._saved
+        ]
+        insert_incidents([self._describe(incident) for incident in incidents], conn)
+        self._saved.update(incident.incident_id for incident in incidents)
+        self._dirty.clear()
+
@@ -0,0 +1,174 @@
+"""
+Chain-of-custody verification.
+
+Stock is legitimately at a facility if it either
+
+- arrived by RESTOCK (supply from the batch's importer) and that importer
+  is authorized for the manufacturer, or
+- arrived by TRANSFER_IN from a facility that itself held the batch
+  legitimately, with a matching TRANSFER_OUT (same transfer_id) there.
+
+Verified (facility, batch) custody is memoized, so a transfer is checked
+against its sender in O(1) instead of walking the chain back to the
+importer. A receipt whose sender's records haven't arrived yet waits on
+exactly that record and is re-checked when it shows up; receipts still
+unresolved after CUSTODY_GRACE_HOURS, or resolved to a bad lineage, are
+flagged as UNVERIFIED_CUSTODY.
+"""
+
+import heapq
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from medguard.detection.anomalies import (
+    DEFAULT_THRESHOLDS,
+    create_anomaly,
+    importer_is_authorized,
+)
+
+VERIFIED = "VERIFIED"
+UNAUTHORIZED = "UNAUTHORIZED"
+
+
+class CustodyDetector:
+    """Stateful detector: feed it each cycle's new movements."""
+
+    anomaly_types = ("UNVERIFIED_CUSTODY",)
+
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS):
+        self.grace = timedelta(hours=thresholds["CUSTODY_GRACE_HOURS"])
+        self.batch_authorized: Dict[str, bool] = {}
+
+        self.custody: Dict[Tuple[str, str], str] = {}  # (facility, batch) -> state
+        self.transfer_outs: Dict[str, Tuple[str, str]] = {}  # transfer_id -> (facility, batch)
+
+        # receipts waiting on a record: ("custody", (facility, batch)) or ("transfer", id)
+        self.waiting: Dict[tuple, List[Dict]] = {}
+        self.pending: Dict[str, Dict] = {}  # movement_id -> receipt
+        self.deadlines = []  # (deadline, movement_id)
+
+        self._found: List[Tuple[Dict, str]] = []
+        self.seeded = False
+
+    def _seed(self, inventory: List[Dict], batches: List[Dict]) -> None:
+        # opening stock has no RESTOCK on record; it is as good as its importer
+        for inv in inventory:
+            key = (inv["facility_id"], inv["batch_id"])
+            if key not in self.custody:
+                self.custody[key] = VERIFIED if self._authorized(inv["batch_id"], batches) else UNAUTHORIZED
+        self.seeded = True
+
+    def _authorized(self, batch_id: str, batches: List[Dict]) -> bool:
+        if batch_id not in self.batch_authorized:
+            # new batch ids are rare; refresh the whole lookup when one shows up
+            for batch in batches:
+                if batch["batch_id"] not in self.batch_authorized:
+                    self.batch_authorized[batch["batch_id"]] = importer_is_authorized(batch)
+            # unknown batches have no importer to vouch for them
+            self.batch_authorized.setdefault(batch_id, False)
+        return self.batch_authorized[batch_id]
+
+    def _set_custody(self, key: Tuple[str, str], state: str) -> None:
+        if self.custody.get(key) == VERIFIED:
+            return
+        self.custody[key] = state
+        self._wake(("custody", key))
+
+    def _wake(self, dependency: tuple) -> None:
+        for receipt in self.waiting.pop(dependency, []):
+            if receipt["movement_id"] in self.pending:
+                self._check_receipt(receipt)
+
+    def _flag(self, receipt: Dict, reason: str) -> None:
+        self.pending.pop(receipt["movement_id"], None)
+        self._found.append((receipt, reason))
+
+    def _check_receipt(self, receipt: Dict) -> None:
+        facility_id, batch_id = receipt["facility_id"], receipt["batch_id"]
+        source_id = receipt.get("source_facility_id")
+        transfer_id = receipt.get("transfer_id")
+
+        if not source_id or not transfer_id:
+            self._set_custody((facility_id, batch_id), UNAUTHORIZED)
+            self._flag(receipt, "Transfer receipt names no sending facility")
+            return
+
+        sender = self.transfer_outs.get(transfer_id)
+        if sender is None:
+            self.waiting.setdefault(("transfer", transfer_id), []).append(receipt)
+            return
+        if sender != (source_id, batch_id):
+            self._set_custody((facility_id, batch_id), UNAUTHORIZED)
+            self._flag(receipt, f"Transfer {transfer_id} was sent by {sender[0]} for {sender[1]}")
+            return
+
+        state = self.custody.get((source_id, batch_id))
+        if state is None:
+            self.waiting.setdefault(("custody", (source_id, batch_id)), []).append(receipt)
+            return
+
+        self.pending.pop(receipt["movement_id"], None)
+        self._set_custody((facility_id, batch_id), state)
+        if state != VERIFIED:
+            self._found.append((receipt, f"Lineage through {source_id} has no authorized source"))
+
+    def detect(
+        self,
+        *,
+        new_movements: List[Dict],
+        inventory: List[Dict],
+        batches: List[Dict],
+        current_time: datetime,
+    ) -> List[Dict]:
+        self._found = []
+        if not self.seeded:
+            self._seed(inventory, batches)
+
+        # senders are normally logged before receivers, so time order resolves
+        # chains within a cycle without waiting
+        for mov in sorted(new_movements, key=lambda m: m["timestamp"]):
+            movement_type = mov["movement_type"]
+            batch_id = mov.get("batch_id")
+            if not batch_id or not mov.get("facility_id"):
+                continue
+
+            if movement_type == "RESTOCK":
+                state = VERIFIED if self._authorized(batch_id, batches) else UNAUTHORIZED
+                self._set_custody((mov["facility_id"], batch_id), state)
+            elif movement_type == "TRANSFER_OUT" and mov.get("transfer_id"):
+                self.transfer_outs[mov["transfer_id"]] = (mov["facility_id"], batch_id)
+                self._wake(("transfer", mov["transfer_id"]))
+            elif movement_type == "TRANSFER_IN":
+                self.pending[mov["movement_id"]] = mov
+                heapq.heappush(
+                    self.deadlines,
+                    (datetime.fromisoformat(mov["timestamp"]) + self.grace, mov["movement_id"]),
+                )
+                self._check_receipt(mov)
+
+        # receipts whose sender records never turned up
+        while self.deadlines and self.deadlines[0][0] <= current_time:
+            _, movement_id = heapq.heappop(self.deadlines)
+            receipt = self.pending.get(movement_id)
+            if receipt is not None:
+                self._flag(receipt, "No transfer or custody record from the sending facility")
+
+        return [self._anomaly(receipt, reason, current_time) for receipt, reason in self._found]
+
+    def _anomaly(self, receipt: Dict, reason: str, current_time: datetime) -> Dict:
+        return create_anomaly(
+            anomaly_type="UNVERIFIED_CUSTODY",
+            severity="HIGH",
+            facility_id=receipt["facility_id"],
+            med_id=receipt.get("med_id"),
+            batch_id=receipt["batch_id"],
+            timestamp=current_time,
+            details=f"Received {abs(receipt['quantity_change'])} units without verifiable custody: {reason}",
+            evidence={
+                "movement_id": receipt["movement_id"],
+                "source_facility_id": receipt.get("source_facility_id"),
+                "transfer_id": receipt.get("transfer_id"),
+                "received_at": receipt["timestamp"],
+                "reason": reason,
+            },
+        )
@@ -0,0 +1,206 @@
+"""
+Pass-through ("rapid turnover") detection.
+
+A facility laundering illegitimate stock receives it and moves it on
+without ever dispensing it to patients. Per (facility, med) this keeps a
+rolling window of:
+
+    inflow      RESTOCK, TRANSFER_IN
+    outflow     TRANSFER_OUT, DISPENSE (kept apart)
+    dwell       how long transferred-out units sat on the shelf
+
+Dwell pairs each transfer out with the most recent receipts (newest lot
+first), while dispenses and withdrawals draw down the oldest stock, as a
+pharmacy shelf does. Charging transfers to the oldest lots instead would
+match a receive-and-forward to stock that had been there since before the
+window and hide it behind a long average dwell.
+
+The window is a deque of fixed-size time buckets with running totals, so a
+new movement updates one bucket and expired buckets drop off the front:
+each cycle costs O(new movements), and only (facility, med) pairs touched
+this cycle are re-checked.
+"""
+
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from medguard.detection.anomalies import DEFAULT_THRESHOLDS, create_anomaly
+
+BUCKET_HOURS = 6
+
+INFLOW_TYPES = {"RESTOCK", "TRANSFER_IN"}
+
+
+def _hours(timestamp) -> float:
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.timestamp() / 3600
+
+
+class FlowWindow:
+    """Rolling inflow/outflow totals and stock lots for one (facility, med)."""
+
+    FIELDS = ("inflow", "transfer_out", "dispensed", "dwell_unit_hours")
+
+    def __init__(self, window_hours: float, bucket_hours: float):
+        self.max_buckets = max(1, int(window_hours // bucket_hours))
+        self.bucket_hours = bucket_hours
+        self.buckets = deque()  # [bucket_index, inflow, transfer_out, dispensed, dwell_unit_hours]
+        self.totals = [0.0, 0.0, 0.0, 0.0]
+        self.lots = deque()  # [arrival_hour, units] in arrival order
+        self.latest_hour = float("-inf")
+
+    def _bucket(self, hour: float) -> Optional[list]:
+        """The bucket for hour, or None if hour is older than the window."""
+        index = int(hour // self.bucket_hours)
+        if not self.buckets or self.buckets[-1][0] < index:
+            self.buckets.append([index, 0.0, 0.0, 0.0, 0.0])
+            return self.buckets[-1]
+        # late movement: credit it to the bucket it belongs to, if still in the window
+        if index <= self.buckets[-1][0] - self.max_buckets:
+            return None
+        position = len(self.buckets)
+        while position > 0 and self.buckets[position - 1][0] > index:
+            position -= 1
+        if position > 0 and self.buckets[position - 1][0] == index:
+            return self.buckets[position - 1]
+        bucket = [index, 0.0, 0.0, 0.0, 0.0]
+        self.buckets.insert(position, bucket)
+        return bucket
+
+    def _evict(self) -> None:
+        if not self.buckets:
+            return
+        oldest = self.buckets[-1][0] - self.max_buckets + 1
+        while self.buckets[0][0] < oldest:
+            expired = self.buckets.popleft()
+            for i in range(4):
+                self.totals[i] -= expired[i + 1]
+
+    def _consume(self, units: float, hour: float, newest_first: bool = False) -> float:
+        """Take units off the oldest (or newest) lots; returns unit-hours of dwell."""
+        dwell = 0.0
+        end = -1 if newest_first else 0
+        while units > 0 and self.lots:
+            lot = self.lots[end]
+            taken = min(units, lot[1])
+            dwell += taken * max(0.0, hour - lot[0])
+            lot[1] -= taken
+            units -= taken
+            if lot[1] <= 0:
+                if newest_first:
+                    self.lots.pop()
+                else:
+                    self.lots.popleft()
+        # stock older than anything seen counts as having sat a full window
+        return dwell + units * self.max_buckets * self.bucket_hours
+
+    def add(self, movement_type: str, units: float, hour: float) -> None:
+        bucket = self._bucket(hour)
+        if bucket is None:
+            return
+        self.latest_hour = max(self.latest_hour, hour)
+
+        if movement_type in INFLOW_TYPES:
+            bucket[1] += units
+            self.totals[0] += units
+            self.lots.append([hour, units])
+        elif movement_type == "TRANSFER_OUT":
+            dwell = self._consume(units, hour, newest_first=True)
+            bucket[2] += units
+            bucket[4] += dwell
+            self.totals[1] += units
+            self.totals[3] += dwell
+        elif movement_type == "DISPENSE":
+            self._consume(units, hour)
+            bucket[3] += units
+            self.totals[2] += units
+        else:
+            self._consume(units, hour)
+
+        self._evict()
+
+    def summary(self) -> Dict[str, float]:
+        inflow, transfer_out, dispensed, dwell = self.totals
+        return {
+            "inflow": inflow,
+            "transfer_out": transfer_out,
+            "dispensed": dispensed,
+            "mean_dwell_hours": dwell / transfer_out if transfer_out else None,
+        }
+
+
+class PassThroughDetector:
+    """Stateful detector: feed it each cycle's new movements."""
+
+    anomaly_types = ("RAPID_TURNOVER",)
+
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS, bucket_hours: float = BUCKET_HOURS):
+        self.thresholds = thresholds
+        self.window_hours = thresholds["RAPID_TURNOVER_WINDOW_HOURS"]
+        self.bucket_hours = bucket_hours
+        self.windows: Dict[Tuple[str, str], FlowWindow] = {}
+
+    def _window(self, key: Tuple[str, str]) -> FlowWindow:
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = FlowWindow(self.window_hours, self.bucket_hours)
+        return window
+
+    def detect(
+        self,
+        *,
+        new_movements: List[Dict],
+        inventory: List[Dict],
+        batches: List[Dict],
+        current_time: datetime,
+    ) -> List[Dict]:
+        touched = set()
+        for mov in new_movements:
+            med_id = mov.get("med_id")
+            if not med_id or not mov.get("facility_id"):
+                continue
+            key = (mov["facility_id"], med_id)
+            units = abs(mov.get("quantity_change") or 0)
+            self._window(key).add(mov["movement_type"], units, _hours(mov["timestamp"]))
+            touched.add(key)
+
+        min_units = self.thresholds["RAPID_TURNOVER_MIN_UNITS"]
+        min_ratio = self.thresholds["RAPID_TURNOVER_RATIO"]
+        max_dwell = self.thresholds["RAPID_TURNOVER_MAX_DWELL_HOURS"]
+
+        anomalies = []
+        for facility_id, med_id in touched:
+            flow = self.windows[(facility_id, med_id)].summary()
+            transfer_out = flow["transfer_out"]
+            if transfer_out < min_units:
+                continue
+            ratio = transfer_out / max(flow["dispensed"], 1)
+            if ratio < min_ratio or flow["mean_dwell_hours"] > max_dwell:
+                continue
+
+            anomalies.append(
+                create_anomaly(
+                    anomaly_type="RAPID_TURNOVER",
+                    severity="HIGH",
+                    facility_id=facility_id,
+                    med_id=med_id,
+                    timestamp=current_time,
+                    details=(
+                        f"Transferred out {transfer_out:.0f} units vs {flow['dispensed']:.0f} "
+                        f"dispensed in {self.window_hours}h, average shelf time "
+                        f"{flow['mean_dwell_hours']:.1f}h"
+                    ),
+                    evidence={
+                        "window_hours": self.window_hours,
+                        "inflow": flow["inflow"],
+                        "transfer_out": transfer_out,
+                        "dispensed": flow["dispensed"],
+                        "transfer_dispense_ratio": round(ratio, 2),
+                        "mean_dwell_hours": round(flow["mean_dwell_hours"], 2),
+                    },
+                )
+            )
+
+        return anomalies
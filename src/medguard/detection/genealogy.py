@@ -0,0 +1,320 @@
+"""
+Batch genealogy graph.
+
+Answers "where else has this batch, or any batch with the same batch number
+or importer, been?" without joining movements, batches and companies on
+every question. Nodes are batches, facilities, importers and batch numbers:
+
+    batch -- facility       first and last time the batch was seen there
+    batch -- importer
+    batch -- batch_number
+
+Adjacency is stored CSR style in flat `array`s (row offsets, sorted
+neighbour ids, first/last timestamps as epoch seconds), which keeps the
+graph compact and lets edge updates find their slot by bisection. New edges
+go to a small delta buffer that is merged into the arrays once it grows
+past COMPACT_RATIO of the graph, so updates stay cheap while reads see
+both.
+"""
+
+import sqlite3
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# merge the delta buffer into the CSR arrays when it reaches this share of the edges
+COMPACT_RATIO = 0.1
+COMPACT_MIN_EDGES = 1024
+
+NO_TIME = float("inf")
+
+# batch attributes that link batches to each other in exposure queries
+DEFAULT_VIA = ("batch_number", "importer")
+
+
+def _epoch(timestamp) -> float:
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+@lru_cache(maxsize=65536)
+def _iso(seconds: float) -> Optional[str]:
+    if seconds in (NO_TIME, -NO_TIME):
+        return None
+    return datetime.fromtimestamp(seconds).isoformat()
+
+
+class GenealogyGraph:
+    def __init__(self):
+        self.node_ids: Dict[Tuple[str, str], int] = {}
+        self.node_kinds: List[str] = []
+        self.node_keys: List[str] = []
+
+        # CSR arrays: row u is targets[offsets[u]:offsets[u + 1]], sorted
+        self.offsets = array("q", [0])
+        self.targets = array("q")
+        self.first_seen = array("d")
+        self.last_seen = array("d")
+
+        # edges added since the last compaction: u -> {v: [first, last]}
+        self.delta: Dict[int, Dict[int, List[float]]] = defaultdict(dict)
+        self.delta_edges = 0
+
+        self.last_movement_rowid = 0
+        self.last_batch_rowid = 0
+
+    # building
+
+    def node(self, kind: str, key: str) -> int:
+        node_id = self.node_ids.get((kind, key))
+        if node_id is None:
+            node_id = len(self.node_kinds)
+            self.node_ids[(kind, key)] = node_id
+            self.node_kinds.append(kind)
+            self.node_keys.append(key)
+        return node_id
+
+    def _row(self, u: int) -> Tuple[int, int]:
+        if u + 1 >= len(self.offsets):
+            return 0, 0
+        return self.offsets[u], self.offsets[u + 1]
+
+    def _touch(self, u: int, v: int, t: float) -> None:
+        lo, hi = self._row(u)
+        i = bisect_left(self.targets, v, lo, hi)
+        if i < hi and self.targets[i] == v:
+            if t != NO_TIME:
+                if t < self.first_seen[i]:
+                    self.first_seen[i] = t
+                if self.last_seen[i] == -NO_TIME or t > self.last_seen[i]:
+                    self.last_seen[i] = t
+            return
+
+        edge = self.delta[u].get(v)
+        if edge is None:
+            self.delta[u][v] = [t, t if t != NO_TIME else -NO_TIME]
+            self.delta_edges += 1
+        elif t != NO_TIME:
+            edge[0] = min(edge[0], t)
+            edge[1] = max(edge[1], t)
+
+    def add_edge(self, u: int, v: int, timestamp=None) -> None:
+        t = NO_TIME if timestamp is None else _epoch(timestamp)
+        self._touch(u, v, t)
+        self._touch(v, u, t)
+
+    def add_batches(self, batches: List[Dict]) -> None:
+        for batch in batches:
+            batch_node = self.node("batch", batch["batch_id"])
+            if batch.get("importer_id"):
+                self.add_edge(batch_node, self.node("importer", batch["importer_id"]))
+            if batch.get("batch_number"):
+                self.add_edge(batch_node, self.node("batch_number", batch["batch_number"]))
+        self._maybe_compact()
+
+    def add_movements(self, movements: List[Dict]) -> None:
+        for mov in movements:
+            if not mov.get("batch_id") or not mov.get("facility_id"):
+                continue
+            self.add_edge(
+                self.node("batch", mov["batch_id"]),
+                self.node("facility", mov["facility_id"]),
+                mov["timestamp"],
+            )
+        self._maybe_compact()
+
+    def _maybe_compact(self) -> None:
+        if self.delta_edges >= max(COMPACT_MIN_EDGES, COMPACT_RATIO * len(self.targets)):
+            self.compact()
+
+    def compact(self) -> None:
+        """Merge the delta buffer into the CSR arrays."""
+        offsets = array("q", [0])
+        targets = array("q")
+        first_seen = array("d")
+        last_seen = array("d")
+
+        for u in range(len(self.node_kinds)):
+            lo, hi = self._row(u)
+            row = {self.targets[i]: (self.first_seen[i], self.last_seen[i]) for i in range(lo, hi)}
+            for v, (first, last) in self.delta.get(u, {}).items():
+                row[v] = (first, last)
+            for v in sorted(row):
+                targets.append(v)
+                first_seen.append(row[v][0])
+                last_seen.append(row[v][1])
+            offsets.append(len(targets))
+
+        self.offsets, self.targets = offsets, targets
+        self.first_seen, self.last_seen = first_seen, last_seen
+        self.delta = defaultdict(dict)
+        self.delta_edges = 0
+
+    # loading from the database
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection) -> "GenealogyGraph":
+        graph = cls()
+        graph.sync(conn)
+        return graph
+
+    def sync(self, conn: sqlite3.Connection) -> None:
+        """Add batches and movements stored since the last sync."""
+        batches = conn.execute(
+            """
+            SELECT rowid, batch_id, importer_id, batch_number
+            FROM batches WHERE rowid > ? ORDER BY rowid
+            """,
+            (self.last_batch_rowid,),
+        ).fetchall()
+        if batches:
+            self.add_batches([dict(row) for row in batches])
+            self.last_batch_rowid = batches[-1]["rowid"]
+
+        # one row per batch and facility, however many movements there are
+        spans = conn.execute(
+            """
+            SELECT batch_id, facility_id,
+                   MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen,
+                   MAX(rowid) AS max_rowid
+            FROM movements
+            WHERE rowid > ?
+            GROUP BY batch_id, facility_id
+            """,
+            (self.last_movement_rowid,),
+        ).fetchall()
+        for row in spans:
+            self.last_movement_rowid = max(self.last_movement_rowid, row["max_rowid"])
+            if not row["batch_id"] or not row["facility_id"]:
+                continue
+            u = self.node("batch", row["batch_id"])
+            v = self.node("facility", row["facility_id"])
+            self.add_edge(u, v, row["first_seen"])
+            self.add_edge(u, v, row["last_seen"])
+        self._maybe_compact()
+
+    # traversal
+
+    def adjacent(self, u: int) -> List[int]:
+        """Neighbour ids of u, without edge data (a slice copy, so cheap)."""
+        lo, hi = self._row(u)
+        ids = self.targets[lo:hi].tolist()
+        if u in self.delta:
+            ids.extend(self.delta[u])
+        return ids
+
+    def neighbors(self, u: int, kind: Optional[str] = None) -> Iterator[Tuple[int, float, float]]:
+        """(neighbour, first_seen, last_seen) for every edge of u."""
+        lo, hi = self._row(u)
+        kinds = self.node_kinds
+        for i in range(lo, hi):
+            v = self.targets[i]
+            if kind is None or kinds[v] == kind:
+                yield v, self.first_seen[i], self.last_seen[i]
+        for v, (first, last) in self.delta.get(u, {}).items():
+            if kind is None or kinds[v] == kind:
+                yield v, first, last
+
+    def related_batches(
+        self, batch_id: str, via=DEFAULT_VIA, max_hops: int = 1
+    ) -> Dict[str, Dict]:
+        """
+        Batches reachable from batch_id through shared attributes (batch
+        number, importer), up to max_hops batch-to-batch steps.
+        """
+        start = self.node_ids.get(("batch", batch_id))
+        if start is None:
+            return {}
+
+        kinds, keys = self.node_kinds, self.node_keys
+        related = {}
+        seen = {start}
+        queue = deque([(start, 0)])
+        while queue:
+            u, hops = queue.popleft()
+            if hops == max_hops:
+                continue
+            for attribute in self.adjacent(u):
+                if kinds[attribute] not in via or attribute in seen:
+                    continue
+                seen.add(attribute)
+                for v in self.adjacent(attribute):
+                    if v in seen or kinds[v] != "batch":
+                        continue
+                    seen.add(v)
+                    related[keys[v]] = {
+                        "hops": hops + 1,
+                        "via": f"{kinds[attribute]}:{keys[attribute]}",
+                    }
+                    queue.append((v, hops + 1))
+        return related
+
+    def _facility_spans(self, batch_node: int) -> List[Tuple[int, float, float]]:
+        # hot path of exposure queries: plain indexing instead of neighbors()
+        lo, hi = self._row(batch_node)
+        kinds, targets = self.node_kinds, self.targets
+        first_seen, last_seen = self.first_seen, self.last_seen
+        spans = [
+            (targets[i], first_seen[i], last_seen[i])
+            for i in range(lo, hi)
+            if kinds[targets[i]] == "facility"
+        ]
+        for v, (first, last) in self.delta.get(batch_node, {}).items():
+            if kinds[v] == "facility":
+                spans.append((v, first, last))
+        return spans
+
+    def facilities_of(self, batch_id: str) -> List[Dict]:
+        u = self.node_ids.get(("batch", batch_id))
+        if u is None:
+            return []
+        return [
+            {
+                "facility_id": self.node_keys[v],
+                "first_seen": _iso(first),
+                "last_seen": _iso(last),
+            }
+            for v, first, last in self._facility_spans(u)
+        ]
+
+    def exposure(self, batch_id: str, via=DEFAULT_VIA, max_hops: int = 1) -> Dict:
+        """
+        Every facility that held batch_id or a batch related to it, with the
+        first and last time any of those batches was seen there.
+        """
+        related = self.related_batches(batch_id, via, max_hops)
+
+        # aggregate on raw node ids and epoch seconds; format once per facility
+        spans: Dict[int, List] = {}
+        for b in [batch_id, *related]:
+            u = self.node_ids.get(("batch", b))
+            if u is None:  # unknown batch_id
+                continue
+            for v, first, last in self._facility_spans(u):
+                span = spans.get(v)
+                if span is None:
+                    spans[v] = [first, last, [b]]
+                else:
+                    span[0] = min(span[0], first)
+                    span[1] = max(span[1], last)
+                    span[2].append(b)
+
+        facilities = [
+            {
+                "facility_id": self.node_keys[v],
+                "first_seen": _iso(first),
+                "last_seen": _iso(last),
+                "batch_ids": batch_ids,
+            }
+            for v, (first, last, batch_ids) in sorted(spans.items(), key=lambda item: item[1][0])
+        ]
+        return {
+            "batch_id": batch_id,
+            "related_batches": [{"batch_id": b, **info} for b, info in related.items()],
+            "facility_count": len(facilities),
+            "facilities": facilities,
+        }
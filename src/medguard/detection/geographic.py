@@ -0,0 +1,234 @@
+"""
+Geographic impossibility over a sliding window.
+
+Comparing only consecutive sightings of a batch misses A -> B -> C where A
+and C are far apart but each hop looks plausible, so every new RESTOCK
+sighting is checked against all sightings of the same batch in the last
+GEOGRAPHIC_IMPOSSIBLE_HOURS.
+
+Per batch the window buckets sightings by a coarse lat/lon grid, each
+bucket sorted by time so expired sightings are cut off the front and the
+ones within the window are found by bisection. The cell size is a third
+of GEOGRAPHIC_IMPOSSIBLE_KM, so any two points in the same or neighbouring
+cells are less than the threshold apart: those cells are skipped without
+computing a single distance, and only sightings in cells further out are
+compared with haversine.
+
+With a TravelTimeModel (utils/travel.py) the rule is road time instead of
+a flat distance: a pair is impossible if the gap between the sightings is
+shorter than GEOGRAPHIC_TRAVEL_TOLERANCE times the road travel time (for
+facilities at least GEOGRAPHIC_MIN_TRAVEL_HOURS apart). Cells
+are then the road nodes facilities snap to, and the node-to-node travel
+time bounds how far back in each cell's time-sorted list to look.
+"""
+
+import math
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from medguard.detection.anomalies import DEFAULT_THRESHOLDS, create_anomaly, haversine_km
+from medguard.utils.travel import TravelTimeModel
+
+KM_PER_DEGREE = 111.0
+
+
+def _hours(timestamp) -> float:
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp.timestamp() / 3600
+
+
+class BatchWindow:
+    """Recent sightings of one batch, bucketed by grid cell and sorted by time."""
+
+    def __init__(self):
+        self.cells: Dict[Hashable, List[Tuple[float, str]]] = {}
+        self.latest = float("-inf")
+
+    def add(self, hour: float, facility_id: str, cell: Hashable) -> None:
+        # restocks are logged ahead of time, so arrivals are not in time order
+        insort(self.cells.setdefault(cell, []), (hour, facility_id))
+        self.latest = max(self.latest, hour)
+
+    def evict(self, before_hour: float) -> None:
+        for cell in list(self.cells):
+            sightings = self.cells[cell]
+            cut = bisect_left(sightings, (before_hour,))
+            if cut == len(sightings):
+                del self.cells[cell]
+            elif cut:
+                del sightings[:cut]
+
+
+class GeographicDetector:
+    """Stateful detector: feed it each cycle's new movements."""
+
+    anomaly_types = ("GEOGRAPHIC_IMPOSSIBILITY",)
+
+    def __init__(
+        self,
+        facilities: List[Dict],
+        thresholds=DEFAULT_THRESHOLDS,
+        travel: Optional[TravelTimeModel] = None,
+    ):
+        self.max_km = thresholds["GEOGRAPHIC_IMPOSSIBLE_KM"]
+        self.cell_degrees = self.max_km / 3 / KM_PER_DEGREE
+        self.facility_lookup = {f["facility_id"]: f for f in facilities}
+        self.windows: Dict[str, BatchWindow] = {}
+
+        self.travel = travel
+        if travel is None:
+            self.window_hours = thresholds["GEOGRAPHIC_IMPOSSIBLE_HOURS"]
+        else:
+            travel.add_facilities(facilities)
+            self.tolerance = thresholds["GEOGRAPHIC_TRAVEL_TOLERANCE"]
+            self.min_travel_hours = thresholds["GEOGRAPHIC_MIN_TRAVEL_HOURS"]
+            self.window_hours = self.tolerance * travel.max_hours()
+
+    def _cell(self, facility: Dict) -> Hashable:
+        if self.travel is not None:
+            return self.travel.snap(facility)[0]
+        # longitude degrees shrink towards the poles; scale them to km first
+        lon_km = facility["longitude"] * math.cos(math.radians(facility["latitude"]))
+        return (
+            math.floor(facility["latitude"] / self.cell_degrees),
+            math.floor(lon_km / KM_PER_DEGREE / self.cell_degrees),
+        )
+
+    def _pair_hours(self, cell: Hashable, other_cell: Hashable) -> float:
+        """Sightings in these cells closer in time than this may be impossible; 0 if never."""
+        if self.travel is not None:
+            bound = self.travel.node_bound(cell, other_cell)
+            # every pair is within a delivery round of each other
+            return 0.0 if bound < self.min_travel_hours else self.tolerance * bound
+        # same or neighbouring cell: closer than max_km, no need to measure
+        if abs(other_cell[0] - cell[0]) <= 1 and abs(other_cell[1] - cell[1]) <= 1:
+            return 0.0
+        return self.window_hours
+
+    def _worst(self, window: BatchWindow, hour: float, facility: Dict, cell) -> Optional[Dict]:
+        """The sighting within the window that is furthest out of reach, if any."""
+        worst = None
+        for other_cell, sightings in window.cells.items():
+            limit = self._pair_hours(cell, other_cell)
+            if limit <= 0:
+                continue
+            lo = bisect_right(sightings, (hour - limit, "\uffff"))
+            hi = bisect_left(sightings, (hour + limit,))
+            for other_hour, other_id in sightings[lo:hi]:
+                if other_id == facility["facility_id"]:
+                    continue
+                other = self.facility_lookup[other_id]
+                hours_between = abs(hour - other_hour)
+                distance = haversine_km(
+                    other["latitude"], other["longitude"], facility["latitude"], facility["longitude"]
+                )
+                if self.travel is None:
+                    if distance <= self.max_km:
+                        continue
+                    travel_hours, score = None, distance
+                else:
+                    travel_hours = self.travel.facility_hours(other, facility)
+                    if (
+                        travel_hours < self.min_travel_hours
+                        or hours_between >= self.tolerance * travel_hours
+                    ):
+                        continue
+                    score = travel_hours - hours_between
+                if worst is None or score > worst["score"]:
+                    worst = {
+                        "score": score,
+                        "facility_id": other_id,
+                        "hour": other_hour,
+                        "hours_between": hours_between,
+                        "distance_km": distance,
+                        "travel_hours": travel_hours,
+                    }
+        return worst
+
+    def detect(
+        self,
+        *,
+        new_movements: List[Dict],
+        inventory: List[Dict],
+        batches: List[Dict],
+        current_time: datetime,
+    ) -> List[Dict]:
+        sightings = [
+            mov
+            for mov in new_movements
+            if mov["movement_type"] == "RESTOCK"
+            and mov.get("source") != "INITIAL_SEED"
+            and mov.get("facility_id") in self.facility_lookup
+        ]
+        # only this cycle's sightings are sorted; the windows stay sorted as they grow
+        sightings.sort(key=lambda mov: mov["timestamp"])
+
+        # anything older than this can no longer pair with a new sighting
+        horizon = _hours(current_time) - self.window_hours
+        if sightings:
+            horizon = min(horizon, _hours(sightings[0]["timestamp"]) - self.window_hours)
+
+        found: Dict[str, Tuple] = {}  # batch_id -> (worst pair, movement)
+        evicted = set()
+        for mov in sightings:
+            facility = self.facility_lookup[mov["facility_id"]]
+            hour = _hours(mov["timestamp"])
+            cell = self._cell(facility)
+
+            window = self.windows.get(mov["batch_id"])
+            if window is None:
+                window = self.windows[mov["batch_id"]] = BatchWindow()
+            elif mov["batch_id"] not in evicted:
+                window.evict(horizon)
+            evicted.add(mov["batch_id"])
+
+            worst = self._worst(window, hour, facility, cell)
+            if worst and (
+                mov["batch_id"] not in found or worst["score"] > found[mov["batch_id"]][0]["score"]
+            ):
+                found[mov["batch_id"]] = (worst, mov)
+
+            window.add(hour, mov["facility_id"], cell)
+
+        # batches not seen for a whole window hold nothing worth keeping
+        for batch_id in [b for b, w in self.windows.items() if w.latest < horizon]:
+            del self.windows[batch_id]
+
+        anomalies = []
+        for batch_id, (worst, mov) in found.items():
+            first, second = worst["facility_id"], mov["facility_id"]
+            if worst["hour"] > _hours(mov["timestamp"]):
+                first, second = second, first
+
+            distance = round(worst["distance_km"], 1)
+            hours_between = round(worst["hours_between"], 2)
+            evidence = {
+                "first_facility": first,
+                "second_facility": second,
+                "distance_km": distance,
+                "hours_between": hours_between,
+            }
+            if worst["travel_hours"] is None:
+                details = f"Batch appeared at two distant locations ({distance} km apart) within {hours_between} hours"
+            else:
+                evidence["travel_hours"] = round(worst["travel_hours"], 2)
+                details = (
+                    f"Batch appeared at two locations {evidence['travel_hours']} hours apart by road "
+                    f"({distance} km) within {hours_between} hours"
+                )
+
+            anomalies.append(
+                create_anomaly(
+                    anomaly_type="GEOGRAPHIC_IMPOSSIBILITY",
+                    severity="CRITICAL",
+                    facility_id=None,
+                    med_id=mov["med_id"],
+                    batch_id=batch_id,
+                    timestamp=current_time,
+                    details=details,
+                    evidence=evidence,
+                )
+            )
+        return anomalies
@@ -0,0 +1,196 @@
+"""
+Ledger reconciliation for ghost stock.
+
+Every movement carries quantity_before / quantity_change / quantity_after,
+so the movement log is a ledger per inventory_id. This replays it as it
+arrives and keeps, per inventory row:
+
+    balance     opening balance plus every quantity_change since
+    last_after  the quantity_after the last movement reported
+
+and checks three things:
+
+    NO_RECEIPT     stock on the shelf but no RESTOCK / TRANSFER_IN for that
+                   facility and batch, ever
+    CHAIN_BREAK    a movement's quantity_before isn't the previous
+                   quantity_after, or its own arithmetic doesn't add up
+    LEDGER_DRIFT   inventory.quantity disagrees with the ledger balance
+                   (records say 500, movements add up to 300)
+
+The first cycle checks every row. After that only rows with new movements
+are checked, plus a rotating slice of LEDGER_AUDIT_ROWS_PER_CYCLE other
+rows, so a quantity edited without any movement is still caught within a
+full sweep, and the cost per cycle is O(changed rows).
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from medguard.detection.anomalies import DEFAULT_THRESHOLDS, create_anomaly
+
+RECEIPT_TYPES = ("RESTOCK", "TRANSFER_IN")
+
+# chain breaks listed in an anomaly's evidence
+MAX_BREAKS_IN_EVIDENCE = 5
+
+
+class LedgerReconciler:
+    """Stateful detector: feed it each cycle's new movements, in log order."""
+
+    anomaly_types = ("GHOST_STOCK",)
+
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS):
+        self.tolerance = thresholds["LEDGER_DRIFT_TOLERANCE"]
+        self.audit_rows = thresholds["LEDGER_AUDIT_ROWS_PER_CYCLE"]
+
+        self.balance: Dict[str, int] = {}
+        self.opening: Dict[str, int] = {}
+        self.last_after: Dict[str, Optional[int]] = {}
+        self.received = set()  # (facility_id, batch_id)
+
+        self.rows: Dict[str, Dict] = {}
+        self.row_ids: List[str] = []
+        self.audit_cursor = 0
+
+    def _index(self, inventory: List[Dict]) -> bool:
+        """
+        Rebuild the row lookup from this call's inventory. Returns True on the
+        first call. Rebuilt every time (O(rows), cheap next to the checks):
+        callers may pass freshly loaded dicts, and a lookup kept from an
+        earlier list would compare the ledger with stale quantities.
+        """
+        first = not self.row_ids
+        self.rows = {inv["inventory_id"]: inv for inv in inventory}
+        self.row_ids = list(self.rows)
+        return first
+
+    def _post(self, mov: Dict, breaks: Dict[str, List[Dict]]) -> None:
+        inv_id = mov["inventory_id"]
+        change = mov.get("quantity_change") or 0
+        before, after = mov.get("quantity_before"), mov.get("quantity_after")
+
+        if inv_id not in self.balance:
+            # the first movement seen opens the ledger at its quantity_before
+            self.opening[inv_id] = self.balance[inv_id] = before or 0
+        else:
+            expected = self.last_after.get(inv_id)
+            if before is not None and expected is not None and before != expected:
+                breaks.setdefault(inv_id, []).append(
+                    {
+                        "movement_id": mov["movement_id"],
+                        "check": "quantity_before",
+                        "expected": expected,
+                        "reported": before,
+                    }
+                )
+
+        if before is not None and after is not None and after != max(0, before + change):
+            breaks.setdefault(inv_id, []).append(
+                {
+                    "movement_id": mov["movement_id"],
+                    "check": "quantity_after",
+                    "expected": max(0, before + change),
+                    "reported": after,
+                }
+            )
+
+        self.balance[inv_id] = max(0, self.balance[inv_id] + change)
+        self.last_after[inv_id] = after
+        if mov["movement_type"] in RECEIPT_TYPES:
+            self.received.add((mov["facility_id"], mov["batch_id"]))
+
+    def _audit_slice(self) -> List[str]:
+        if not self.row_ids or self.audit_rows <= 0:
+            return []
+        start = self.audit_cursor % len(self.row_ids)
+        ids = self.row_ids[start : start + self.audit_rows]
+        if len(ids) < self.audit_rows:
+            ids += self.row_ids[: min(start, self.audit_rows - len(ids))]
+        self.audit_cursor = start + self.audit_rows
+        return ids
+
+    def detect(
+        self,
+        *,
+        new_movements: List[Dict],
+        inventory: List[Dict],
+        batches: List[Dict],
+        current_time: datetime,
+    ) -> List[Dict]:
+        first = self._index(inventory)
+
+        breaks: Dict[str, List[Dict]] = {}
+        last_movement: Dict[str, Dict] = {}
+        for mov in new_movements:
+            if not mov.get("inventory_id"):
+                continue
+            self._post(mov, breaks)
+            last_movement[mov["inventory_id"]] = mov
+
+        if first:
+            check = list(self.row_ids)
+        else:
+            check = list(dict.fromkeys([*last_movement, *self._audit_slice()]))
+
+        anomalies = []
+        for inv_id in check:
+            row = self.rows.get(inv_id)
+            if row is None:
+                # movements against rows we don't hold (e.g. injected ones): chain checks only
+                if inv_id in breaks:
+                    anomalies.append(
+                        self._anomaly(last_movement[inv_id], ["CHAIN_BREAK"], inv_id, breaks, current_time)
+                    )
+                continue
+
+            reasons = []
+            if row["quantity"] > 0 and (row["facility_id"], row["batch_id"]) not in self.received:
+                reasons.append("NO_RECEIPT")
+            if inv_id in breaks:
+                reasons.append("CHAIN_BREAK")
+            if inv_id in self.balance and abs(row["quantity"] - self.balance[inv_id]) > self.tolerance:
+                reasons.append("LEDGER_DRIFT")
+            if reasons:
+                anomalies.append(self._anomaly(row, reasons, inv_id, breaks, current_time))
+
+        return anomalies
+
+    def _anomaly(
+        self,
+        record: Dict,
+        reasons: List[str],
+        inv_id: str,
+        breaks: Dict[str, List[Dict]],
+        current_time: datetime,
+    ) -> Dict:
+        row = self.rows.get(inv_id)
+        quantity = row["quantity"] if row is not None else None
+        balance = self.balance.get(inv_id)
+
+        details = []
+        if "NO_RECEIPT" in reasons:
+            details.append("Inventory exists at facility without any receipt movement")
+        if "CHAIN_BREAK" in reasons:
+            details.append(f"{len(breaks[inv_id])} movement(s) don't continue the ledger")
+        if "LEDGER_DRIFT" in reasons:
+            details.append(f"Records show {quantity} but movements add up to {balance}")
+
+        return create_anomaly(
+            anomaly_type="GHOST_STOCK",
+            severity="HIGH",
+            facility_id=record["facility_id"],
+            med_id=record.get("med_id"),
+            batch_id=record["batch_id"],
+            timestamp=current_time,
+            details="; ".join(details),
+            evidence={
+                "inventory_id": inv_id,
+                "reasons": reasons,
+                "quantity": quantity,
+                "ledger_balance": balance,
+                "opening_balance": self.opening.get(inv_id),
+                "drift": None if quantity is None or balance is None else quantity - balance,
+                "chain_breaks": breaks.get(inv_id, [])[:MAX_BREAKS_IN_EVIDENCE],
+                "facility_id": record["facility_id"],
+            },
+        )
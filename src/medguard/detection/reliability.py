@@ -0,0 +1,173 @@
+"""
+Facility reliability scores based on anomaly history.
+
+Each anomaly adds a severity-weighted penalty to the facilities it involves.
+Penalties decay exponentially (half-life RELIABILITY_HALF_LIFE_DAYS), so a
+facility recovers if it stays clean. Decay is applied lazily on update:
+penalty = penalty * exp(-rate * elapsed) + weight, which makes each new
+anomaly O(1) and each score() O(1), without rescanning the anomalies table.
+breakdown() is not: it scans every stored penalty.
+
+Reads decay to `at`, or by default to as_of: the latest time the scorer has
+seen (the newest anomaly or update(at=...) call, or the newest stored score
+after load()). Passing the current time to update() each cycle lets callers
+that only hold score() see facilities recover while no anomalies arrive.
+
+reliability = 1 / (1 + penalty), in (0, 1]. A facility with no anomalies is 1.0.
+"""
+
+import math
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SEVERITY_WEIGHTS = {
+    "INFO": 0.1,
+    "MEDIUM": 0.5,
+    "HIGH": 1.0,
+    "CRITICAL": 2.0,
+}
+
+RELIABILITY_HALF_LIFE_DAYS = 30
+
+# anomaly_type key that holds the combined penalty of a facility
+ALL_TYPES = "ALL"
+
+# evidence keys that name involved facilities on batch-level anomalies
+EVIDENCE_FACILITY_KEYS = ("facility_id", "first_facility", "second_facility")
+
+
+def _as_datetime(t) -> datetime:
+    if isinstance(t, datetime):
+        return t
+    return datetime.fromisoformat(t)
+
+
+def anomaly_facilities(anomaly: Dict) -> List[str]:
+    """Facilities an anomaly points at: its own facility_id plus any named in the evidence."""
+    facilities = []
+    if anomaly.get("facility_id"):
+        facilities.append(anomaly["facility_id"])
+
+    evidence = anomaly.get("evidence") or {}
+    if isinstance(evidence, dict):
+        for key in EVIDENCE_FACILITY_KEYS:
+            facility_id = evidence.get(key)
+            if facility_id and facility_id not in facilities:
+                facilities.append(facility_id)
+
+    return facilities
+
+
+class ReliabilityScorer:
+    def __init__(self, half_life_days: float = RELIABILITY_HALF_LIFE_DAYS):
+        self.decay_rate = math.log(2) / (half_life_days * 86400)  # per second
+        # (facility_id, anomaly_type) -> (penalty, updated_at)
+        self.penalties: Dict[Tuple[str, str], Tuple[float, datetime]] = {}
+        self._dirty = set()
+        self.as_of: Optional[datetime] = None
+
+    def _decayed(self, key: Tuple[str, str], at: Optional[datetime]) -> float:
+        entry = self.penalties.get(key)
+        if entry is None:
+            return 0.0
+        penalty, updated_at = entry
+        at = at or self.as_of
+        if at is None or at <= updated_at:
+            return penalty
+        return penalty * math.exp(-self.decay_rate * (at - updated_at).total_seconds())
+
+    def _add(self, key: Tuple[str, str], weight: float, at: datetime) -> None:
+        entry = self.penalties.get(key)
+        if entry is not None and entry[1] > at:
+            # older anomaly arriving late: decay it forward instead of the stored value back
+            penalty = entry[0] + weight * math.exp(
+                -self.decay_rate * (entry[1] - at).total_seconds()
+            )
+            self.penalties[key] = (penalty, entry[1])
+        else:
+            self.penalties[key] = (self._decayed(key, at) + weight, at)
+        self._dirty.add(key)
+
+    def update(self, anomalies: List[Dict], at: Optional[datetime] = None) -> None:
+        """
+        Fold newly detected anomalies into the scores, O(1) per anomaly, and
+        move as_of forward to `at` (or the newest anomaly).
+        """
+        for anomaly in anomalies:
+            weight = SEVERITY_WEIGHTS.get(anomaly.get("severity"), 1.0)
+            timestamp = _as_datetime(anomaly["timestamp"])
+            for facility_id in anomaly_facilities(anomaly):
+                self._add((facility_id, anomaly["anomaly_type"]), weight, timestamp)
+                self._add((facility_id, ALL_TYPES), weight, timestamp)
+            self._advance(timestamp)
+        if at is not None:
+            self._advance(at)
+
+    def _advance(self, at: datetime) -> None:
+        if self.as_of is None or at > self.as_of:
+            self.as_of = at
+
+    def penalty(
+        self,
+        facility_id: str,
+        anomaly_type: str = ALL_TYPES,
+        at: Optional[datetime] = None,
+    ) -> float:
+        return self._decayed((facility_id, anomaly_type), at)
+
+    def score(self, facility_id: str, at: Optional[datetime] = None) -> float:
+        """Reliability in (0, 1]; 1.0 means no recent anomalies."""
+        return 1 / (1 + self.penalty(facility_id, ALL_TYPES, at))
+
+    def breakdown(self, facility_id: str, at: Optional[datetime] = None) -> Dict[str, float]:
+        """
+        Penalty per anomaly type, e.g. for explaining a score to the agent.
+        Scans all stored penalties, so keep it out of ranking loops.
+        """
+        return {
+            anomaly_type: round(self._decayed((fac_id, anomaly_type), at), 3)
+            for fac_id, anomaly_type in self.penalties
+            if fac_id == facility_id and anomaly_type != ALL_TYPES
+        }
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection, **kwargs) -> "ReliabilityScorer":
+        scorer = cls(**kwargs)
+        scorer.load(conn)
+        return scorer
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        rows = conn.execute(
+            "SELECT facility_id, anomaly_type, penalty, updated_at FROM facility_scores"
+        )
+        self.penalties = {
+            (row["facility_id"], row["anomaly_type"]): (
+                row["penalty"],
+                datetime.fromisoformat(row["updated_at"]),
+            )
+            for row in rows
+        }
+        self.as_of = max((updated_at for _, updated_at in self.penalties.values()), default=None)
+        self._dirty.clear()
+
+    def save(self, conn: sqlite3.Connection) -> None:
+        """Persist only the scores that changed since the last save."""
+        if not self._dirty:
+            return
+
+        sql = """
+            INSERT INTO facility_scores (facility_id, anomaly_type, penalty, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (facility_id, anomaly_type) DO UPDATE SET
+                penalty = excluded.penalty,
+                updated_at = excluded.updated_at
+        """
+        values = []
+        for facility_id, anomaly_type in self._dirty:
+            penalty, updated_at = self.penalties[(facility_id, anomaly_type)]
+            values.append((facility_id, anomaly_type, penalty, updated_at.isoformat()))
+
+        with conn:
+            conn.executemany(sql, values)
+        self._dirty.clear()
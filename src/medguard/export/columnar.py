@@ -0,0 +1,279 @@
+"""
+Columnar export of simulation runs for analytics.
+
+Writes movements, events, anomalies and the final inventory either from a
+SimulationEngine.run() result or from the database into typed columns:
+
+- parquet: one .parquet file per table (needs pyarrow)
+- arrow:   one uncompressed Arrow IPC file per table, memory-mappable (needs pyarrow)
+- npy:     one directory per table with a .npy file per column (numpy only)
+
+Id-like columns (facility, batch, med, movement type, ...) are dictionary
+encoded: int32 codes plus a small dictionary, so a month of national-scale
+movements stays compact and loads with zero-copy reads.
+"""
+
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from medguard.db.database import to_json
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional, the npy format works without it
+    pa = None
+
+FORMATS = ("parquet", "arrow", "npy")
+
+# column kinds:
+# id   - dictionary encoded string
+# str  - plain string
+# json - dict payload stored as JSON text
+# int  - int64
+# time - datetime64[s]
+# bool - bool
+TABLE_SCHEMAS = {
+    "movements": {
+        "movement_id": "str",
+        "inventory_id": "id",
+        "facility_id": "id",
+        "batch_id": "id",
+        "med_id": "id",
+        "movement_type": "id",
+        "quantity_before": "int",
+        "quantity_change": "int",
+        "quantity_after": "int",
+        "timestamp": "time",
+        "reference_id": "str",
+        "source": "id",
+        "reason": "id",
+        "transfer_id": "str",
+        "source_facility_id": "id",
+        "destination_facility_id": "id",
+    },
+    "events": {
+        "event_id": "str",
+        "event_type": "id",
+        "severity": "id",
+        "facility_id": "id",
+        "med_id": "id",
+        "batch_id": "id",
+        "timestamp": "time",
+        "detected_at": "time",
+        "details": "str",
+        "data": "json",
+        "source": "id",
+        "is_active": "bool",
+    },
+    "anomalies": {
+        "anomaly_id": "str",
+        "anomaly_type": "id",
+        "severity": "id",
+        "facility_id": "id",
+        "med_id": "id",
+        "batch_id": "id",
+        "timestamp": "time",
+        "details": "str",
+        "evidence": "json",
+        "source": "id",
+        "is_active": "bool",
+    },
+    "inventory": {
+        "inventory_id": "str",
+        "facility_id": "id",
+        "batch_id": "id",
+        "brand_id": "id",
+        "med_id": "id",
+        "quantity": "int",
+        "reorder_point": "int",
+        "unit_price": "int",
+        "expiry_date": "time",
+    },
+}
+
+# npy has no null for integers
+INT_NULL = np.iinfo(np.int64).min
+
+
+def _to_datetime64(value) -> np.datetime64:
+    if value is None or value == "":
+        return np.datetime64("NaT", "s")
+    if isinstance(value, datetime):
+        return np.datetime64(value, "s")
+    return np.datetime64(datetime.fromisoformat(value), "s")
+
+
+def _encode_column(values: List, kind: str) -> Dict[str, np.ndarray]:
+    """Encode one column into numpy arrays ("values", plus "dictionary" for ids)."""
+    if kind == "id":
+        dictionary = {}
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is None:
+                codes[i] = -1
+            else:
+                codes[i] = dictionary.setdefault(value, len(dictionary))
+        return {
+            "values": codes,
+            "dictionary": np.array(list(dictionary), dtype=str),
+        }
+
+    if kind == "int":
+        return {
+            "values": np.array(
+                [INT_NULL if v is None else int(v) for v in values], dtype=np.int64
+            )
+        }
+
+    if kind == "time":
+        return {
+            "values": np.array(
+                [_to_datetime64(v) for v in values], dtype="datetime64[s]"
+            )
+        }
+
+    if kind == "bool":
+        return {"values": np.array([bool(v) for v in values], dtype=bool)}
+
+    if kind == "json":
+        values = [to_json(v) for v in values]
+
+    # fixed width unicode keeps the column memory-mappable
+    return {"values": np.array(["" if v is None else v for v in values], dtype=str)}
+
+
+def _to_arrow_column(encoded: Dict[str, np.ndarray], kind: str):
+    values = encoded["values"]
+
+    if kind == "id":
+        mask = values < 0
+        indices = pa.array(np.where(mask, 0, values), type=pa.int32(), mask=mask)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(encoded["dictionary"]))
+    if kind == "int":
+        return pa.array(values, type=pa.int64(), mask=values == INT_NULL)
+    if kind == "time":
+        return pa.array(values, type=pa.timestamp("s"), mask=np.isnat(values))
+    if kind == "bool":
+        return pa.array(values, type=pa.bool_())
+    return pa.array(values.tolist(), type=pa.string())
+
+
+def _write_table(name: str, rows: List[Dict], out_dir: Path, fmt: str) -> Path:
+    schema = TABLE_SCHEMAS[name]
+    if rows:
+        # DB rows carry fewer columns than simulation dicts (no med_id on movements),
+        # and optional keys (transfer_id, ...) only appear on some rows
+        present = set().union(*rows)
+        schema = {col: kind for col, kind in schema.items() if col in present}
+
+    columns = {
+        col: _encode_column([row.get(col) for row in rows], kind)
+        for col, kind in schema.items()
+    }
+
+    if fmt == "npy":
+        table_dir = out_dir / name
+        table_dir.mkdir(parents=True, exist_ok=True)
+        for col, encoded in columns.items():
+            np.save(table_dir / f"{col}.npy", encoded["values"])
+            if "dictionary" in encoded:
+                np.save(table_dir / f"{col}.dict.npy", encoded["dictionary"])
+        return table_dir
+
+    table = pa.table(
+        {
+            col: _to_arrow_column(encoded, schema[col])
+            for col, encoded in columns.items()
+        }
+    )
+
+    if fmt == "parquet":
+        path = out_dir / f"{name}.parquet"
+        pq.write_table(table, path)
+        return path
+
+    # arrow IPC without compression so readers can memory-map it
+    path = out_dir / f"{name}.arrow"
+    with pa.OSFile(str(path), "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def _resolve_format(fmt: str) -> str:
+    if fmt == "auto":
+        return "parquet" if pa is not None else "npy"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt != "npy" and pa is None:
+        raise ImportError(f"pyarrow is required for the {fmt} format")
+    return fmt
+
+
+def export_tables(
+    tables: Dict[str, List[Dict]], out_dir: Path, fmt: str = "auto"
+) -> Dict[str, Path]:
+    fmt = _resolve_format(fmt)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return {
+        name: _write_table(name, rows, out_dir, fmt) for name, rows in tables.items()
+    }
+
+
+def export_run(result: Dict, out_dir: Path, fmt: str = "auto") -> Dict[str, Path]:
+    """Export the dict returned by SimulationEngine.run()."""
+    return export_tables(
+        {
+            "movements": result["movements"],
+            "events": result["events"],
+            "anomalies": result["anomalies"],
+            "inventory": result["final_inventory"],
+        },
+        out_dir,
+        fmt,
+    )
+
+
+def export_database(
+    conn: sqlite3.Connection, out_dir: Path, fmt: str = "auto"
+) -> Dict[str, Path]:
+    """Export the operational tables and current inventory from the database."""
+    tables = {}
+    for name in ("movements", "events", "anomalies", "inventory"):
+        tables[name] = [dict(row) for row in conn.execute(f"SELECT * FROM {name}")]
+    return export_tables(tables, out_dir, fmt)
+
+
+def load_table(path: Path, mmap: bool = True):
+    """
+    Load an exported table.
+
+    parquet / arrow files return a pyarrow Table (arrow files are memory-mapped).
+    npy directories return a dict of column name -> array; dictionary-encoded
+    columns come back as int32 codes with the dictionary under "<col>.dict".
+    """
+    path = Path(path)
+
+    if path.is_dir():
+        mmap_mode = "r" if mmap else None
+        return {
+            file.name[: -len(".npy")]: np.load(file, mmap_mode=mmap_mode)
+            for file in sorted(path.glob("*.npy"))
+        }
+
+    if pa is None:
+        raise ImportError("pyarrow is required to read parquet/arrow exports")
+
+    if path.suffix == ".parquet":
+        return pq.read_table(path, memory_map=mmap)
+
+    source = pa.memory_map(str(path), "r") if mmap else pa.OSFile(str(path), "rb")
+    return ipc.open_file(source).read_all()
+
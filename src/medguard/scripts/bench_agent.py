@@ -0,0 +1,144 @@
+"""
+Benchmark the agent loop's own overhead (tool dispatch, context building, DB
+access) with the offline ScriptedBackend, so it runs without network access.
+
+    python -m medguard.scripts.bench_agent --sessions 200
+"""
+
+import argparse
+import random
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+from medguard.agent.agent import Agent
+from medguard.agent.backends import ScriptedBackend
+from medguard.agent.registry import registry
+from medguard.data.generators.movements import seed_historical_movements
+from medguard.db.database import get_connection_to_db, insert_movements, set_db_path
+from medguard.scripts.seed_db import seed_database
+
+HISTORY_START = datetime(2025, 11, 12)
+
+
+def build_benchmark_db(db_path: Path, days: int = 30) -> List[str]:
+    """Seed a database with reference data and `days` of dispense history. Returns batch ids."""
+    seed_database(db_path)
+    conn = get_connection_to_db(db_path)
+
+    inventory = [
+        dict(row)
+        for row in conn.execute(
+            """
+            SELECT i.inventory_id, i.facility_id, i.batch_id, i.quantity, br.med_id
+            FROM inventory i
+            JOIN batches b ON i.batch_id = b.batch_id
+            JOIN brands br ON b.brand_id = br.brand_id
+            """
+        )
+    ]
+    medications = [
+        dict(row) for row in conn.execute("SELECT med_id, base_demand FROM medications")
+    ]
+
+    movements = seed_historical_movements(inventory, medications, HISTORY_START, days)
+    insert_movements(movements, conn)
+
+    batch_ids = sorted({inv["batch_id"] for inv in inventory})
+    conn.close()
+    return batch_ids
+
+
+def make_investigation_script(batch_ids: List[str]) -> List[Dict]:
+    """A typical investigation: trace a few suspect batches together, then one follow-up."""
+    return [
+        {
+            "function_calls": [
+                {"name": "trace_batch_journey", "args": {"batch_id": batch_id}}
+                for batch_id in batch_ids[:-1]
+            ]
+        },
+        {
+            "function_calls": [
+                {"name": "trace_batch_journey", "args": {"batch_id": batch_ids[-1]}}
+            ]
+        },
+        {"text": "Investigation complete."},
+    ]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p90/p99 in milliseconds."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1)]
+
+    return {
+        "p50_ms": round(rank(50) * 1000, 3),
+        "p90_ms": round(rank(90) * 1000, 3),
+        "p99_ms": round(rank(99) * 1000, 3),
+        "n": len(values),
+    }
+
+
+def run_benchmark(
+    sessions: int = 100,
+    batches_per_session: int = 5,
+    days: int = 30,
+    seed: int = 42,
+) -> Dict:
+    # a cold cache and fresh counters, so runs in one process don't inherit each other's hits
+    registry.clear_cache()
+    registry.cache_hits = registry.cache_misses = 0
+
+    rng = random.Random(seed)
+    turn_seconds = []
+    model_seconds = []
+    tool_seconds: Dict[str, List[float]] = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.db"
+        batch_ids = build_benchmark_db(db_path, days)
+        previous_db_path = set_db_path(db_path)
+        try:
+            for _ in range(sessions):
+                suspects = rng.sample(batch_ids, batches_per_session)
+                agent = Agent(backend=ScriptedBackend(make_investigation_script(suspects)))
+                agent.run("Investigate these suspect batches")
+
+                for turn in agent.last_trace:
+                    turn_seconds.append(turn["turn_seconds"])
+                    model_seconds.append(turn["model_seconds"])
+                    for tool in turn["tools"]:
+                        tool_seconds.setdefault(tool["name"], []).append(tool["seconds"])
+        finally:
+            set_db_path(previous_db_path)
+
+    return {
+        "sessions": sessions,
+        "turn": percentiles(turn_seconds),
+        "model": percentiles(model_seconds),
+        "tools": {name: percentiles(values) for name, values in tool_seconds.items()},
+        "cache_hits": registry.cache_hits,
+        "cache_misses": registry.cache_misses,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    report = run_benchmark(args.sessions, args.batches, args.days)
+    print(f"sessions: {report['sessions']}")
+    print(f"turn:  {report['turn']}")
+    print(f"model: {report['model']}")
+    for name, stats in report["tools"].items():
+        print(f"tool {name}: {stats}")
+    print(f"cache: {report['cache_hits']} hits, {report['cache_misses']} misses")
@@ -0,0 +1,174 @@
+"""
+Load generator for the verification service: sustained requests per second
+and latency, either calling the service in-process or over HTTP.
+
+    python -m medguard.scripts.load_verify --mode inprocess --seconds 10
+    python -m medguard.scripts.load_verify --mode http --clients 8 --seconds 10
+    python -m medguard.scripts.load_verify --mode http --url http://127.0.0.1:8080 --db medguard.db
+
+Without --db a freshly seeded temporary database is used. Without --url the
+HTTP mode starts its own server on a free port; with it, pass the server's
+--db so requests are drawn from the same batches.
+"""
+
+import argparse
+import http.client
+import random
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from medguard.db.database import get_connection_to_db
+from medguard.scripts.bench_agent import percentiles
+from medguard.scripts.seed_db import seed_database
+from medguard.verification.server import make_server
+from medguard.verification.service import VerificationService
+
+# share of requests per kind; the rest are genuine packs with the right NRN
+WRONG_NRN_SHARE = 0.05
+UNKNOWN_SHARE = 0.05
+LOOKALIKE_SHARE = 0.02
+
+
+def build_requests(db_path: Path, n: int = 10000, seed: int = 42) -> List[Tuple[str, str]]:
+    """(batch_number, nrn) pairs shaped like point-of-sale traffic."""
+    conn = get_connection_to_db(db_path)
+    packs = [
+        (row["batch_number"], row["nrn"])
+        for row in conn.execute(
+            """
+            SELECT b.batch_number, m.nrn
+            FROM batches b
+            JOIN brands br ON b.brand_id = br.brand_id
+            JOIN medications m ON br.med_id = m.med_id
+            """
+        )
+    ]
+    conn.close()
+
+    rng = random.Random(seed)
+    nrns = [nrn for _, nrn in packs]
+    requests = []
+    for _ in range(n):
+        batch_number, nrn = rng.choice(packs)
+        roll = rng.random()
+        if roll < WRONG_NRN_SHARE:
+            nrn = rng.choice(nrns)
+        elif roll < WRONG_NRN_SHARE + UNKNOWN_SHARE:
+            batch_number = f"XXX-{rng.randint(2000, 2030)}-{rng.randint(0, 99999):05d}"
+        elif roll < WRONG_NRN_SHARE + UNKNOWN_SHARE + LOOKALIKE_SHARE:
+            batch_number = batch_number.replace("0", "O", 1)
+        requests.append((batch_number, nrn))
+    return requests
+
+
+def _drive(send, requests: List[Tuple[str, str]], deadline: float, latencies: List[float]) -> None:
+    i = 0
+    clock = time.perf_counter
+    while clock() < deadline:
+        batch_number, nrn = requests[i % len(requests)]
+        i += 1
+        start = clock()
+        send(batch_number, nrn)
+        latencies.append(clock() - start)
+
+
+def run_inprocess(service: VerificationService, requests, seconds: float) -> List[float]:
+    latencies: List[float] = []
+    _drive(service.verify, requests, time.perf_counter() + seconds, latencies)
+    return latencies
+
+
+def run_http(url: str, requests, seconds: float, clients: int) -> List[float]:
+    parts = urlsplit(url)
+    deadline = time.perf_counter() + seconds
+    per_client: List[List[float]] = [[] for _ in range(clients)]
+
+    def client(k: int):
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80)
+
+        def send(batch_number, nrn):
+            conn.request("GET", "/verify?" + urlencode({"batch_number": batch_number, "nrn": nrn}))
+            conn.getresponse().read()
+
+        # each client starts at a different point of the request mix
+        offset = k * len(requests) // clients
+        _drive(send, requests[offset:] + requests[:offset], deadline, per_client[k])
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(k,)) for k in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [latency for latencies in per_client for latency in latencies]
+
+
+def run_load(
+    mode: str = "inprocess",
+    db_path: Optional[Path] = None,
+    url: Optional[str] = None,
+    seconds: float = 10.0,
+    clients: int = 4,
+) -> Dict:
+    if db_path is None:
+        # seeded for this run and removed with it
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = Path(tmp) / "verify.db"
+            seed_database(db_path)
+            return run_load(mode, db_path, url, seconds, clients)
+
+    requests = build_requests(db_path)
+
+    service = None
+    load_seconds = None
+    if url is None or mode == "inprocess":
+        started = time.perf_counter()
+        service = VerificationService(db_path).load()
+        load_seconds = round((time.perf_counter() - started) * 1000, 1)
+
+    server = None
+    if mode == "http" and url is None:
+        server = make_server(service, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        if mode == "http":
+            latencies = run_http(url, requests, seconds, clients)
+        else:
+            latencies = run_inprocess(service, requests, seconds)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    return {
+        "mode": mode,
+        "clients": clients if mode == "http" else 1,
+        "load_ms": load_seconds,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / seconds),
+        "latency": percentiles(latencies),
+        "service": service.stats() if service is not None else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--db", type=Path, default=None)
+    parser.add_argument("--url", default=None, help="verify against a running server")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=4)
+    args = parser.parse_args()
+
+    report = run_load(args.mode, args.db, args.url, args.seconds, args.clients)
+    print(f"mode: {report['mode']} ({report['clients']} client(s))")
+    print(f"load: {report['load_ms']} ms")
+    print(f"requests: {report['requests']} ({report['requests_per_second']}/s)")
+    print(f"latency: {report['latency']}")
+    print(f"service: {report['service']}")
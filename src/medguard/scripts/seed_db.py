@@ -18,9 +18,9 @@ from medguard.data.generators.batches import generate_batches
 from medguard.data.generators.inventory import generate_inventory
 
 
-def seed_database():
-    init_database()
-    clear_database()
+def seed_database(db_path=None):
+    init_database(db_path)
+    clear_database(db_path)
 
     medications = generate_medications()
     companies = generate_companies()
@@ -29,7 +29,7 @@ def seed_database():
     batches = generate_batches(brands, companies)
     inventory = generate_inventory(facilities, batches, medications, brands)
 
-    conn = get_connection_to_db()
+    conn = get_connection_to_db(db_path)
 
     insert_medications(medications, conn)
     insert_companies(companies, conn)
@@ -1,11 +1,19 @@
 from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import List, Dict, Callable
+from typing import List, Dict, Callable, Optional
 import random
 import heapq
+import sqlite3
 import numpy as np
 
-from medguard.data.generators.movements import dispense, expiry_withdraw, restock
+from medguard.data.generators.movements import (
+    dispense,
+    expiry_withdraw,
+    new_movement_id,
+    restock,
+    transfer_in,
+    transfer_out,
+)
 from medguard.data.generators.inventory import generate_inventory
 from medguard.data.generators.medications import generate_medications
 from medguard.data.generators.brands import generate_brands
@@ -13,7 +21,24 @@ from medguard.data.generators.batches import generate_batches
 from medguard.data.generators.companies import generate_companies
 from medguard.data.generators.facilities import generate_facilities
 from medguard.detection.events import generate_events
-from medguard.detection.anomalies import generate_anomalies
+from medguard.detection.anomalies import PriceDetector, generate_anomalies
+from medguard.detection.batch_numbers import CONFUSABLES, BatchNumberIndex
+from medguard.detection.reliability import ReliabilityScorer
+from medguard.detection.correlation import CorrelationEngine
+from medguard.detection.genealogy import GenealogyGraph
+from medguard.detection.custody import CustodyDetector
+from medguard.detection.flow import PassThroughDetector
+from medguard.detection.geographic import GeographicDetector
+from medguard.detection.ledger import LedgerReconciler
+from medguard.agent.triage import DEFAULT_LLM_BUDGET, TriageQueue, investigation_prompt
+from medguard.db.database import (
+    insert_anomalies,
+    insert_movements,
+    set_anomalies_active,
+    upsert_inventory_quantities,
+)
+from medguard.db.history import ensure_checkpoints
+from medguard.utils.travel import get_travel_model
 
 
 START_TIME = datetime(2026, 1, 3, 0, 0, 0)
@@ -101,6 +126,9 @@ class SimulationEngine:
         batches: List[Dict],
         start_time: datetime,
         end_time: datetime,
+        conn: Optional[sqlite3.Connection] = None,
+        agent=None,
+        llm_budget_per_cycle: int = DEFAULT_LLM_BUDGET,
     ):
         self.inventory = inventory
         self.medications = medications
@@ -109,6 +137,8 @@ class SimulationEngine:
         self.start_time = start_time
         self.end_time = end_time
         self.current_time = start_time
+        # when set, changed inventory is written back after every agent cycle
+        self.conn = conn
 
         # Lookups
         self.med_lookup = {m["med_id"]: m for m in medications}
@@ -127,9 +157,79 @@ class SimulationEngine:
         self.events_log: List[Dict] = []
         self.anomalies_log: List[Dict] = []
 
+        # facility reliability, updated as anomalies are detected
+        self.reliability = ReliabilityScorer()
+
+        # movements_log entries already seen by the incremental detectors
+        self.movement_cursor = 0
+        self.detectors = [
+            GeographicDetector(facilities, travel=get_travel_model()),
+            PassThroughDetector(),
+            CustodyDetector(),
+            LedgerReconciler(),
+            BatchNumberIndex(),
+            PriceDetector(),
+        ]
+
+        # where every batch has been, fed with movements each agent cycle
+        self.genealogy = GenealogyGraph()
+        self.genealogy.add_batches(batches)
+
+        # anomalies linked by batch, importer, brand or facility become incidents
+        self.correlation = CorrelationEngine(batches, genealogy=self.genealogy)
+
+        # related anomalies are investigated together, a few per cycle
+        self.agent = agent
+        self.triage = TriageQueue(llm_budget_per_cycle, reliability=self.reliability.score)
+        self.investigations_log: List[Dict] = []
+
         # Tracking
         self.restocked_inventory = set()  # Prevent duplicate restocks
         self.last_agent_cycle = None
+        self.dirty_inventory_ids = set()  # quantity changed since last flush
+        self.persisted_movements = 0  # movements_log entries already written
+        self.persisted_anomalies = 0  # anomalies_log entries already written
+        self.resolved_anomaly_ids = set()  # deactivated since last flush
+
+    def _log_movement(self, mov: Dict):
+        """Log a movement and mark its inventory row for the next flush."""
+        self.movements_log.append(mov)
+        if mov["inventory_id"] in self.inventory_lookup:
+            self.dirty_inventory_ids.add(mov["inventory_id"])
+
+    def flush_inventory(self, conn: sqlite3.Connection) -> int:
+        """
+        Persist only the inventory rows whose quantity changed since the last
+        flush, so write volume follows activity rather than table size.
+        """
+        dirty = [self.inventory_lookup[inv_id] for inv_id in self.dirty_inventory_ids]
+        upsert_inventory_quantities(dirty, conn)
+        self.dirty_inventory_ids.clear()
+        return len(dirty)
+
+    def flush_movements(self, conn: sqlite3.Connection) -> int:
+        """Write movements logged since the last flush; insert_movements keeps the daily ledger."""
+        new = self.movements_log[self.persisted_movements :]
+        insert_movements(new, conn)
+        self.persisted_movements = len(self.movements_log)
+        return len(new)
+
+    def flush_anomalies(self, conn: sqlite3.Connection) -> int:
+        """Write anomalies detected since the last flush, then any deactivations."""
+        new = self.anomalies_log[self.persisted_anomalies :]
+        insert_anomalies(new, conn)
+        self.persisted_anomalies = len(self.anomalies_log)
+        set_anomalies_active(sorted(self.resolved_anomaly_ids), False, conn)
+        self.resolved_anomaly_ids.clear()
+        return len(new)
+
+    def resolve_anomalies(self, anomaly_ids: List[str]):
+        """Deactivate anomalies; the change is written on the next flush."""
+        anomaly_ids = set(anomaly_ids)
+        for anomaly in self.anomalies_log:
+            if anomaly["anomaly_id"] in anomaly_ids and anomaly.get("is_active", True):
+                anomaly["is_active"] = False
+                self.resolved_anomaly_ids.add(anomaly["anomaly_id"])
 
     def initialize(self):
         """Set up initial state and schedule initial events."""
@@ -162,7 +262,7 @@ class SimulationEngine:
                 timestamp=receipt_time,
                 source="INITIAL_SEED",
             )
-            self.movements_log.append(mov)
+            self._log_movement(mov)
 
         #  hourly ticks schedule
         current = self.start_time
@@ -206,6 +306,27 @@ class SimulationEngine:
             {"description": "Batch dispensed more than existed"},
         )
 
+        # Scenario 4: pharmacy passing stock straight through at hour 60
+        self.event_queue.push(
+            self.start_time + timedelta(hours=60),
+            "INJECT_PASS_THROUGH",
+            {"description": "Stock received and transferred on without dispensing"},
+        )
+
+        # Scenario 5: stock received from a facility that never held it at hour 40
+        self.event_queue.push(
+            self.start_time + timedelta(hours=40),
+            "INJECT_UNTRACED_TRANSFER",
+            {"description": "Transfer received with no custody record at the sender"},
+        )
+
+        # Scenario 6: batch registered under a look-alike batch number at hour 25
+        self.event_queue.push(
+            self.start_time + timedelta(hours=25),
+            "INJECT_LOOKALIKE_BATCH",
+            {"description": "New batch number differs from a genuine one by a look-alike character"},
+        )
+
     def run(self):
         """Main simulation loop."""
 
@@ -218,6 +339,13 @@ class SimulationEngine:
             self.current_time = event_time
             self._process_event(event_type, event_data)
 
+        # whatever happened after the last agent cycle
+        if self.conn is not None:
+            self.flush_movements(self.conn)
+            self.flush_inventory(self.conn)
+            self.flush_anomalies(self.conn)
+            ensure_checkpoints(self.conn)
+
         # print(f"Movements: {len(self.movements_log)}")
         # print(f"Events: {len(self.events_log)}")
         # print(f"Anomalies: {len(self.anomalies_log)}")
@@ -227,6 +355,8 @@ class SimulationEngine:
             "movements": self.movements_log,
             "events": self.events_log,
             "anomalies": self.anomalies_log,
+            "investigations": self.investigations_log,
+            "incidents": self.correlation.incidents(),
             "simulation_start": self.start_time,
             "simulation_end": self.end_time,
         }
@@ -238,6 +368,9 @@ class SimulationEngine:
             "AGENT_CYCLE": self._handle_agent_cycle,
             "INJECT_GEOGRAPHIC_ANOMALY": self._handle_inject_geographic,
             "INJECT_IMPOSSIBLE_QUANTITY": self._handle_inject_impossible_qty,
+            "INJECT_PASS_THROUGH": self._handle_inject_pass_through,
+            "INJECT_UNTRACED_TRANSFER": self._handle_inject_untraced_transfer,
+            "INJECT_LOOKALIKE_BATCH": self._handle_inject_lookalike_batch,
         }
 
         handler = handlers.get(event_type)
@@ -269,7 +402,7 @@ class SimulationEngine:
                     timestamp=self.current_time,
                     source="SIMULATION",
                 )
-                self.movements_log.append(mov)
+                self._log_movement(mov)
 
     def _process_dispensing(self):
         """
@@ -310,7 +443,7 @@ class SimulationEngine:
                     source="SIMULATION",
                     reason="PATIENT_DEMAND",
                 )
-                self.movements_log.append(mov)
+                self._log_movement(mov)
 
     def _handle_agent_cycle(self, data: Dict):
         """
@@ -335,6 +468,9 @@ class SimulationEngine:
         self._process_restocks(daily_events)
 
         # detect anomalies
+        new_movements = self.movements_log[self.movement_cursor :]
+        self.movement_cursor = len(self.movements_log)
+
         new_anomalies = generate_anomalies(
             inventory=self.inventory,
             movements=self.movements_log,
@@ -343,14 +479,46 @@ class SimulationEngine:
             batches=self.batches,
             current_time=self.current_time,
             existing_anomalies=self.anomalies_log,
+            detectors=self.detectors,
+            new_movements=new_movements,
         )
         self.anomalies_log.extend(new_anomalies)
-
+        self.reliability.update(new_anomalies, at=self.current_time)
+        self.genealogy.add_movements(new_movements)
+        self.correlation.add(new_anomalies)
+
+        if self.conn is not None:
+            self.flush_movements(self.conn)
+            self.flush_inventory(self.conn)
+            # before incidents, which reference them
+            self.flush_anomalies(self.conn)
+            # movements logged from now on are stamped now or later, so every
+            # checkpoint strictly before now is final
+            ensure_checkpoints(self.conn, until=self.current_time - timedelta(microseconds=1))
+            self.reliability.save(self.conn)
+            self.correlation.save(self.conn)
+
+        self.triage.push(new_anomalies)
+        investigations = self.triage.next_cycle()
         if new_anomalies:
-            # replace print with actual agent logic
-            print(f"Detected {len(new_anomalies)} new anomalies")
-            for a in new_anomalies:
-                print(f"{a['anomaly_type']}: {a['details'][:50]}...")
+            print(
+                f"Detected {len(new_anomalies)} new anomalies, "
+                f"investigating {len(investigations)} ({len(self.triage)} queued)"
+            )
+
+        for investigation in investigations:
+            record = {"time": self.current_time, **investigation.summary()}
+            if self.agent is not None:
+                try:
+                    record["finding"] = self.agent.run(investigation_prompt(investigation))
+                except Exception as e:
+                    record["finding"] = f"Agent failed: {e}"
+            else:
+                print(
+                    f"{record['investigation_id']}: {', '.join(record['anomaly_types'])} "
+                    f"batches={record['batch_ids']}"
+                )
+            self.investigations_log.append(record)
 
     def _process_restocks(self, events: List[Dict]):
         """Process restocks in response to low stock events."""
@@ -391,7 +559,7 @@ class SimulationEngine:
                 timestamp=restock_time,
                 source="SIMULATION",
             )
-            self.movements_log.append(mov)
+            self._log_movement(mov)
 
     def _handle_inject_geographic(self, data: Dict):
         """Inject a geographic impossibility anomaly."""
@@ -433,7 +601,7 @@ class SimulationEngine:
 
         # create a restock at the source
         mov1 = {
-            "movement_id": f"MOV_{random.randint(100000, 999999)}",
+            "movement_id": new_movement_id(),
             "inventory_id": source_inv["inventory_id"],
             "facility_id": source_inv["facility_id"],
             "batch_id": batch_id,
@@ -446,11 +614,11 @@ class SimulationEngine:
             "source": "SIMULATION_ANOMALY",
             "reason": "GEOGRAPHIC_TEST",
         }
-        self.movements_log.append(mov1)
+        self._log_movement(mov1)
 
         # create a restock at distant facility 1-2 hours later
         mov2 = {
-            "movement_id": f"MOV_{random.randint(100000, 999999)}",
+            "movement_id": new_movement_id(),
             "inventory_id": f"ANOMALY_{source_inv['inventory_id']}",
             "facility_id": distant["facility_id"],
             "batch_id": batch_id,  # same batch id
@@ -465,7 +633,7 @@ class SimulationEngine:
             "source": "SIMULATION_ANOMALY",
             "reason": "GEOGRAPHIC_TEST",
         }
-        self.movements_log.append(mov2)
+        self._log_movement(mov2)
 
         print(
             f"Injected: Batch {batch_id} at {source_facility['state']} and {distant['state']}"
@@ -493,7 +661,7 @@ class SimulationEngine:
 
         for i in range(5):
             mov = {
-                "movement_id": f"MOV_{random.randint(100000, 999999)}",
+                "movement_id": new_movement_id(),
                 "inventory_id": inv["inventory_id"],
                 "facility_id": inv["facility_id"],
                 "batch_id": batch_id,
@@ -508,12 +676,98 @@ class SimulationEngine:
                 "source": "SIMULATION_ANOMALY",
                 "reason": "IMPOSSIBLE_QTY_TEST",
             }
-            self.movements_log.append(mov)
+            self._log_movement(mov)
 
         print(
             f"Injected: Batch {batch_id} dispensed {excess_qty} (initial was {initial_qty})"
         )
 
+    def _handle_inject_pass_through(self, data: Dict):
+        """Inject repeated receive-and-forward cycles at one facility."""
+        print(f"[Inject] Pass-through at {self.current_time}")
+
+        candidates = [inv for inv in self.inventory if inv["quantity"] > 0]
+        if len(self.facilities) < 2 or not candidates:
+            return
+
+        inv = random.choice(candidates)
+        destinations = [
+            f for f in self.facilities if f["facility_id"] != inv["facility_id"]
+        ]
+
+        # four rounds: receive a delivery, ship it on two hours later
+        for i in range(4):
+            received_at = self.current_time + timedelta(hours=i * 6)
+            qty = random.randint(80, 150)
+            self._log_movement(
+                restock(
+                    inventory=inv,
+                    quantity=qty,
+                    timestamp=received_at,
+                    source="SIMULATION_ANOMALY",
+                )
+            )
+            self._log_movement(
+                transfer_out(
+                    inventory=inv,
+                    quantity=qty,
+                    timestamp=received_at + timedelta(hours=2),
+                    destination_facility_id=random.choice(destinations)["facility_id"],
+                    source="SIMULATION_ANOMALY",
+                )
+            )
+
+        print(f"Injected: {inv['facility_id']} forwarding {inv['med_id']} ({inv['batch_id']})")
+
+    def _handle_inject_untraced_transfer(self, data: Dict):
+        """Inject a transfer receipt naming a sender that never had the batch."""
+        print(f"[Inject] Untraced transfer at {self.current_time}")
+
+        inv = random.choice(self.inventory)
+        holders = {i["facility_id"] for i in self.inventory if i["batch_id"] == inv["batch_id"]}
+        senders = [f for f in self.facilities if f["facility_id"] not in holders]
+        if not senders:
+            return
+
+        sender = random.choice(senders)["facility_id"]
+        self._log_movement(
+            transfer_in(
+                inventory=inv,
+                quantity=random.randint(100, 300),
+                timestamp=self.current_time,
+                source_facility_id=sender,
+                source="SIMULATION_ANOMALY",
+            )
+        )
+
+        print(f"Injected: {inv['facility_id']} received {inv['batch_id']} from {sender}")
+
+    def _handle_inject_lookalike_batch(self, data: Dict):
+        """Inject a batch whose number swaps one character of a genuine one for a look-alike."""
+        print(f"[Inject] Look-alike batch number at {self.current_time}")
+
+        lookalikes = {}
+        for letter, digit in CONFUSABLES.items():
+            lookalikes.setdefault(digit, chr(letter))
+        genuine = random.choice(self.batches)
+        number = genuine["batch_number"]
+        positions = [i for i, c in enumerate(number) if c in lookalikes]
+        if not positions:
+            return
+
+        i = random.choice(positions[len(positions) // 2 :])
+        fake = dict(
+            genuine,
+            batch_id=f"BAT_X{random.randint(1000, 9999)}",
+            batch_number=number[:i] + lookalikes[number[i]] + number[i + 1 :],
+            is_verified=False,
+        )
+        self.batches.append(fake)
+        self.genealogy.add_batches([fake])
+        self.correlation.batch_lookup[fake["batch_id"]] = fake
+
+        print(f"Injected: batch {fake['batch_id']} numbered {fake['batch_number']} (genuine {number})")
+
 
 if __name__ == "__main__":
 
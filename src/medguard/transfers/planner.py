@@ -0,0 +1,390 @@
+"""
+Batch transfer planning with min-cost flow.
+
+When a shortage hits, many facilities ask for the same medication at once.
+Matching them one at a time double-books donors and ignores which stock is
+about to expire. Instead every open request of a planning cycle is solved
+together as a transportation problem:
+
+    source -> (donor facility, batch) -> request -> sink
+
+Donor edges carry the batch quantity, request edges the requested units.
+The per-unit cost on (donor batch -> request) edges combines distance (or
+road travel time, given a travel model) and expiry: stock close to expiry
+is cheaper to move, because sending it where it will be used avoids
+writing it off. That is the README's "take the 10 near-expiry units,
+source the other 20 elsewhere" as an optimization.
+
+Each medication, and within it each group of requests that share no
+donors, is an independent subproblem. Each request only gets edges to its
+nearest viable donors, so thousands of requests solve in seconds with the
+pure-python solver below.
+"""
+
+import heapq
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from medguard.detection.events import DEFAULT_THRESHOLDS as EVENT_THRESHOLDS
+from medguard.transfers.recommender import TransferRecommender
+from medguard.utils.travel import TravelTimeModel
+
+DEFAULT_CANDIDATES_PER_REQUEST = 8
+
+# sending a unit that expires within NEAR_EXPIRY_DAYS is worth this many km of travel
+EXPIRY_WEIGHT_KM = 100
+# cold chain stock degrades in transit, so distance costs more
+COLD_CHAIN_DISTANCE_FACTOR = 2.0
+# costs are per unit and scaled to integers for the solver
+COST_SCALE = 100
+# with a travel time model, an hour on the road costs as much as this many km
+KM_PER_ROAD_HOUR = 60
+
+INF = float("inf")
+
+
+class MinCostFlow:
+    """
+    Successive shortest paths with potentials (Dijkstra), augmenting a
+    blocking flow over all zero reduced-cost paths after each Dijkstra run.
+    Costs must be non-negative integers.
+    """
+
+    def __init__(self, n: int):
+        self.n = n
+        self.adj: List[List[int]] = [[] for _ in range(n)]
+        # edge e and its reverse e ^ 1 are stored next to each other
+        self.to: List[int] = []
+        self.cap: List[int] = []
+        self.cost: List[int] = []
+
+    def add_edge(self, u: int, v: int, capacity: int, cost: int) -> int:
+        e = len(self.to)
+        self.to += [v, u]
+        self.cap += [capacity, 0]
+        self.cost += [cost, -cost]
+        self.adj[u].append(e)
+        self.adj[v].append(e + 1)
+        return e
+
+    def flow_on(self, e: int) -> int:
+        return self.cap[e + 1]
+
+    def solve(self, s: int, t: int) -> Tuple[int, int]:
+        """Max flow from s to t at minimum cost. Returns (flow, cost)."""
+        n, adj, to, cap, cost = self.n, self.adj, self.to, self.cap, self.cost
+        potential = [0] * n
+        total_flow = total_cost = 0
+
+        while True:
+            dist = [INF] * n
+            dist[s] = 0
+            done = [False] * n
+            heap = [(0, s)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if done[u]:
+                    continue
+                done[u] = True
+                if u == t:
+                    # nodes beyond t can't shorten this path; stop early
+                    break
+                pu = potential[u]
+                for e in adj[u]:
+                    if cap[e] > 0:
+                        v = to[e]
+                        nd = d + cost[e] + pu - potential[v]
+                        if nd < dist[v]:
+                            dist[v] = nd
+                            heapq.heappush(heap, (nd, v))
+
+            if not done[t]:
+                break
+            # unsettled nodes get dist[t], which keeps every reduced cost non-negative
+            dt = dist[t]
+            for v in range(n):
+                potential[v] += dist[v] if done[v] else dt
+
+            pushed = self._blocking_flow(s, t, potential)
+            total_flow += pushed
+            total_cost += pushed * (potential[t] - potential[s])
+
+        return total_flow, total_cost
+
+    def _blocking_flow(self, s: int, t: int, potential: List[int]) -> int:
+        """Augment along every zero reduced-cost path (Dinic on the admissible graph)."""
+        n, adj, to, cap, cost = self.n, self.adj, self.to, self.cap, self.cost
+
+        # only edges with residual capacity and zero reduced cost are admissible;
+        # BFS levels over them keep the graph acyclic
+        admissible: List[List[int]] = [[] for _ in range(n)]
+        level = [-1] * n
+        level[s] = 0
+        queue = deque([s])
+        while queue:
+            u = queue.popleft()
+            pu = potential[u]
+            next_level = level[u] + 1
+            for e in adj[u]:
+                if cap[e] > 0:
+                    v = to[e]
+                    if cost[e] + pu - potential[v] == 0 and level[v] in (-1, next_level):
+                        admissible[u].append(e)
+                        if level[v] < 0:
+                            level[v] = next_level
+                            queue.append(v)
+        if level[t] < 0:
+            return 0
+
+        it = [0] * n
+        total = 0
+        path: List[int] = []
+        u = s
+        while True:
+            if u == t:
+                pushed = min(cap[e] for e in path)
+                for e in path:
+                    cap[e] -= pushed
+                    cap[e ^ 1] += pushed
+                total += pushed
+                path = []
+                u = s
+                continue
+
+            edges = admissible[u]
+            while it[u] < len(edges) and cap[edges[it[u]]] <= 0:
+                it[u] += 1
+
+            if it[u] < len(edges):
+                e = edges[it[u]]
+                path.append(e)
+                u = to[e]
+            else:
+                if u == s:
+                    return total
+                # dead end: step back and skip the edge that led here
+                e = path.pop()
+                u = to[e ^ 1]
+                it[u] += 1
+
+
+def _solve_by_component(n: int, edges: List[Tuple[int, int, int, int]]) -> Tuple[List[int], int]:
+    """
+    Solve source(0) -> sink(1) min-cost flow separately per connected group of
+    donors and requests. Requests far apart never share donors, so the groups
+    are small and each solve only touches its own nodes.
+    Returns (flow per edge, total cost).
+    """
+    parent = list(range(n))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for u, v, _, _ in edges:
+        if u > 1 and v > 1:
+            parent[find(u)] = find(v)
+
+    groups = defaultdict(list)
+    for index, (u, v, _, _) in enumerate(edges):
+        groups[find(v if u == 0 else u)].append(index)
+
+    edge_flows = [0] * len(edges)
+    total_cost = 0
+    for edge_indexes in groups.values():
+        local = {0: 0, 1: 1}
+        for index in edge_indexes:
+            u, v, _, _ = edges[index]
+            local.setdefault(u, len(local))
+            local.setdefault(v, len(local))
+
+        flow = MinCostFlow(len(local))
+        edge_ids = [
+            flow.add_edge(local[edges[i][0]], local[edges[i][1]], edges[i][2], edges[i][3])
+            for i in edge_indexes
+        ]
+        _, cost = flow.solve(0, 1)
+        total_cost += cost
+        for index, e in zip(edge_indexes, edge_ids):
+            edge_flows[index] = flow.flow_on(e)
+
+    return edge_flows, total_cost
+
+
+def _unit_cost(distance_km: float, days_to_expiry: Optional[int], cold_chain: bool) -> int:
+    near_expiry_days = EVENT_THRESHOLDS["NEAR_EXPIRY_DAYS"]
+    if days_to_expiry is None:
+        waste_avoided = 0.0
+    else:
+        waste_avoided = min(1.0, near_expiry_days / max(days_to_expiry, 1))
+
+    distance_cost = distance_km * (COLD_CHAIN_DISTANCE_FACTOR if cold_chain else 1.0)
+    expiry_cost = EXPIRY_WEIGHT_KM * (1 - waste_avoided)
+    return int(round((distance_cost + expiry_cost) * COST_SCALE))
+
+
+def plan_transfers(
+    requests: List[Dict],
+    recommender: TransferRecommender,
+    as_of: Optional[datetime] = None,
+    candidates_per_request: int = DEFAULT_CANDIDATES_PER_REQUEST,
+    max_km: Optional[float] = None,
+    travel: Optional[TravelTimeModel] = None,
+) -> Dict:
+    """
+    Plan transfers for all open requests at once.
+
+    Args:
+        requests: dicts with request_id, facility_id, med_id, quantity.
+        recommender: provides current stock, expiry and facility locations.
+        as_of: planning time, used for expiry (defaults to now).
+        candidates_per_request: nearest viable donors considered per request.
+        max_km: ignore donors farther than this.
+        travel: cost transfers by road travel time instead of straight-line
+            distance (utils.travel.get_travel_model()).
+
+    Returns:
+        {"transfers": [...], "unfilled": [...], "total_cost": float}
+    """
+    as_of = as_of or datetime.now()
+
+    by_med = defaultdict(list)
+    for request in requests:
+        by_med[request["med_id"]].append(request)
+
+    transfers = []
+    unfilled = []
+    total_cost = 0
+
+    for med_id, med_requests in by_med.items():
+        plan = _plan_medication(
+            med_id, med_requests, recommender, as_of, candidates_per_request, max_km, travel
+        )
+        transfers.extend(plan["transfers"])
+        unfilled.extend(plan["unfilled"])
+        total_cost += plan["cost"]
+
+    return {
+        "transfers": transfers,
+        "unfilled": unfilled,
+        "total_cost": round(total_cost / COST_SCALE, 2),
+    }
+
+
+def _plan_medication(
+    med_id: str,
+    requests: List[Dict],
+    recommender: TransferRecommender,
+    as_of: datetime,
+    candidates_per_request: int,
+    max_km: Optional[float],
+    travel: Optional[TravelTimeModel],
+) -> Dict:
+    cold_chain = med_id in recommender.cold_chain_meds
+    holders = recommender.stock.by_med.get(med_id, {})
+    # a facility asking for this medication is short of it, never a donor
+    requesting = {r["facility_id"] for r in requests}
+
+    def viable(facility_id: str) -> bool:
+        if facility_id in requesting or facility_id not in holders:
+            return False
+        if cold_chain and not recommender.facility_lookup[facility_id].get("has_cold_storage"):
+            return False
+        return bool(recommender.usable_batches(med_id, facility_id, as_of))
+
+    # node 0 = source, node 1 = sink, then donor batches and requests
+    supply_nodes: Dict[Tuple[str, str], int] = {}
+    supply_info: Dict[int, Dict] = {}
+    request_nodes: Dict[int, Dict] = {}
+    edges = []  # (u, v, capacity, cost)
+    transfer_edges = []  # (edge list index, supply node, request node, distance, travel hours)
+    next_node = 2
+
+    for request in requests:
+        requester = recommender.facility_lookup.get(request["facility_id"])
+        if requester is None or request["quantity"] <= 0:
+            continue
+
+        request_node = next_node
+        next_node += 1
+        request_nodes[request_node] = request
+        edges.append((request_node, 1, request["quantity"], 0))
+        if requester["latitude"] is None or requester["longitude"] is None:
+            # no donors can be ranked; the request is reported as unfilled
+            continue
+
+        donors = recommender.spatial.nearest(
+            requester["latitude"],
+            requester["longitude"],
+            k=candidates_per_request,
+            accept=viable,
+            max_km=max_km,
+        )
+        for distance, donor_id in donors:
+            travel_hours = None
+            cost_km = distance
+            if travel is not None:
+                donor = recommender.facility_lookup[donor_id]
+                travel_hours = travel.facility_hours(donor, requester)
+                cost_km = travel_hours * KM_PER_ROAD_HOUR
+
+            for batch in recommender.usable_batches(med_id, donor_id, as_of):
+                key = (donor_id, batch["batch_id"])
+                if key not in supply_nodes:
+                    supply_nodes[key] = next_node
+                    supply_info[next_node] = {"facility_id": donor_id, **batch}
+                    edges.append((0, next_node, batch["quantity"], 0))
+                    next_node += 1
+
+                transfer_edges.append(
+                    (len(edges), supply_nodes[key], request_node, distance, travel_hours)
+                )
+                edges.append(
+                    (
+                        supply_nodes[key],
+                        request_node,
+                        request["quantity"],
+                        _unit_cost(cost_km, batch["days_to_expiry"], cold_chain),
+                    )
+                )
+
+    edge_flows, cost = _solve_by_component(next_node, edges)
+
+    transfers = []
+    received = defaultdict(int)
+    for edge_index, supply_node, request_node, distance, travel_hours in transfer_edges:
+        quantity = edge_flows[edge_index]
+        if quantity <= 0:
+            continue
+        supply = supply_info[supply_node]
+        request = request_nodes[request_node]
+        received[request_node] += quantity
+        transfers.append(
+            {
+                "request_id": request.get("request_id"),
+                "from_facility_id": supply["facility_id"],
+                "to_facility_id": request["facility_id"],
+                "med_id": med_id,
+                "batch_id": supply["batch_id"],
+                "quantity": quantity,
+                "distance_km": round(distance, 1),
+                "travel_hours": None if travel_hours is None else round(travel_hours, 2),
+                "days_to_expiry": supply["days_to_expiry"],
+            }
+        )
+
+    unfilled = [
+        {
+            "request_id": request.get("request_id"),
+            "facility_id": request["facility_id"],
+            "med_id": med_id,
+            "shortfall": request["quantity"] - received[node],
+        }
+        for node, request in request_nodes.items()
+        if received[node] < request["quantity"]
+    ]
+
+    return {"transfers": transfers, "unfilled": unfilled, "cost": cost}
@@ -0,0 +1,403 @@
+"""
+Transfer recommendation: "I need 30 units of paracetamol at FAC_012".
+
+Two indexes keep queries in the millisecond range for thousands of facilities:
+
+- StockIndex: med_id -> facility_id -> batch_id -> (quantity, expiry_date),
+  updated in O(1) per movement or inventory change.
+- SpatialIndex: a uniform lat/lon grid over facility coordinates, searched in
+  rings outward from the requester for the k nearest viable sources.
+
+Viable sources have unexpired stock of the medication and, for cold chain
+medications, cold storage. They are ranked by distance, expiry proximity
+(near-expiry stock is preferred so it gets used instead of wasted), stock
+coverage and facility reliability.
+"""
+
+import heapq
+import math
+import random
+import sqlite3
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from medguard.data.generators.movements import transfer_in, transfer_out
+from medguard.detection.events import DEFAULT_THRESHOLDS as EVENT_THRESHOLDS
+from medguard.utils.geo import haversine_distance
+
+KM_PER_DEGREE = 111.19
+DEFAULT_CELL_DEGREES = 0.5
+
+DEFAULT_WEIGHTS = {
+    "distance": 1.0,
+    "expiry": 0.5,
+    "coverage": 0.5,
+    "reliability": 1.0,
+}
+
+# distance at which the distance score halves
+DISTANCE_SCALE_KM = 50
+
+
+class SpatialIndex:
+    """Uniform lat/lon grid for k-nearest-facility queries."""
+
+    def __init__(self, cell_degrees: float = DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.cells: Dict[Tuple[int, int], List[str]] = defaultdict(list)
+        self.coords: Dict[str, Tuple[float, float]] = {}
+        self._max_abs_lat = 0.0
+        self._bounds = None  # (min_i, max_i, min_j, max_j) of occupied cells
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (
+            math.floor(lat / self.cell_degrees),
+            math.floor(lon / self.cell_degrees),
+        )
+
+    def add(self, facility_id: str, lat: float, lon: float) -> None:
+        if facility_id in self.coords:
+            old_cell = self._cell(*self.coords[facility_id])
+            self.cells[old_cell].remove(facility_id)
+
+        self.coords[facility_id] = (lat, lon)
+        i, j = self._cell(lat, lon)
+        self.cells[(i, j)].append(facility_id)
+        self._max_abs_lat = max(self._max_abs_lat, abs(lat))
+
+        if self._bounds is None:
+            self._bounds = (i, i, j, j)
+        else:
+            min_i, max_i, min_j, max_j = self._bounds
+            self._bounds = (min(min_i, i), max(max_i, i), min(min_j, j), max(max_j, j))
+
+    def _ring(self, center: Tuple[int, int], r: int):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int,
+        accept: Optional[Callable[[str], bool]] = None,
+        max_km: Optional[float] = None,
+    ) -> List[Tuple[float, str]]:
+        """
+        k nearest facilities passing `accept`, as (distance_km, facility_id)
+        sorted by distance.
+        """
+        if not self.coords or k <= 0:
+            return []
+
+        # smallest km per degree anywhere in the index (longitude shrinks with latitude)
+        km_per_cell = (
+            self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(self._max_abs_lat))
+        )
+        center = self._cell(lat, lon)
+        min_i, max_i, min_j, max_j = self._bounds
+        max_ring = max(
+            abs(center[0] - min_i),
+            abs(center[0] - max_i),
+            abs(center[1] - min_j),
+            abs(center[1] - max_j),
+        )
+
+        best: List[Tuple[float, str]] = []  # max-heap via negated distance
+        for r in range(max_ring + 1):
+            for cell in self._ring(center, r):
+                for facility_id in self.cells.get(cell, ()):
+                    if accept is not None and not accept(facility_id):
+                        continue
+                    f_lat, f_lon = self.coords[facility_id]
+                    distance = haversine_distance(lat, lon, f_lat, f_lon)
+                    if max_km is not None and distance > max_km:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, facility_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, facility_id))
+
+            # everything beyond ring r is at least r cells away
+            lower_bound = r * km_per_cell
+            if max_km is not None and lower_bound > max_km:
+                break
+            if len(best) == k and lower_bound >= -best[0][0]:
+                break
+
+        return sorted((-d, facility_id) for d, facility_id in best)
+
+
+class StockIndex:
+    """med_id -> facility_id -> batch_id -> (quantity, expiry_date), kept current per movement."""
+
+    def __init__(self):
+        self.by_med: Dict[str, Dict[str, Dict[str, Tuple[int, str]]]] = defaultdict(dict)
+        # inventory_id -> (med_id, facility_id, batch_id, expiry_date)
+        self.inventory_keys: Dict[str, Tuple[str, str, str, str]] = {}
+
+    def set_quantity(
+        self,
+        inventory_id: str,
+        quantity: int,
+        med_id: Optional[str] = None,
+        facility_id: Optional[str] = None,
+        batch_id: Optional[str] = None,
+        expiry_date: Optional[str] = None,
+    ) -> None:
+        if inventory_id not in self.inventory_keys:
+            if med_id is None:
+                return  # unknown inventory row and nothing to place it with
+            self.inventory_keys[inventory_id] = (med_id, facility_id, batch_id, expiry_date)
+
+        med_id, facility_id, batch_id, expiry_date = self.inventory_keys[inventory_id]
+        facilities = self.by_med[med_id]
+
+        if quantity and quantity > 0:
+            facilities.setdefault(facility_id, {})[batch_id] = (quantity, expiry_date)
+        elif facility_id in facilities:
+            facilities[facility_id].pop(batch_id, None)
+            if not facilities[facility_id]:
+                del facilities[facility_id]
+
+    def batches(self, med_id: str, facility_id: str) -> Dict[str, Tuple[int, str]]:
+        return self.by_med.get(med_id, {}).get(facility_id, {})
+
+
+def _days_until(expiry_date: Optional[str], as_of: datetime) -> Optional[int]:
+    if not expiry_date:
+        return None
+    return (datetime.strptime(expiry_date, "%Y-%m-%d") - as_of).days
+
+
+class TransferRecommender:
+    def __init__(
+        self,
+        facilities: List[Dict],
+        medications: List[Dict],
+        reliability: Optional[Callable[[str], float]] = None,
+        weights: Dict[str, float] = DEFAULT_WEIGHTS,
+        cell_degrees: float = DEFAULT_CELL_DEGREES,
+    ):
+        self.facility_lookup = {f["facility_id"]: f for f in facilities}
+        self.cold_chain_meds = {
+            m["med_id"] for m in medications if m.get("is_cold_chain")
+        }
+        # facility_id -> score in [0, 1]; every facility is fully reliable until scored
+        self.reliability = reliability or (lambda facility_id: 1.0)
+        self.weights = weights
+
+        self.spatial = SpatialIndex(cell_degrees)
+        for f in facilities:
+            if f.get("latitude") is not None and f.get("longitude") is not None:
+                self.spatial.add(f["facility_id"], f["latitude"], f["longitude"])
+
+        self.stock = StockIndex()
+        self.last_inventory_change_id = 0
+
+    @classmethod
+    def from_db(cls, conn: sqlite3.Connection, **kwargs) -> "TransferRecommender":
+        facilities = [dict(row) for row in conn.execute("SELECT * FROM facilities")]
+        medications = [dict(row) for row in conn.execute("SELECT * FROM medications")]
+        recommender = cls(facilities, medications, **kwargs)
+
+        rows = conn.execute(
+            """
+            SELECT i.inventory_id, i.facility_id, i.batch_id, i.quantity,
+                   b.expiry_date, br.med_id
+            FROM inventory i
+            JOIN batches b ON i.batch_id = b.batch_id
+            JOIN brands br ON b.brand_id = br.brand_id
+            """
+        )
+        recommender.load_inventory([dict(row) for row in rows])
+        # the rows just read already include every change logged so far
+        recommender.last_inventory_change_id = (
+            conn.execute("SELECT MAX(change_id) FROM inventory_change_log").fetchone()[0] or 0
+        )
+        return recommender
+
+    def load_inventory(self, inventory: List[Dict]) -> None:
+        for inv in inventory:
+            self.stock.set_quantity(
+                inv["inventory_id"],
+                inv["quantity"],
+                med_id=inv["med_id"],
+                facility_id=inv["facility_id"],
+                batch_id=inv["batch_id"],
+                expiry_date=inv.get("expiry_date"),
+            )
+
+    def apply_movement(self, movement: Dict) -> None:
+        """Incremental update: a movement carries the row's new quantity."""
+        if movement.get("quantity_after") is None:
+            return
+        self.stock.set_quantity(movement["inventory_id"], movement["quantity_after"])
+
+    def sync(self, conn: sqlite3.Connection) -> int:
+        """
+        Apply inventory changes stored since the last sync. Returns how many
+        were applied. Reads inventory_change_log rather than movements: the
+        engine writes quantities with upsert_inventory_quantities, and not
+        every stored movement's quantity_after is the row's quantity.
+        """
+        rows = conn.execute(
+            """
+            SELECT l.change_id, l.inventory_id, l.quantity,
+                   i.facility_id, i.batch_id, b.expiry_date, br.med_id
+            FROM inventory_change_log l
+            LEFT JOIN inventory i ON i.inventory_id = l.inventory_id
+            LEFT JOIN batches b ON b.batch_id = i.batch_id
+            LEFT JOIN brands br ON br.brand_id = b.brand_id
+            WHERE l.change_id > ?
+            ORDER BY l.change_id
+            """,
+            (self.last_inventory_change_id,),
+        ).fetchall()
+        for row in rows:
+            # placement columns only matter for rows the index hasn't seen yet
+            self.stock.set_quantity(
+                row["inventory_id"],
+                row["quantity"],
+                med_id=row["med_id"],
+                facility_id=row["facility_id"],
+                batch_id=row["batch_id"],
+                expiry_date=row["expiry_date"],
+            )
+        if rows:
+            self.last_inventory_change_id = rows[-1]["change_id"]
+        return len(rows)
+
+    def usable_batches(self, med_id: str, facility_id: str, as_of: datetime) -> List[Dict]:
+        usable = []
+        for batch_id, (quantity, expiry_date) in self.stock.batches(med_id, facility_id).items():
+            days = _days_until(expiry_date, as_of)
+            if days is not None and days <= 0:
+                continue
+            usable.append(
+                {
+                    "batch_id": batch_id,
+                    "quantity": quantity,
+                    "expiry_date": expiry_date,
+                    "days_to_expiry": days,
+                }
+            )
+        # soonest expiry first: that stock should leave first
+        usable.sort(key=lambda b: b["days_to_expiry"] if b["days_to_expiry"] is not None else 10**9)
+        return usable
+
+    def recommend(
+        self,
+        facility_id: str,
+        med_id: str,
+        quantity: int,
+        k: int = 5,
+        as_of: Optional[datetime] = None,
+        max_km: Optional[float] = None,
+    ) -> List[Dict]:
+        """
+        Up to k viable source facilities for `quantity` units, best first.
+        Empty if the requester has no coordinates to measure distance from.
+        """
+        requester = self.facility_lookup.get(facility_id)
+        if requester is None:
+            raise ValueError(f"Facility not found: {facility_id}")
+        if requester.get("latitude") is None or requester.get("longitude") is None:
+            return []
+
+        as_of = as_of or datetime.now()
+        holders = self.stock.by_med.get(med_id, {})
+        needs_cold = med_id in self.cold_chain_meds
+
+        def viable(candidate_id: str) -> bool:
+            if candidate_id == facility_id or candidate_id not in holders:
+                return False
+            if needs_cold and not self.facility_lookup[candidate_id].get("has_cold_storage"):
+                return False
+            return bool(self.usable_batches(med_id, candidate_id, as_of))
+
+        # rank a wider pool than k so a slightly farther but better source can win
+        nearest = self.spatial.nearest(
+            requester["latitude"],
+            requester["longitude"],
+            k=k * 3,
+            accept=viable,
+            max_km=max_km,
+        )
+
+        near_expiry_days = EVENT_THRESHOLDS["NEAR_EXPIRY_DAYS"]
+        candidates = []
+        for distance, source_id in nearest:
+            batches = self.usable_batches(med_id, source_id, as_of)
+            available = sum(b["quantity"] for b in batches)
+            soonest = batches[0]["days_to_expiry"]
+            reliability = self.reliability(source_id)
+
+            distance_score = 1 / (1 + distance / DISTANCE_SCALE_KM)
+            expiry_score = (
+                0.0 if soonest is None else min(1.0, near_expiry_days / max(soonest, 1))
+            )
+            coverage_score = min(1.0, available / quantity) if quantity > 0 else 1.0
+
+            score = (
+                self.weights["distance"] * distance_score
+                + self.weights["expiry"] * expiry_score
+                + self.weights["coverage"] * coverage_score
+                + self.weights["reliability"] * reliability
+            )
+
+            source = self.facility_lookup[source_id]
+            candidates.append(
+                {
+                    "facility_id": source_id,
+                    "facility_name": source["name"],
+                    "city": source.get("city"),
+                    "distance_km": round(distance, 1),
+                    "available_quantity": available,
+                    "soonest_expiry_days": soonest,
+                    "reliability": round(reliability, 3),
+                    "score": round(score, 4),
+                    "batches": batches,
+                }
+            )
+
+        candidates.sort(key=lambda c: c["score"], reverse=True)
+        return candidates[:k]
+
+
+def create_transfer_movements(
+    source_inventory: Dict,
+    destination_inventory: Dict,
+    quantity: int,
+    timestamp,
+    source: str = "TRANSFER",
+) -> List[Dict]:
+    """Record an accepted transfer as a linked TRANSFER_OUT / TRANSFER_IN pair."""
+    quantity = min(quantity, source_inventory["quantity"])
+    transfer_id = f"TXF_{random.randint(10000, 99999)}"
+    out_mov = transfer_out(
+        inventory=source_inventory,
+        quantity=quantity,
+        timestamp=timestamp,
+        destination_facility_id=destination_inventory["facility_id"],
+        transfer_id=transfer_id,
+        source=source,
+    )
+    in_mov = transfer_in(
+        inventory=destination_inventory,
+        quantity=quantity,
+        timestamp=timestamp,
+        source_facility_id=source_inventory["facility_id"],
+        transfer_id=transfer_id,
+        source=source,
+    )
+    return [out_mov, in_mov]
@@ -1,5 +1,6 @@
 """MedGuard utility functions."""
 
 from medguard.utils.geo import haversine_distance
+from medguard.utils.travel import TravelTimeModel, get_travel_model
 
-__all__ = ["haversine_distance"]
+__all__ = ["haversine_distance", "TravelTimeModel", "get_travel_model"]
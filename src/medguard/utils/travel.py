@@ -0,0 +1,131 @@
+"""
+Road travel times between facilities.
+
+A flat km threshold treats Lagos -> Ibadan (two hours of expressway) the
+same as Lagos -> Maiduguri (a day and more). This models the major road
+network in data/seed/roads_data.py instead: facilities snap to their
+nearest city node, and the travel time between two facilities is
+
+    access time to the node + shortest road time between nodes + access time
+
+All-pairs shortest road times are computed once with Dijkstra from every
+node and cached on disk as a .npy matrix, keyed by a hash of the road data,
+so a lookup is two dict hits and one array index.
+"""
+
+import hashlib
+import heapq
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from medguard.data.seed.roads_data import road_edges, road_nodes
+from medguard.utils.geo import haversine_distance
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "medguard"
+
+# local roads between a facility and the road network node it snaps to
+ACCESS_SPEED_KMH = 40
+
+
+def shortest_paths(n: int, edges: List[Tuple[int, int, float]]) -> np.ndarray:
+    """All-pairs shortest travel times (Dijkstra from every node); inf if unreachable."""
+    adjacency: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+    for u, v, hours in edges:
+        adjacency[u].append((v, hours))
+        adjacency[v].append((u, hours))
+
+    matrix = np.full((n, n), np.inf)
+    for source in range(n):
+        row = matrix[source]
+        row[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            hours, u = heapq.heappop(heap)
+            if hours > row[u]:
+                continue
+            for v, edge_hours in adjacency[u]:
+                candidate = hours + edge_hours
+                if candidate < row[v]:
+                    row[v] = candidate
+                    heapq.heappush(heap, (candidate, v))
+    return matrix
+
+
+class TravelTimeModel:
+    def __init__(self, nodes: List[Tuple], edges: List[Tuple], matrix: Optional[np.ndarray] = None):
+        self.node_names = [node[0] for node in nodes]
+        self.node_coords = [(node[2], node[3]) for node in nodes]
+        index = {name: i for i, name in enumerate(self.node_names)}
+        self.edges = [(index[a], index[b], hours) for a, b, hours in edges]
+
+        self.matrix = matrix if matrix is not None else shortest_paths(len(nodes), self.edges)
+
+        # facility_id -> (node, access hours)
+        self.snapped: Dict[str, Tuple[int, float]] = {}
+        # longest access time of any facility snapped to each node
+        self.node_access = [0.0] * len(nodes)
+
+    @classmethod
+    def load(cls, cache_dir: Optional[Path] = DEFAULT_CACHE_DIR) -> "TravelTimeModel":
+        """Model of the shipped road network, reusing the cached matrix if there is one."""
+        key = hashlib.sha1(repr((road_nodes, road_edges)).encode()).hexdigest()[:16]
+        path = Path(cache_dir) / f"travel_times_{key}.npy" if cache_dir else None
+
+        if path is not None and path.exists():
+            return cls(road_nodes, road_edges, np.load(path))
+
+        model = cls(road_nodes, road_edges)
+        if path is not None:
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                np.save(path, model.matrix)
+            except OSError:
+                pass  # read-only home: just recompute next time
+        return model
+
+    def snap(self, facility: Dict) -> Tuple[int, float]:
+        """(node, access hours) for a facility, snapping it on first use."""
+        snapped = self.snapped.get(facility["facility_id"])
+        if snapped is None:
+            lat, lon = facility["latitude"], facility["longitude"]
+            km, node = min(
+                (haversine_distance(lat, lon, n_lat, n_lon), i)
+                for i, (n_lat, n_lon) in enumerate(self.node_coords)
+            )
+            access = km / ACCESS_SPEED_KMH
+            snapped = self.snapped[facility["facility_id"]] = (node, access)
+            self.node_access[node] = max(self.node_access[node], access)
+        return snapped
+
+    def add_facilities(self, facilities: Iterable[Dict]) -> None:
+        for facility in facilities:
+            self.snap(facility)
+
+    def node_bound(self, a: int, b: int) -> float:
+        """Upper bound on travel time between any facilities snapped to nodes a and b."""
+        return float(self.matrix[a, b]) + self.node_access[a] + self.node_access[b]
+
+    def max_hours(self) -> float:
+        finite = self.matrix[np.isfinite(self.matrix)]
+        return float(finite.max()) + 2 * max(self.node_access)
+
+    def facility_hours(self, a: Dict, b: Dict) -> float:
+        """Road travel time between two facilities, in hours."""
+        if a["facility_id"] == b["facility_id"]:
+            return 0.0
+        node_a, access_a = self.snap(a)
+        node_b, access_b = self.snap(b)
+        if node_a == node_b:
+            # same town: straight across on local roads
+            km = haversine_distance(a["latitude"], a["longitude"], b["latitude"], b["longitude"])
+            return km / ACCESS_SPEED_KMH
+        return access_a + float(self.matrix[node_a, node_b]) + access_b
+
+
+@lru_cache(maxsize=1)
+def get_travel_model() -> TravelTimeModel:
+    """Shared model, so the detector and the transfer planner use one matrix."""
+    return TravelTimeModel.load()
@@ -0,0 +1,110 @@
+"""
+Stdlib HTTP front end for the verification service.
+
+    python -m medguard.verification.server --port 8080
+
+    GET /verify?batch_number=NOV-2024-0001&nrn=B4-2959
+    GET /stats
+
+Connections are kept alive (HTTP/1.1) and each one gets a thread. A
+background thread calls refresh() every --refresh-seconds, so new anomalies
+and flag changes reach verdicts without a restart.
+"""
+
+import argparse
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from medguard.db.database import to_json
+from medguard.verification.service import VerificationService
+
+REFRESH_SECONDS = 5.0
+
+
+class VerifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes; don't let the body wait for an ACK
+    disable_nagle_algorithm = True
+    service: VerificationService = None  # set by make_server
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/verify":
+            query = parse_qs(url.query)
+            batch_number = query.get("batch_number", [""])[0]
+            if not batch_number:
+                self._send(400, {"error": "batch_number is required"})
+                return
+            self._send(200, self.service.verify(batch_number, query.get("nrn", [None])[0]))
+        elif url.path == "/stats":
+            self._send(200, self.service.stats())
+        else:
+            self._send(404, {"error": f"no route for {url.path}"})
+
+    def _send(self, status: int, payload) -> None:
+        body = to_json(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # one line per request to stderr costs more than the request
+
+
+def make_server(
+    service: VerificationService,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+) -> ThreadingHTTPServer:
+    handler = type("BoundVerifyHandler", (VerifyHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_refresher(
+    service: VerificationService,
+    interval: float = REFRESH_SECONDS,
+    stop: Optional[threading.Event] = None,
+) -> threading.Event:
+    """Refresh the service every interval seconds until the returned event is set."""
+    stop = stop or threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                service.refresh()
+            except Exception as e:
+                # e.g. "database is locked" while a writer holds it; retried next tick
+                print(f"refresh failed: {e}", file=sys.stderr)
+
+    threading.Thread(target=loop, name="verification-refresh", daemon=True).start()
+    return stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", type=Path, default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--refresh-seconds", type=float, default=REFRESH_SECONDS)
+    args = parser.parse_args()
+
+    service = VerificationService(args.db).load()
+    print(f"loaded: {service.stats()}")
+    start_refresher(service, args.refresh_seconds)
+
+    server = make_server(service, args.host, args.port)
+    print(f"listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
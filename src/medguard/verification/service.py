@@ -0,0 +1,342 @@
+"""
+Point-of-sale pack verification.
+
+A pharmacist (or patient) reads the batch number and NAFDAC registration
+number (NRN) off a pack and asks whether it's genuine. Answering that from
+SQLite means a four-table join per request. Instead the service loads
+everything a verdict needs into dicts once:
+
+    batch number -> batch ids      batch id -> brand, medication, NRN, expiry
+    look-alike skeleton -> batch numbers
+    flagged batch ids              batch id -> active anomalies
+
+and keeps a ready-made entry per registered batch number, so a verify call
+is a couple of hash lookups. refresh() reads only what changed since the
+last call, the same way the marathon runner does (anomalies.rowid,
+anomaly_status_log, batch_flag_log, batches.rowid, and batch_change_log for
+batches re-imported with a new number or expiry), and drops the cached
+entries of the batch numbers it touched.
+
+Verdicts:
+
+    VERIFIED   registered, NRN matches, nothing against it
+    WARNING    registered, but with active anomalies below CRITICAL
+    SUSPECT    flagged, a CRITICAL anomaly, duplicate number, wrong NRN, or
+               an unregistered look-alike of a registered number
+    UNKNOWN    not registered
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from medguard.db.database import get_connection_to_db
+from medguard.detection.batch_numbers import skeleton
+
+# anomalies listed per batch in a verdict; the rest are counted
+MAX_ANOMALIES_PER_BATCH = 5
+
+BATCH_COLUMNS = """
+    SELECT b.rowid, b.batch_id, b.batch_number, b.expiry_date, b.is_flagged,
+           br.brand_name, br.med_id, m.generic_name, c.name AS manufacturer_name
+    FROM batches b
+    JOIN brands br ON b.brand_id = br.brand_id
+    LEFT JOIN medications m ON br.med_id = m.med_id
+    LEFT JOIN companies c ON br.manufacturer_id = c.company_id
+"""
+
+
+def normalize(code: Optional[str]) -> str:
+    return (code or "").strip().upper()
+
+
+class VerificationService:
+    def __init__(self, db_path: Optional[Path] = None):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.nrn_by_med: Dict[str, str] = {}
+        self.batches: Dict[str, Dict] = {}
+        self.by_number: Dict[str, List[str]] = {}
+        self.by_skeleton: Dict[Tuple[str, str], Set[str]] = {}
+        self.flagged: Set[str] = set()
+        self.anomalies: Dict[str, Dict[str, Tuple[str, str]]] = {}  # batch id -> anomaly id -> (type, severity)
+
+        # batch number -> verdict parts that don't depend on the NRN asked about;
+        # read without the lock, built and invalidated under it
+        self.entries: Dict[str, Dict] = {}
+
+        self.last_batch_rowid = 0
+        self.last_anomaly_rowid = 0
+        self.last_status_change_id = 0
+        self.last_flag_change_id = 0
+        self.last_batch_change_id = 0
+
+    def load(self, conn: Optional[sqlite3.Connection] = None) -> "VerificationService":
+        """Full read of the reference data; later changes come in through refresh()."""
+        owned = conn is None
+        conn = conn or get_connection_to_db(self.db_path)
+        try:
+            with self.lock:
+                self._reset()
+                self.nrn_by_med = {
+                    row["med_id"]: normalize(row["nrn"])
+                    for row in conn.execute("SELECT med_id, nrn FROM medications")
+                }
+                self.last_status_change_id = (
+                    conn.execute("SELECT MAX(change_id) FROM anomaly_status_log").fetchone()[0] or 0
+                )
+                self.last_flag_change_id = (
+                    conn.execute("SELECT MAX(change_id) FROM batch_flag_log").fetchone()[0] or 0
+                )
+                self.last_batch_change_id = (
+                    conn.execute("SELECT MAX(change_id) FROM batch_change_log").fetchone()[0] or 0
+                )
+                self._read_batches(conn)
+                self._read_anomalies(conn)
+        finally:
+            if owned:
+                conn.close()
+        return self
+
+    def _read_batches(self, conn: sqlite3.Connection) -> Set[str]:
+        """Index batches added since last_batch_rowid. Returns their batch numbers."""
+        numbers = set()
+        for row in conn.execute(
+            BATCH_COLUMNS + "WHERE b.rowid > ? ORDER BY b.rowid",
+            (self.last_batch_rowid,),
+        ):
+            self.last_batch_rowid = row["rowid"]
+            numbers.add(self._index_batch(row))
+        numbers.discard("")
+        return numbers
+
+    def _index_batch(self, row: sqlite3.Row) -> str:
+        """Index one batch row. Returns its batch number ("" if it has none)."""
+        batch = dict(row)
+        del batch["rowid"]
+        number = normalize(batch["batch_number"])
+        if not number:
+            return ""
+
+        self.batches[batch["batch_id"]] = batch
+        self.by_number.setdefault(number, []).append(batch["batch_id"])
+        self.by_skeleton.setdefault(skeleton(number), set()).add(number)
+        if batch.pop("is_flagged"):
+            self.flagged.add(batch["batch_id"])
+        return number
+
+    def _unindex_batch(self, batch_id: str) -> Optional[str]:
+        """Drop a batch from the indexes. Returns the batch number it was under."""
+        batch = self.batches.pop(batch_id, None)
+        if batch is None:
+            return None
+        number = normalize(batch["batch_number"])
+        batch_ids = self.by_number[number]
+        batch_ids.remove(batch_id)
+        if not batch_ids:
+            del self.by_number[number]
+            numbers = self.by_skeleton[skeleton(number)]
+            numbers.discard(number)
+            if not numbers:
+                del self.by_skeleton[skeleton(number)]
+        return number
+
+    def _read_batch_changes(self, conn: sqlite3.Connection) -> Set[str]:
+        """Re-index batches updated in place. Returns their old and new batch numbers."""
+        changed = set()
+        for row in conn.execute(
+            "SELECT change_id, batch_id FROM batch_change_log WHERE change_id > ? ORDER BY change_id",
+            (self.last_batch_change_id,),
+        ):
+            self.last_batch_change_id = row["change_id"]
+            changed.add(row["batch_id"])
+        if not changed:
+            return set()
+
+        numbers = {self._unindex_batch(batch_id) for batch_id in changed}
+        placeholders = ", ".join("?" * len(changed))
+        for row in conn.execute(
+            BATCH_COLUMNS + f"WHERE b.batch_id IN ({placeholders})", sorted(changed)
+        ):
+            numbers.add(self._index_batch(row))
+        numbers -= {None, ""}
+        return numbers
+
+    def _read_anomalies(self, conn: sqlite3.Connection) -> Set[str]:
+        """Pick up new anomalies and is_active flips. Returns the batch ids affected."""
+        touched = set()
+        for row in conn.execute(
+            """
+            SELECT rowid, anomaly_id, anomaly_type, severity, batch_id, is_active
+            FROM anomalies
+            WHERE rowid > ?
+            ORDER BY rowid
+            """,
+            (self.last_anomaly_rowid,),
+        ):
+            self.last_anomaly_rowid = row["rowid"]
+            if not row["batch_id"]:
+                continue
+            if row["is_active"]:
+                self.anomalies.setdefault(row["batch_id"], {})[row["anomaly_id"]] = (
+                    row["anomaly_type"],
+                    row["severity"],
+                )
+                touched.add(row["batch_id"])
+
+        for row in conn.execute(
+            """
+            SELECT l.change_id, l.anomaly_id, l.is_active, a.anomaly_type, a.severity, a.batch_id
+            FROM anomaly_status_log l
+            JOIN anomalies a ON a.rowid = l.anomaly_rowid
+            WHERE l.change_id > ?
+            ORDER BY l.change_id
+            """,
+            (self.last_status_change_id,),
+        ):
+            self.last_status_change_id = row["change_id"]
+            batch_id = row["batch_id"]
+            if not batch_id:
+                continue
+            active = self.anomalies.setdefault(batch_id, {})
+            if row["is_active"]:
+                active[row["anomaly_id"]] = (row["anomaly_type"], row["severity"])
+            else:
+                active.pop(row["anomaly_id"], None)
+            touched.add(batch_id)
+        return touched
+
+    def _read_flags(self, conn: sqlite3.Connection) -> Set[str]:
+        touched = set()
+        for row in conn.execute(
+            """
+            SELECT change_id, batch_id, is_flagged
+            FROM batch_flag_log
+            WHERE change_id > ?
+            ORDER BY change_id
+            """,
+            (self.last_flag_change_id,),
+        ):
+            self.last_flag_change_id = row["change_id"]
+            if row["is_flagged"]:
+                self.flagged.add(row["batch_id"])
+            else:
+                self.flagged.discard(row["batch_id"])
+            touched.add(row["batch_id"])
+        return touched
+
+    def refresh(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Apply changes since the last load/refresh. Returns how many batch numbers were invalidated."""
+        owned = conn is None
+        conn = conn or get_connection_to_db(self.db_path)
+        try:
+            with self.lock:
+                numbers = self._read_batches(conn) | self._read_batch_changes(conn)
+                touched = self._read_anomalies(conn) | self._read_flags(conn)
+                for batch_id in touched:
+                    batch = self.batches.get(batch_id)
+                    if batch is not None:
+                        numbers.add(normalize(batch["batch_number"]))
+
+                for number in numbers:
+                    self.entries.pop(number, None)
+                return len(numbers)
+        finally:
+            if owned:
+                conn.close()
+
+    def _entry(self, number: str) -> Dict:
+        entry = self.entries.get(number)
+        if entry is not None:
+            return entry
+        with self.lock:
+            entry = self._build_entry(number)
+            # only registered numbers are cached: any string can be asked about
+            if entry["batches"]:
+                self.entries[number] = entry
+        return entry
+
+    def _build_entry(self, number: str) -> Dict:
+        batch_ids = self.by_number.get(number, [])
+        batches = []
+        for batch_id in batch_ids:
+            batch = self.batches[batch_id]
+            anomalies = sorted(self.anomalies.get(batch_id, {}).items())
+            batches.append(
+                {
+                    "batch_id": batch_id,
+                    "brand_name": batch["brand_name"],
+                    "generic_name": batch["generic_name"],
+                    "manufacturer_name": batch["manufacturer_name"],
+                    "expiry_date": batch["expiry_date"],
+                    "nrn": self.nrn_by_med.get(batch["med_id"], ""),
+                    "is_flagged": batch_id in self.flagged,
+                    "active_anomalies": len(anomalies),
+                    "anomalies": [
+                        {"anomaly_id": anomaly_id, "anomaly_type": anomaly_type, "severity": severity}
+                        for anomaly_id, (anomaly_type, severity) in anomalies[:MAX_ANOMALIES_PER_BATCH]
+                    ],
+                }
+            )
+
+        severities = {
+            severity for batch_id in batch_ids for _, severity in self.anomalies.get(batch_id, {}).values()
+        }
+        lookalikes = [] if batch_ids else sorted(self.by_skeleton.get(skeleton(number), ()))
+
+        reasons = []
+        if any(b["is_flagged"] for b in batches):
+            reasons.append("FLAGGED_BATCH")
+        if "CRITICAL" in severities:
+            reasons.append("CRITICAL_ANOMALY")
+        if len(batch_ids) > 1:
+            reasons.append("DUPLICATE_BATCH_NUMBER")
+        if lookalikes:
+            reasons.append("LOOKALIKE_BATCH_NUMBER")
+
+        if reasons:
+            status = "SUSPECT"
+        elif severities:
+            status = "WARNING"
+            reasons.append("ACTIVE_ANOMALY")
+        else:
+            status = "VERIFIED" if batch_ids else "UNKNOWN"
+
+        return {
+            "status": status,
+            "reasons": reasons,
+            "batches": batches,
+            "lookalike_of": lookalikes,
+            "nrns": {b["nrn"] for b in batches},
+        }
+
+    def verify(self, batch_number: str, nrn: Optional[str] = None) -> Dict:
+        number = normalize(batch_number)
+        entry = self._entry(number)
+
+        status, reasons = entry["status"], entry["reasons"]
+        nrn = normalize(nrn)
+        if nrn and entry["batches"] and nrn not in entry["nrns"]:
+            status, reasons = "SUSPECT", reasons + ["NRN_MISMATCH"]
+
+        return {
+            "batch_number": number,
+            "nrn": nrn or None,
+            "status": status,
+            "reasons": reasons,
+            "batches": entry["batches"],
+            "lookalike_of": entry["lookalike_of"],
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "batches": len(self.batches),
+            "batch_numbers": len(self.by_number),
+            "flagged": len(self.flagged),
+            "batches_with_anomalies": sum(1 for active in self.anomalies.values() if active),
+            "cached_entries": len(self.entries),
+        }